@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+    Microbenchmarks for the hot functions of migrate_data_2024.py and update_gencc.py.
+
+    Each benchmark runs on synthetic inputs at different scales (default: 1x, 10x and 100x
+    the base size). The base sizes are close to the current production data.
+    The results can be saved as a baseline (JSON) and later runs can be compared against it:
+    the script exits with error if any benchmark is slower than the baseline by more than
+    the regression threshold. With --memory the peak memory (tracemalloc) of each benchmark
+    is also reported.
+
+    The inputs are generated from a fixed seed, the same scale always runs on the same data.
+    The dump_gfd_set_decoding benchmark first checks that the SET columns are decoded to the same
+    values with different hash seeds (1x scale).
+    The gencc_arrow_engine benchmark (only when pyarrow is installed) first checks that the
+    arrow engine of update_gencc.py returns the same lines as the row engine.
+
+    Usage:
+        python benchmark_hot_functions.py --save_baseline baseline.json
+        python benchmark_hot_functions.py --baseline baseline.json --threshold 0.2
+        python benchmark_hot_functions.py --benchmarks convert_txt_to_excel gencc_submission_writer --scales 1,10 --memory
+"""
+
+import io
+import os
+import sys
+import csv
+import gzip
+import json
+import time
+import random
+import string
+import argparse
+import tempfile
+import subprocess
+import statistics
+import tracemalloc
+import contextlib
+from datetime import datetime, timedelta
+
+import migrate_data_2024
+import update_gencc
+
+benchmarks = {}
+
+def benchmark(name, base_size):
+    """
+        Registers a benchmark.
+        The decorated function receives the input size and returns a function to time.
+    """
+    def register(setup):
+        benchmarks[name] = { 'setup':setup, 'base_size':base_size }
+        return setup
+    return register
+
+def random_word(rnd, min_len=3, max_len=12):
+    return "".join(rnd.choice(string.ascii_lowercase) for _ in range(rnd.randint(min_len, max_len)))
+
+def random_gene(rnd):
+    return "".join(rnd.choice(string.ascii_uppercase) for _ in range(rnd.randint(3, 5))) + str(rnd.randint(1, 20))
+
+def random_disease_name(rnd, gene=None):
+    words = [random_word(rnd) for _ in range(rnd.randint(2, 8))]
+    # Some of the patterns cleaned by clean_up_disease_name()
+    if rnd.random() < 0.3:
+        words.append(rnd.choice(["syndrome", "syndrom", "type 1", "and", "or", "(disorder)"]))
+    name = " ".join(words)
+    if rnd.random() < 0.2:
+        name = "?" + name + "."
+    if rnd.random() < 0.3:
+        name = name.replace(" ", ", ", 1)
+    if gene and rnd.random() < 0.4:
+        name = f"{gene}-related {name}"
+    return name
+
+def random_title(rnd):
+    words = [random_word(rnd) for _ in range(rnd.randint(8, 25))]
+    if rnd.random() < 0.3:
+        words[0] = f"<i>{words[0]}</i>"
+    if rnd.random() < 0.1:
+        words[-1] = words[-1] + "Ã©"
+    return " ".join(words)
+
+def old_attribs():
+    """
+        Attribs with the same structure returned by migrate_data_2024.fetch_attribs()
+    """
+    attribs = {}
+    for attrib_id in range(54, 132):
+        attribs[attrib_id] = { 'attrib_value':f"attrib_{attrib_id}",
+                               'attrib_type_code':'code',
+                               'attrib_type_name':'name',
+                               'attrib_type_description':'description' }
+    return attribs
+
+def gencc_rows(rnd, size):
+    """
+        Rows with the same structure as the G2P download files (csv.DictReader)
+    """
+    ar_values = list(update_gencc.allelic_requirement.keys()) + ["biallelic_autosomal;monoallelic_autosomal"]
+    mc_values = ["absent gene product", "altered gene product structure", "decreased gene product level",
+                 "increased gene product level", "uncertain"]
+    rows = []
+    for i in range(size):
+        gene = random_gene(rnd)
+        rows.append({ "gene symbol":gene,
+                      "disease name":random_disease_name(rnd, gene),
+                      "allelic requirement":rnd.choice(ar_values),
+                      "mutation consequence":";".join(rnd.sample(mc_values, rnd.randint(1, 3))),
+                      "hgnc id":str(rnd.randint(1, 50000)),
+                      "confidence category":rnd.choice(list(update_gencc.confidence_category.keys())),
+                      "disease mim":rnd.choice(["No disease mim", str(rnd.randint(100000, 699999))]),
+                      "disease ontology":rnd.choice(["", f"MONDO:{rnd.randint(1, 999999):07}"]),
+                      "pmids":";".join(str(rnd.randint(1000000, 39999999)) for _ in range(rnd.randint(0, 6))),
+                      "gene disease pair entry date":rnd.choice(["", "2019-07-22 16:14:07", "2023-11-02 09:01:55"]) })
+    return rows
+
+@benchmark("clean_up_disease_name", 5000)
+def bench_clean_up_disease_name(size):
+    rnd = random.Random(size)
+    names = [random_disease_name(rnd, random_gene(rnd)) for _ in range(size)]
+
+    def run():
+        for name in names:
+            migrate_data_2024.clean_up_disease_name(name)
+    return run
+
+@benchmark("format_disease_name", 5000)
+def bench_format_disease_name(size):
+    rnd = random.Random(size)
+    data = []
+    for _ in range(size):
+        genes = [random_gene(rnd) for _ in range(rnd.choice([1, 1, 1, 2, 3]))]
+        data.append((random_disease_name(rnd, genes[0]), genes))
+
+    def run():
+        for name, genes in data:
+            migrate_data_2024.format_disease_name(name, genes)
+    return run
+
+@benchmark("clean_title", 10000)
+def bench_clean_title(size):
+    rnd = random.Random(size)
+    titles = [random_title(rnd) for _ in range(size)]
+
+    def run():
+        for title in titles:
+            migrate_data_2024.clean_title(title)
+    return run
+
+def decoded_set_attribs(size=1000):
+    """
+        Decodes SET columns with several values, as dump_gfd() (first_set_attrib for the allelic requirement)
+    """
+    rnd = random.Random(0)
+    attribs = old_attribs()
+    rows = [({str(i) for i in rnd.sample(range(59, 71), rnd.randint(1, 3))},
+             {str(i) for i in rnd.sample(range(75, 81), rnd.randint(1, 3))}) for _ in range(size)]
+
+    return [(migrate_data_2024.first_set_attrib(row[0], attribs), migrate_data_2024.decode_set_attrib(row[1], attribs)) for row in rows]
+
+def check_set_decoding_determinism(seeds=(1, 2, 3, 4)):
+    """
+        Checks that the SET columns are decoded to the same values with different hash seeds
+        (the SET values are python sets, their order changes with PYTHONHASHSEED)
+    """
+    code = "import json, benchmark_hot_functions; print(json.dumps(benchmark_hot_functions.decoded_set_attribs()))"
+    outputs = set()
+    for seed in seeds:
+        output = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                env=dict(os.environ, PYTHONHASHSEED=str(seed)), capture_output=True, text=True, check=True)
+        outputs.add(output.stdout)
+    if len(outputs) != 1:
+        sys.exit(f"dump_gfd_set_decoding: the SET columns are decoded to different values with the hash seeds {', '.join(map(str, seeds))}")
+
+@benchmark("dump_gfd_set_decoding", 3500)
+def bench_dump_gfd_set_decoding(size):
+    rnd = random.Random(size)
+    attribs = old_attribs()
+    if size == benchmarks['dump_gfd_set_decoding']['base_size']:
+        check_set_decoding_determinism()
+    rows = []
+    for _ in range(size):
+        rows.append(({str(rnd.randint(59, 70))},
+                     {str(i) for i in rnd.sample(range(54, 59), rnd.randint(0, 2))} or None,
+                     {str(i) for i in rnd.sample(range(75, 81), rnd.randint(1, 3))},
+                     {str(i) for i in rnd.sample(range(71, 75), rnd.randint(0, 2))} or None,
+                     {str(i) for i in rnd.sample(range(100, 132), rnd.randint(0, 4))} or None))
+
+    def run():
+        for row in rows:
+            migrate_data_2024.first_set_attrib(row[0], attribs)
+            migrate_data_2024.decode_set_attrib(row[1], attribs)
+            migrate_data_2024.decode_set_attrib(row[2], attribs)
+            migrate_data_2024.decode_set_attrib(row[3], attribs)
+            migrate_data_2024.decode_set_attrib(row[4], attribs)
+    return run
+
+@benchmark("fetch_g2p_records_set_decoding", 3500)
+def bench_fetch_g2p_records_set_decoding(size):
+    rnd = random.Random(size)
+    ar_attribs = {i:f"ar_{i}" for i in range(59, 71)}
+    mc_attribs = {i:f"mc_{i}" for i in range(75, 85)}
+    rows = []
+    for _ in range(size):
+        rows.append(({str(i) for i in rnd.sample(range(59, 71), rnd.randint(1, 2))},
+                     {str(i) for i in rnd.sample(range(75, 85), rnd.randint(1, 3))}))
+
+    def run():
+        for ar, mc in rows:
+            update_gencc.decode_attribs(ar, ar_attribs)
+            update_gencc.decode_attribs(mc, mc_attribs)
+    return run
+
+@benchmark("populates_history_timezone", 8000)
+def bench_populates_history_timezone(size):
+    rnd = random.Random(size)
+    start = datetime(2015, 1, 1)
+    dates = [start + timedelta(seconds=rnd.randint(0, 10 * 365 * 24 * 3600)) for _ in range(size)]
+
+    def run():
+        for date_value in dates:
+            migrate_data_2024.make_date_aware(date_value)
+    return run
+
+@benchmark("gencc_row_to_line", 4000)
+def bench_gencc_row_to_line(size):
+    rnd = random.Random(size)
+    rows = gencc_rows(rnd, size)
+
+    def run():
+        for i, row in enumerate(rows):
+            update_gencc.build_key(row)
+            if row["allelic requirement"] in update_gencc.allelic_requirement:
+                update_gencc.format_submission_line(row, i + 1)
+    return run
+
+@benchmark("convert_txt_to_excel", 2500)
+def bench_convert_txt_to_excel(size):
+    rnd = random.Random(size)
+    tmp_dir = tempfile.mkdtemp(prefix="g2p_benchmark_")
+    input_file = os.path.join(tmp_dir, "G2P_GenCC.txt")
+    output_file = os.path.join(tmp_dir, "G2P_GenCC.xlsx")
+
+    with open(input_file, "w") as output:
+        output.write(update_gencc.output_header)
+        for i, row in enumerate(gencc_rows(rnd, size)):
+            if row["allelic requirement"] in update_gencc.allelic_requirement:
+                output.write(update_gencc.format_submission_line(row, i + 1))
+
+    def run():
+        update_gencc.convert_txt_to_excel(input_file, output_file)
+    return run
+
+@benchmark("gencc_submission_writer", 2500)
+def bench_gencc_submission_writer(size):
+    rnd = random.Random(size)
+    tmp_dir = tempfile.mkdtemp(prefix="g2p_benchmark_")
+    txt_file = os.path.join(tmp_dir, "G2P_GenCC.txt")
+    excel_file = os.path.join(tmp_dir, "G2P_GenCC.xlsx")
+
+    lines = [update_gencc.submission_fields(row, i + 1) for i, row in enumerate(gencc_rows(rnd, size))
+             if row["allelic requirement"] in update_gencc.allelic_requirement]
+
+    header = update_gencc.output_header.rstrip("\n").split("\t")
+
+    def run():
+        with update_gencc.submission_writer(txt_file, excel_file, header) as write:
+            for fields in lines:
+                write(fields)
+    return run
+
+def write_download_file(file_path, rows):
+    """
+        Writes the rows as a G2P download file (gzipped csv)
+    """
+    with gzip.open(file_path, "wt", newline="") as output:
+        writer = csv.DictWriter(output, fieldnames=update_gencc.submission_columns)
+        writer.writeheader()
+        writer.writerows(rows)
+
+def check_gencc_arrow_engine(tmp_dir):
+    """
+        Checks that the arrow engine returns the same lines as the row engine on a download file
+        with new lines in the quoted disease names. The file is bigger than the blocks read by
+        pyarrow (1 MB), a new line in a value can be at the end of a block.
+    """
+    rows = gencc_rows(random.Random(0), 20000)
+    for row in rows:
+        row["disease name"] = row["disease name"].replace(" ", "\n", 1)
+    download_file = os.path.join(tmp_dir, "G2P_check.csv.gz")
+    write_download_file(download_file, rows)
+    all_g2p_records = { update_gencc.build_key(row):i + 1 for i, row in enumerate(rows) }
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        row_lines = list(update_gencc.submission_lines(update_gencc.read_download_files([download_file]), all_g2p_records))
+        arrow_lines = update_gencc.arrow_submission_lines([download_file], all_g2p_records)
+    if arrow_lines != row_lines:
+        sys.exit(f"gencc_arrow_engine: the arrow engine lines are not the same as the row engine lines ({len(arrow_lines)} and {len(row_lines)} lines)")
+
+def bench_gencc_arrow_engine(size):
+    """
+        Arrow engine on a download file, checked against the row engine first
+    """
+    rnd = random.Random(size)
+    tmp_dir = tempfile.mkdtemp(prefix="g2p_benchmark_")
+    check_gencc_arrow_engine(tmp_dir)
+
+    rows = gencc_rows(rnd, size)
+    download_file = os.path.join(tmp_dir, "G2P_download.csv.gz")
+    write_download_file(download_file, rows)
+    all_g2p_records = { update_gencc.build_key(row):i + 1 for i, row in enumerate(rows) }
+
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            update_gencc.arrow_submission_lines([download_file], all_g2p_records)
+    return run
+
+# The arrow engine needs pyarrow (optional)
+if update_gencc.arrow_available():
+    benchmark("gencc_arrow_engine", 2500)(bench_gencc_arrow_engine)
+
+def time_function(function, repeat):
+    """
+        Runs the function 'repeat' times and returns the min and median run time (seconds)
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+
+    return min(timings), statistics.median(timings)
+
+def peak_memory(function):
+    """
+        Runs the function once and returns the peak memory allocated (bytes, tracemalloc)
+    """
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def run_benchmarks(names, scales, repeat, memory=False):
+    """
+        Returns the results of the benchmarks.
+        Output: dict key = "<benchmark>@<scale>x"; value = { size, min, median, items_per_second[, peak_memory] }
+        With memory, each benchmark runs once more with tracemalloc (not timed) to get the peak memory.
+    """
+    results = {}
+
+    for name in names:
+        for scale in scales:
+            size = benchmarks[name]['base_size'] * scale
+            function = benchmarks[name]['setup'](size)
+            # Big inputs run less times
+            n_repeat = max(1, repeat // scale) if scale > 1 else repeat
+            min_time, median_time = time_function(function, n_repeat)
+            results[f"{name}@{scale}x"] = { 'size':size,
+                                            'min':min_time,
+                                            'median':median_time,
+                                            'items_per_second':size / min_time if min_time > 0 else 0 }
+            line = f"{name + '@' + str(scale) + 'x':<40} {size:>10} items  min {min_time * 1000:>10.2f} ms  median {median_time * 1000:>10.2f} ms"
+            line += f"  {results[f'{name}@{scale}x']['items_per_second']:>12.0f} items/s"
+            if memory:
+                results[f"{name}@{scale}x"]['peak_memory'] = peak_memory(function)
+                line += f"  peak {results[f'{name}@{scale}x']['peak_memory'] / 1024 / 1024:>8.1f} MB"
+            print(line)
+
+    return results
+
+def compare_baseline(results, baseline, threshold):
+    """
+        Compares the min run time of each benchmark with the baseline.
+        Returns the list of regressions.
+    """
+    regressions = []
+
+    print(f"\n### Comparison with baseline (threshold: {threshold:.0%}) ###")
+    for key, result in results.items():
+        if key not in baseline:
+            print(f"{key:<40} no baseline")
+            continue
+        change = (result['min'] - baseline[key]['min']) / baseline[key]['min']
+        status = "OK"
+        if change > threshold:
+            status = "REGRESSION"
+            regressions.append(key)
+        print(f"{key:<40} {change:>+8.1%}  {status}")
+
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks for the migration and GenCC hot functions")
+    parser.add_argument("--benchmarks", nargs='+', default=list(benchmarks.keys()),
+                        choices=list(benchmarks.keys()), help="Benchmarks to run (default: all)")
+    parser.add_argument("--scales", default="1,10,100", help="Input scales (default: 1,10,100)")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of runs at scale 1x (default: 5)")
+    parser.add_argument("--memory", action="store_true", help="Report the peak memory of each benchmark (tracemalloc)")
+    parser.add_argument("--save_baseline", default=None, help="Save the results to this JSON file")
+    parser.add_argument("--baseline", default=None, help="Compare the results with this JSON file")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Regression threshold (default: 0.2 = 20%% slower)")
+
+    args = parser.parse_args()
+
+    scales = [int(scale) for scale in args.scales.split(",")]
+    results = run_benchmarks(args.benchmarks, scales, args.repeat, args.memory)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+        print(f"\nBaseline saved to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_baseline(results, baseline, args.threshold)
+        if regressions:
+            sys.exit(f"\nERROR: {len(regressions)} benchmarks are slower than the baseline: {', '.join(regressions)}")
+
+if __name__ == '__main__':
+    main()
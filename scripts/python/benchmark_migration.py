@@ -0,0 +1,431 @@
+#!/usr/bin/env python3
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+    End-to-end benchmark of migrate_data_2024.py.
+
+    Loads the test-genome-DBs gene2phenotype fixtures into a local MySQL/MariaDB server
+    (old schema), creates an empty database with the new schema and a small Ensembl core
+    database built from the fixture genes. The external APIs (OLS, OMIM, EuropePMC) are
+    served by a local HTTP stub so that the run does not depend on the network, or
+    replayed from a cassette recorded with http_cassette.py (--cassette).
+    With --db_backend sqlite the databases are created in memory and no server is needed.
+    Each run reloads the databases and runs the full migration. The report has the time
+    of each stage of the migration and the total run time.
+
+    The new schema is created by the G2P Django app, its SQL dump has to be provided
+    with --new_schema.
+
+    Usage:
+        python benchmark_migration.py --host 127.0.0.1 --port 3306 --user root --password ''
+                                      --new_schema g2p_new_schema.sql --runs 3 --output report.json
+"""
+
+import os
+import sys
+import re
+import json
+import time
+import argparse
+import threading
+import statistics
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import requests
+from openpyxl import Workbook
+
+import db_backend
+import fixture_tsv
+import http_cassette
+from db_backend import Error
+import migrate_data_2024
+
+default_fixtures = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..",
+                                "modules", "t", "test-genome-DBs", "homo_sapiens", "gene2phenotype")
+
+gencc_submission_base = "1000112"
+
+core_tables = [
+    """ CREATE TABLE seq_region (
+            seq_region_id int(10) unsigned NOT NULL AUTO_INCREMENT,
+            name varchar(255) NOT NULL,
+            coord_system_id int(10) unsigned NOT NULL,
+            length int(10) unsigned NOT NULL,
+            PRIMARY KEY (seq_region_id)
+        ) """,
+    """ CREATE TABLE meta (
+            meta_id int(10) NOT NULL AUTO_INCREMENT,
+            species_id int(10) unsigned DEFAULT '1',
+            meta_key varchar(40) NOT NULL,
+            meta_value varchar(255) NOT NULL,
+            PRIMARY KEY (meta_id)
+        ) """,
+    """ CREATE TABLE gene (
+            gene_id int(10) unsigned NOT NULL AUTO_INCREMENT,
+            biotype varchar(40) NOT NULL,
+            seq_region_id int(10) unsigned NOT NULL,
+            seq_region_start int(10) unsigned NOT NULL,
+            seq_region_end int(10) unsigned NOT NULL,
+            seq_region_strand tinyint(2) NOT NULL,
+            display_xref_id int(10) unsigned DEFAULT NULL,
+            source varchar(40) NOT NULL,
+            description text,
+            stable_id varchar(128) DEFAULT NULL,
+            PRIMARY KEY (gene_id)
+        ) """,
+    """ CREATE TABLE gene_attrib (
+            gene_id int(10) unsigned NOT NULL DEFAULT '0',
+            attrib_type_id smallint(5) unsigned NOT NULL DEFAULT '0',
+            value text NOT NULL,
+            KEY gene_idx (gene_id)
+        ) """,
+    """ CREATE TABLE external_synonym (
+            xref_id int(10) unsigned NOT NULL,
+            synonym varchar(100) NOT NULL,
+            PRIMARY KEY (xref_id, synonym)
+        ) """
+]
+
+def split_sql(sql_file):
+    """
+        Returns the list of statements of a SQL file
+    """
+    with open(sql_file, encoding="utf-8") as fh:
+        return db_backend.split_sql(fh.read())
+
+def create_database(host, port, user, password, db, statements):
+    """
+        Creates an empty database and runs the schema statements.
+        Returns the connection to the new database.
+    """
+    if db_backend.backend() == "sqlite":
+        db_backend.drop_database(db)
+        connection = db_backend.connect(host=host, database=db, user=user, port=port, password=password)
+        cursor = connection.cursor()
+        for statement in statements:
+            for sqlite_statement in db_backend.translate_ddl(statement):
+                cursor.execute(sqlite_statement)
+    else:
+        connection = db_backend.connect(host=host, user=user, port=port, password=password)
+        cursor = connection.cursor()
+        cursor.execute(f"DROP DATABASE IF EXISTS `{db}`")
+        cursor.execute(f"CREATE DATABASE `{db}`")
+        cursor.execute(f"USE `{db}`")
+        cursor.execute("SET foreign_key_checks = 0")
+        for statement in statements:
+            cursor.execute(statement)
+
+    cursor.close()
+    connection.commit()
+
+    return connection
+
+def load_old_database(host, port, user, password, db, fixtures_dir, batch_size=1000):
+    """
+        Creates the old schema (table.sql) and loads the fixtures
+        Returns the number of rows loaded
+    """
+    n_rows = 0
+
+    statements = split_sql(os.path.join(fixtures_dir, "table.sql"))
+    tables = [re.search(r"CREATE\s+TABLE\s+`?(\w+)`?", statement, re.I).group(1)
+              for statement in statements if re.match(r"CREATE\s+TABLE", statement, re.I)]
+
+    connection = create_database(host, port, user, password, db, statements)
+
+    try:
+        if connection.is_connected():
+            cursor = connection.cursor()
+            for table in tables:
+                rows = fixture_tsv.read_fixture(fixtures_dir, table)
+                if not rows:
+                    continue
+                placeholders = ", ".join(["%s"] * len(rows[0]))
+                sql_insert = f"INSERT INTO `{table}` VALUES ({placeholders})"
+                for i in range(0, len(rows), batch_size):
+                    cursor.executemany(sql_insert, rows[i:i + batch_size])
+                n_rows += len(rows)
+
+            connection.commit()
+
+    except Error as e:
+        print("Error while connecting to MySQL", e)
+    finally:
+        if connection.is_connected():
+            cursor.close()
+            connection.close()
+
+    return n_rows
+
+def load_new_database(host, port, user, password, db, schema_file):
+    """
+        Creates an empty database with the new schema
+    """
+    connection = create_database(host, port, user, password, db, split_sql(schema_file))
+    connection.close()
+
+def load_core_database(host, port, user, password, db, fixtures_dir):
+    """
+        Creates a minimal Ensembl core database with the genes from the fixtures.
+        The old schema does not store the gene coordinates, they are generated from the gene id.
+    """
+    genes = fixture_tsv.read_fixture(fixtures_dir, "genomic_feature")
+    synonyms = {}
+    for gf_id, name in fixture_tsv.read_fixture(fixtures_dir, "genomic_feature_synonym"):
+        synonyms.setdefault(gf_id, []).append(name)
+
+    chromosomes = [str(i) for i in range(1, 23)] + ["X", "Y", "MT"]
+
+    connection = create_database(host, port, user, password, db, core_tables)
+
+    try:
+        if connection.is_connected():
+            cursor = connection.cursor()
+            release = re.search("[0-9]+", db).group()
+            cursor.executemany("INSERT INTO meta (species_id, meta_key, meta_value) VALUES (%s, %s, %s)",
+                               [(None, "schema_version", release), (1, "species.production_name", "homo_sapiens"),
+                                (1, "assembly.default", "GRCh38"), (1, "genebuild.last_geneset_update", f"{release}-01")])
+            cursor.executemany("INSERT INTO seq_region (seq_region_id, name, coord_system_id, length) VALUES (%s, %s, %s, %s)",
+                               [(i + 1, name, 4, 250000000) for i, name in enumerate(chromosomes)])
+
+            gene_rows = []
+            attrib_rows = []
+            synonym_rows = []
+            for row in genes:
+                gf_id, symbol, stable_id = int(row[0]), row[1], row[5]
+                if stable_id is None:
+                    continue
+                start = 1000 + gf_id * 10000
+                gene_rows.append((gf_id, "protein_coding", gf_id % len(chromosomes) + 1, start, start + 5000,
+                                  1 if gf_id % 2 else -1, gf_id, "ensembl_havana", f"{symbol} gene", stable_id))
+                attrib_rows.append((gf_id, 4, symbol))
+                for synonym in synonyms.get(row[0], []):
+                    synonym_rows.append((gf_id, synonym))
+
+            cursor.executemany(""" INSERT INTO gene (gene_id, biotype, seq_region_id, seq_region_start, seq_region_end,
+                                   seq_region_strand, display_xref_id, source, description, stable_id)
+                                   VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s) """, gene_rows)
+            cursor.executemany("INSERT INTO gene_attrib (gene_id, attrib_type_id, value) VALUES (%s, %s, %s)", attrib_rows)
+            cursor.executemany("INSERT IGNORE INTO external_synonym (xref_id, synonym) VALUES (%s, %s)", synonym_rows)
+            connection.commit()
+
+    except Error as e:
+        print("Error while connecting to MySQL", e)
+    finally:
+        if connection.is_connected():
+            cursor.close()
+            connection.close()
+
+def write_gencc_file(fixtures_dir, output_file):
+    """
+        Writes a GenCC submission file (xlsx) with one submission per G2P record
+    """
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(["submission_id", "public_report_url"])
+    for row in fixture_tsv.read_fixture(fixtures_dir, "genomic_feature_disease"):
+        sheet.append([f"{gencc_submission_base}{int(row[0]):06}",
+                      f"https://www.ebi.ac.uk/gene2phenotype/gfd?dbID={row[0]}"])
+    workbook.save(output_file)
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+        Returns minimal responses for the OLS, OMIM and EuropePMC endpoints used by the migration
+    """
+    latency = 0
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+
+        if url.path.startswith("/ols4/api/search"):
+            term = query.get("q", [""])[0]
+            body = { "response": { "docs": [ { "label": f"disease {term}",
+                                               "description": [f"Description of {term}"] } ] } }
+        elif url.path.startswith("/api/entry"):
+            mim = query.get("mimNumber", [""])[0]
+            body = { "omim": { "entryList": [ { "entry": { "titles": { "preferredTitle": f"DISEASE {mim}; D{mim}",
+                                                                        "alternativeTitles": f"OTHER DISEASE {mim}" } } } ] } }
+        elif url.path.startswith("/europepmc/"):
+            pmid = url.path.rstrip("/").split("/")[-1]
+            body = { "result": { "authorString": "Smith J, Jones A.",
+                                 "pubYear": "2020",
+                                 "doi": f"10.1000/{pmid}" } }
+        else:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_stub_server(latency):
+    StubHandler.latency = latency
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    return server
+
+class RedirectedRequests:
+    """
+        Replaces the 'requests' module in migrate_data_2024: the calls to the external APIs go to the local stub
+    """
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.session = requests.Session()
+        self.calls = 0
+
+    def get(self, url, **kwargs):
+        self.calls += 1
+        for prefix in ("https://www.ebi.ac.uk", "https://api.omim.org"):
+            if url.startswith(prefix):
+                url = self.base_url + url[len(prefix):]
+                break
+        return self.session.get(url, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(requests, name)
+
+def run_migration(args, gencc_file, stub):
+    """
+        Runs migrate_data_2024.main() and returns the run time of each stage.
+        The API calls go to the stub, or to the cassette if there is no stub.
+    """
+    sys.argv = [ "migrate_data_2024.py",
+                 "--host", args.host, "--port", str(args.port), "--database", args.old_database,
+                 "--user", args.user, "--password", args.password,
+                 "--new_host", args.host, "--new_port", str(args.port), "--new_database", args.new_database,
+                 "--new_user", args.user, "--new_password", args.password,
+                 "--ensembl_host", args.host, "--ensembl_port", str(args.port), "--ensembl_database", args.core_database,
+                 "--ensembl_user", args.user, "--ensembl_password", args.password,
+                 "--omim_key", "benchmark",
+                 "--gencc_file", gencc_file,
+                 "--db_backend", args.db_backend,
+                 "--ensembl_fetch", args.ensembl_fetch ]
+    if args.ensembl_cache_dir:
+        sys.argv += [ "--ensembl_cache_dir", args.ensembl_cache_dir ]
+    if args.fast_load:
+        sys.argv += [ "--fast_load" ]
+    if args.cassette:
+        sys.argv += [ "--http_cassette", args.cassette, "--http_mode", args.cassette_mode,
+                      "--http_latency", str(args.latency), "--http_error_rate", str(args.error_rate) ]
+
+    migrate_data_2024.stage_timings.clear()
+    migrate_data_2024.requests = stub if stub else requests
+    migrate_data_2024.main()
+
+    return dict(migrate_data_2024.stage_timings)
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of the migration to the new G2P schema")
+    parser.add_argument("--host", default="127.0.0.1", help="Database host (default: 127.0.0.1)")
+    parser.add_argument("--port", default="3306", help="Host port (default: 3306)")
+    parser.add_argument("--user", default='', help="Username, needs to create databases (default: '')")
+    parser.add_argument("--password", default='', help="Password (default: '')")
+    parser.add_argument("--old_database", default="g2p_bench_old", help="Old schema database name (default: g2p_bench_old)")
+    parser.add_argument("--new_database", default="g2p_bench_new", help="New schema database name (default: g2p_bench_new)")
+    parser.add_argument("--core_database", default="g2p_bench_core_110", help="Ensembl core database name, must include the release number (default: g2p_bench_core_110)")
+    parser.add_argument("--new_schema", required=True, help="SQL file with the new schema")
+    parser.add_argument("--fixtures", default=default_fixtures, help="Directory with table.sql and the old schema data")
+    parser.add_argument("--runs", type=int, default=1, help="Number of runs (default: 1)")
+    parser.add_argument("--latency", type=float, default=0, help="Latency of the API stub or the cassette replay in seconds (default: 0)")
+    parser.add_argument("--cassette", default=None, help="Replay the API responses from this cassette (http_cassette.py) instead of the stub")
+    parser.add_argument("--cassette_mode", default="replay", choices=["record", "replay"], help="record: call the live APIs and save the responses to --cassette (default: replay)")
+    parser.add_argument("--error_rate", type=float, default=0, help="Cassette replay: fraction of requests that fail with HTTP 503 (default: 0)")
+    parser.add_argument("--output", default=None, help="JSON file to write the report")
+    parser.add_argument("--db_backend", default="mysql", choices=db_backend.backends, help="Database backend, sqlite runs in memory without a server (default: mysql)")
+    parser.add_argument("--ensembl_fetch", default="in_list", choices=["all", "in_list", "temp_table"], help="How the migration selects the genes in the core db (default: in_list)")
+    parser.add_argument("--ensembl_cache_dir", default=None, help="Directory of the migration's Ensembl core cache (default: no cache)")
+    parser.add_argument("--fast_load", action="store_true", help="Run the migration with --fast_load")
+
+    args = parser.parse_args()
+
+    db_backend.configure(args.db_backend)
+
+    if not os.path.isfile(os.path.join(args.fixtures, "table.sql")):
+        sys.exit(f"ERROR: {args.fixtures}/table.sql not found")
+    if not os.path.isfile(args.new_schema):
+        sys.exit(f"ERROR: {args.new_schema} not found")
+
+    server = None
+    stub = None
+    cassette = None
+    if args.cassette:
+        # migrate_data_2024.main() gets the same adapter
+        cassette = http_cassette.install(args.cassette, args.cassette_mode, args.latency, args.error_rate)
+    else:
+        server = start_stub_server(args.latency)
+        stub = RedirectedRequests(f"http://127.0.0.1:{server.server_address[1]}")
+    gencc_file = os.path.abspath(f"{args.new_database}_gencc.xlsx")
+    write_gencc_file(args.fixtures, gencc_file)
+
+    runs = []
+    for run in range(args.runs):
+        print(f"INFO: Run {run + 1}/{args.runs}: loading databases...")
+        # dump_diseases() deletes data from the old database, it has to be reloaded before each run
+        start = time.perf_counter()
+        n_rows = load_old_database(args.host, args.port, args.user, args.password, args.old_database, args.fixtures)
+        load_new_database(args.host, args.port, args.user, args.password, args.new_database, args.new_schema)
+        load_core_database(args.host, args.port, args.user, args.password, args.core_database, args.fixtures)
+        load_time = time.perf_counter() - start
+        print(f"INFO: Run {run + 1}/{args.runs}: {n_rows} rows loaded in {load_time:.2f} s")
+
+        if stub:
+            stub.calls = 0
+        else:
+            cassette.counts = { key:0 for key in cassette.counts }
+        start = time.perf_counter()
+        stages = run_migration(args, gencc_file, stub)
+        total = time.perf_counter() - start
+        runs.append({ 'load_time':load_time,
+                      'total':total,
+                      'api_calls':stub.calls if stub else cassette.counts['requests'],
+                      'stages':stages })
+
+    if server:
+        server.shutdown()
+    os.remove(gencc_file)
+
+    stage_names = list(runs[0]['stages'].keys())
+    report = { 'fixtures':os.path.abspath(args.fixtures),
+               'runs':runs,
+               'median':{ 'load_time':statistics.median(r['load_time'] for r in runs),
+                          'total':statistics.median(r['total'] for r in runs),
+                          'stages':{ name:statistics.median(r['stages'].get(name, 0) for r in runs) for name in stage_names } } }
+
+    print("\n### Migration benchmark (median of runs) ###")
+    for name in stage_names:
+        print(f"{name:<35} {report['median']['stages'][name]:>10.3f} s")
+    print(f"{'total':<35} {report['median']['total']:>10.3f} s")
+    print(f"{'load fixtures':<35} {report['median']['load_time']:>10.3f} s")
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+        print(f"\nReport saved to {args.output}")
+
+if __name__ == '__main__':
+    main()
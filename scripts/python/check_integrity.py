@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+    Referential integrity check of the G2P databases.
+
+    Each relationship (table.column -> referenced table.column) is checked with one
+    anti-join query, the relationships are checked concurrently (one connection per thread).
+    The report has the number of orphan rows of each relationship and a few orphan values.
+
+    Relationships:
+      - old schema: sql/foreign_keys.sql
+      - new schema: the relationships written by the migration (LGD and children tables,
+        history tables, locus, ...) and the foreign keys declared in the database
+
+    Usage:
+        python check_integrity.py --host ... --port ... --database ... --user ... --password ... --schema new
+        python check_integrity.py --host ... --port ... --database ... --user ... --password ... --schema old --foreign_keys ../../sql/foreign_keys.sql
+
+        import check_integrity
+        results = check_integrity.scan_relationships(host, port, db, user, password, check_integrity.new_schema_relationships)
+"""
+
+import os
+import re
+import sys
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import db_backend
+from db_backend import Error
+
+default_foreign_keys = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "sql", "foreign_keys.sql")
+
+# Relationships of the new schema written by the migration (migrate_data_2024.py)
+# (table, column, referenced table, referenced column)
+new_schema_relationships = [
+    ("attrib", "type_id", "attrib_type", "id"),
+    ("user_panel", "user_id", "user", "id"),
+    ("user_panel", "panel_id", "panel", "id"),
+    ("disease_ontology_term", "disease_id", "disease", "id"),
+    ("disease_ontology_term", "ontology_term_id", "ontology_term", "id"),
+    ("disease_synonym", "disease_id", "disease", "id"),
+    ("locus", "sequence_id", "sequence", "id"),
+    ("locus", "type_id", "attrib", "id"),
+    ("locus_identifier", "locus_id", "locus", "id"),
+    ("locus_identifier", "source_id", "source", "id"),
+    ("locus_attrib", "locus_id", "locus", "id"),
+    ("locus_attrib", "source_id", "source", "id"),
+    ("locus_genotype_disease", "stable_id", "g2p_stableid", "id"),
+    ("locus_genotype_disease", "locus_id", "locus", "id"),
+    ("locus_genotype_disease", "disease_id", "disease", "id"),
+    ("locus_genotype_disease", "genotype_id", "attrib", "id"),
+    ("locus_genotype_disease", "confidence_id", "attrib", "id"),
+    ("locus_genotype_disease", "mechanism_id", "cv_molecular_mechanism", "id"),
+    ("locus_genotype_disease", "mechanism_support_id", "cv_molecular_mechanism", "id"),
+    ("lgd_panel", "lgd_id", "locus_genotype_disease", "id"),
+    ("lgd_panel", "panel_id", "panel", "id"),
+    ("lgd_panel", "relevance_id", "attrib", "id"),
+    ("lgd_comment", "lgd_id", "locus_genotype_disease", "id"),
+    ("lgd_comment", "user_id", "user", "id"),
+    ("lgd_cross_cutting_modifier", "lgd_id", "locus_genotype_disease", "id"),
+    ("lgd_cross_cutting_modifier", "ccm_id", "attrib", "id"),
+    ("lgd_publication", "lgd_id", "locus_genotype_disease", "id"),
+    ("lgd_publication", "publication_id", "publication", "id"),
+    ("lgd_variant_gencc_consequence", "lgd_id", "locus_genotype_disease", "id"),
+    ("lgd_variant_gencc_consequence", "variant_consequence_id", "ontology_term", "id"),
+    ("lgd_variant_gencc_consequence", "support_id", "attrib", "id"),
+    ("lgd_variant_type", "lgd_id", "locus_genotype_disease", "id"),
+    ("lgd_variant_type", "variant_type_ot_id", "ontology_term", "id"),
+    ("lgd_phenotype", "lgd_id", "locus_genotype_disease", "id"),
+    ("lgd_phenotype", "phenotype_id", "ontology_term", "id"),
+    ("lgd_mutation_consequence_flag", "lgd_id", "locus_genotype_disease", "id"),
+    ("lgd_mutation_consequence_flag", "mutation_consequence_flag_id", "attrib", "id"),
+    ("lgd_organ", "lgd_id", "locus_genotype_disease", "id"),
+    ("lgd_organ", "organ_id", "organ", "id"),
+    ("gene2phenotype_app_historicallocusgenotypedisease", "id", "locus_genotype_disease", "id"),
+    ("gene2phenotype_app_historicallocusgenotypedisease", "history_user_id", "user", "id"),
+    ("gene2phenotype_app_historicallgdpanel", "lgd_id", "locus_genotype_disease", "id"),
+    ("gene2phenotype_app_historicallgdpanel", "history_user_id", "user", "id"),
+    ("gene2phenotype_app_historicallgdphenotype", "lgd_id", "locus_genotype_disease", "id"),
+    ("gene2phenotype_app_historicallgdphenotype", "history_user_id", "user", "id"),
+    ("gencc_submission", "g2p_stable_id", "g2p_stableid", "id"),
+]
+
+def read_foreign_keys(fk_file):
+    """
+        Returns the relationships of a file with ALTER TABLE ... ADD FOREIGN KEY statements (sql/foreign_keys.sql)
+    """
+    with open(fk_file, encoding="utf-8") as fh:
+        content = fh.read()
+    content = re.sub(r"^\s*(#|--).*$", "", content, flags=re.M)
+
+    relationships = []
+    for statement in content.split(";"):
+        table = re.search(r"ALTER\s+TABLE\s+`?(\w+)`?", statement, re.I)
+        if not table:
+            continue
+        for column, ref_table, ref_column in re.findall(r"FOREIGN\s+KEY\s*\(`?(\w+)`?\)\s*REFERENCES\s+`?(\w+)`?\s*\(`?(\w+)`?\)", statement, re.I):
+            relationships.append((table.group(1), column, ref_table, ref_column))
+
+    return relationships
+
+def fetch_declared_foreign_keys(host, port, db, user, password):
+    """
+        Returns the foreign keys declared in the database
+    """
+    relationships = []
+
+    connection = db_backend.connect(host=host,
+                                    database=db,
+                                    user=user,
+                                    port=port,
+                                    password=password)
+
+    try:
+        if connection.is_connected():
+            cursor = connection.cursor()
+            relationships = db_backend.foreign_keys(cursor, db)
+
+    except Error as e:
+        print("Error while connecting to MySQL", e)
+    finally:
+        if connection.is_connected():
+            cursor.close()
+            connection.close()
+
+    return relationships
+
+def merge_relationships(*lists):
+    """
+        Returns the relationships of all the lists without duplicates (first list first)
+    """
+    result = []
+    for relationships in lists:
+        for relationship in relationships:
+            if relationship not in result:
+                result.append(relationship)
+
+    return result
+
+def check_relationship(host, port, db, user, password, relationship, max_samples=5):
+    """
+        Returns the number of rows of the table with a value not found in the referenced table,
+        and up to max_samples of these values
+    """
+    table, column, ref_table, ref_column = relationship
+    result = { 'relationship':relationship, 'orphans':0, 'samples':[], 'error':None, 'time':0 }
+
+    sql_anti_join = f""" FROM `{table}` c
+                         LEFT JOIN `{ref_table}` p ON p.`{ref_column}` = c.`{column}`
+                         WHERE c.`{column}` IS NOT NULL AND p.`{ref_column}` IS NULL """
+
+    start = time.perf_counter()
+
+    connection = db_backend.connect(host=host,
+                                    database=db,
+                                    user=user,
+                                    port=port,
+                                    password=password)
+
+    try:
+        if connection.is_connected():
+            cursor = connection.cursor()
+            cursor.execute(f"SELECT COUNT(*) {sql_anti_join}")
+            result['orphans'] = cursor.fetchone()[0]
+            if result['orphans'] and max_samples:
+                cursor.execute(f"SELECT DISTINCT c.`{column}` {sql_anti_join} ORDER BY c.`{column}` LIMIT {int(max_samples)}")
+                result['samples'] = [row[0] for row in cursor.fetchall()]
+
+    except Error as e:
+        result['error'] = str(e)
+    finally:
+        if connection.is_connected():
+            cursor.close()
+            connection.close()
+
+    result['time'] = time.perf_counter() - start
+
+    return result
+
+def scan_relationships(host, port, db, user, password, relationships, workers=8, max_samples=5):
+    """
+        Checks the relationships concurrently.
+        Returns the results in the order of the relationships.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(check_relationship, host, port, db, user, password, relationship, max_samples)
+                   for relationship in relationships]
+
+        return [future.result() for future in futures]
+
+def print_report(results, verbose=False):
+    """
+        Prints the relationships with orphans or errors (all the relationships if verbose).
+        Returns the total number of orphan rows and the number of relationships that could not be checked.
+    """
+    total = 0
+    for result in results:
+        table, column, ref_table, ref_column = result['relationship']
+        name = f"{table}.{column} -> {ref_table}.{ref_column}"
+        if result['error']:
+            print(f"ERROR: {name}: not checked ({result['error']})")
+        elif result['orphans']:
+            total += result['orphans']
+            samples = ", ".join(str(value) for value in result['samples'])
+            print(f"ERROR: {name}: {result['orphans']} orphan rows (e.g. {samples})")
+        elif verbose:
+            print(f"INFO: {name}: OK ({result['time']:.3f} s)")
+
+    unchecked = sum(1 for result in results if result['error'])
+    failed = sum(1 for result in results if result['orphans'])
+    print(f"INFO: {len(results) - unchecked} relationships checked, {failed} with orphan rows ({total} rows), {unchecked} not checked")
+
+    return total, unchecked
+
+def main():
+    parser = argparse.ArgumentParser(description="Checks the referential integrity of the G2P database (old or new schema)")
+    parser.add_argument("--host", required=True, help="Database host")
+    parser.add_argument("--port", required=True, help="Host port")
+    parser.add_argument("--database", required=True, help="Database name")
+    parser.add_argument("--user", required=True, help="Username")
+    parser.add_argument("--password", default='', help="Password (default: '')")
+    parser.add_argument("--schema", default="new", choices=["old", "new"], help="Schema of the database (default: new)")
+    parser.add_argument("--foreign_keys", default=default_foreign_keys, help="Old schema: file with the foreign keys (default: sql/foreign_keys.sql)")
+    parser.add_argument("--workers", type=int, default=8, help="Number of relationships checked at the same time (default: 8)")
+    parser.add_argument("--max_samples", type=int, default=5, help="Number of orphan values reported by relationship (default: 5)")
+    parser.add_argument("--verbose", action="store_true", help="Report all the relationships")
+    parser.add_argument("--db_backend", default="mysql", choices=db_backend.backends, help="Database backend (default: mysql)")
+    parser.add_argument("--sqlite_dir", default=None, help="Directory with the SQLite databases. Only used with --db_backend sqlite")
+
+    args = parser.parse_args()
+
+    db_backend.configure(args.db_backend, args.sqlite_dir)
+
+    if args.schema == "old":
+        relationships = read_foreign_keys(args.foreign_keys)
+    else:
+        relationships = merge_relationships(new_schema_relationships,
+                                            fetch_declared_foreign_keys(args.host, args.port, args.database, args.user, args.password))
+
+    start = time.perf_counter()
+    results = scan_relationships(args.host, args.port, args.database, args.user, args.password, relationships, args.workers, args.max_samples)
+    total, unchecked = print_report(results, args.verbose)
+    print(f"INFO: Integrity check done in {time.perf_counter() - start:.2f} s")
+
+    if total or unchecked:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
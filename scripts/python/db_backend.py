@@ -0,0 +1,443 @@
+#!/usr/bin/env python3
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+    Database backend used by the G2P python scripts.
+
+    The scripts open their connections with db_backend.connect(), which takes the same
+    arguments as mysql.connector.connect(). The default backend is MySQL.
+    The SQLite backend runs the same code in-process, without a server:
+      - each database name is a SQLite database, in memory (shared by all the connections
+        of the process) or a file <directory>/<database>.sqlite
+      - the statements keep the MySQL parameter style (%s), they are translated to the
+        SQLite style (?) when executed
+      - SET columns are returned as python sets and timestamps as datetime, like mysql-connector
+      - MySQL schemas (table.sql, mysqldump) are loaded with load_schema()
+
+    Usage:
+        import db_backend
+        db_backend.configure("sqlite")
+        db_backend.load_schema("g2p_old", "table.sql")
+        connection = db_backend.connect(host=host, database="g2p_old", user=user, port=port, password=password)
+"""
+
+import os
+import re
+import sqlite3
+from datetime import datetime
+import mysql.connector
+
+Error = (mysql.connector.Error, sqlite3.Error)
+
+backends = ["mysql", "sqlite"]
+
+_backend = "mysql"
+_sqlite_directory = None
+_keepers = {} # key: database name; value: connection that keeps the in-memory database alive
+_session_statements = {} # key: database name; value: statements run on each new connection
+_pools = {} # key: database name; value: size of the pool of connections (MySQL)
+
+def configure(backend, sqlite_directory=None):
+    """
+        Selects the backend used by connect().
+        For SQLite the databases are stored in memory, unless a directory is given.
+    """
+    global _backend, _sqlite_directory
+
+    if backend not in backends:
+        raise ValueError(f"Unknown database backend '{backend}', use one of: {', '.join(backends)}")
+
+    _backend = backend
+    _sqlite_directory = sqlite_directory
+
+def backend():
+    return _backend
+
+def connect(host=None, database=None, user=None, port=None, password=None, **kwargs):
+    """
+        Opens a connection with the selected backend.
+        The SQLite backend ignores the host, port, user and password.
+    """
+    if _backend == "mysql":
+        if database in _pools:
+            kwargs = dict(kwargs, pool_name=f"g2p_{database}"[:64], pool_size=_pools[database])
+        connection = mysql.connector.connect(host=host, database=database, user=user, port=port, password=password, **kwargs)
+    else:
+        connection = SQLiteConnection(_sqlite_connect(database))
+
+    if database in _session_statements:
+        cursor = connection.cursor()
+        for statement in _session_statements[database]:
+            cursor.execute(statement)
+        cursor.close()
+
+    return connection
+
+def set_bulk_load(database, enabled=True):
+    """
+        Bulk load of an empty database: the next connections to the database do not check
+        the foreign keys and the unique keys (MySQL), or the foreign keys and the disk syncs (SQLite).
+    """
+    if not enabled:
+        _session_statements.pop(database, None)
+    elif _backend == "mysql":
+        _session_statements[database] = ["SET SESSION foreign_key_checks = 0", "SET SESSION unique_checks = 0"]
+    else:
+        _session_statements[database] = ["PRAGMA foreign_keys = OFF", "PRAGMA synchronous = OFF"]
+
+def set_pool(database, size=2):
+    """
+        The connections to the database are taken from a pool of connections (MySQL),
+        closing a connection returns it to the pool. size 0 removes the pool.
+        The SQLite connections are not pooled.
+    """
+    if size:
+        _pools[database] = size
+    else:
+        _pools.pop(database, None)
+
+def set_values(value):
+    """
+        Returns the value of a SET column as a python set of strings.
+        SQLite stores SET values as comma separated strings.
+    """
+    if value is None or isinstance(value, set):
+        return value
+    if isinstance(value, (bytes, bytearray)):
+        value = value.decode("utf-8")
+
+    return set(value.split(",")) if value != "" else set()
+
+def _timestamp(value):
+    value = value.decode("utf-8")
+    if value.startswith("0000-00-00"):
+        return None
+    if len(value) == 10:
+        return datetime.strptime(value, "%Y-%m-%d")
+
+    return datetime.strptime(value[:19], "%Y-%m-%d %H:%M:%S")
+
+sqlite3.register_converter("SETVALUES", set_values)
+sqlite3.register_converter("TIMESTAMP", _timestamp)
+sqlite3.register_converter("DATETIME", _timestamp)
+sqlite3.register_adapter(datetime, lambda value: value.strftime("%Y-%m-%d %H:%M:%S"))
+sqlite3.register_adapter(set, lambda value: ",".join(sorted(value, key=lambda x: (len(x), x))))
+
+def _find_in_set(value, set_value):
+    if value is None or set_value is None:
+        return None
+    values = str(set_value).split(",")
+    return values.index(str(value)) + 1 if str(value) in values else 0
+
+def _sqlite_connect(database):
+    if _sqlite_directory:
+        os.makedirs(_sqlite_directory, exist_ok=True)
+        path = os.path.join(_sqlite_directory, f"{database}.sqlite")
+        connection = sqlite3.connect(path, detect_types=sqlite3.PARSE_DECLTYPES)
+    else:
+        uri = f"file:{database}?mode=memory&cache=shared"
+        if database not in _keepers:
+            _keepers[database] = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        connection = sqlite3.connect(uri, uri=True, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False)
+
+    connection.create_function("FIND_IN_SET", 2, _find_in_set, deterministic=True)
+    connection.create_function("NOW", 0, lambda: datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    connection.create_function("CONCAT", -1, lambda *values: None if None in values else "".join(str(v) for v in values), deterministic=True)
+
+    return connection
+
+def drop_database(database):
+    """
+        Drops a SQLite database (in memory or file)
+    """
+    if database in _keepers:
+        _keepers.pop(database).close()
+    if _sqlite_directory:
+        path = os.path.join(_sqlite_directory, f"{database}.sqlite")
+        if os.path.isfile(path):
+            os.remove(path)
+
+def foreign_keys(cursor, database):
+    """
+        Returns the foreign keys declared in the database: list of (table, column, referenced table, referenced column)
+    """
+    if _backend == "sqlite":
+        result = []
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name")
+        for (table,) in cursor.fetchall():
+            cursor.execute(f"PRAGMA foreign_key_list(`{table}`)")
+            for row in cursor.fetchall():
+                result.append((table, row[3], row[2], row[4]))
+        return result
+
+    cursor.execute(""" SELECT TABLE_NAME, COLUMN_NAME, REFERENCED_TABLE_NAME, REFERENCED_COLUMN_NAME
+                       FROM information_schema.KEY_COLUMN_USAGE
+                       WHERE TABLE_SCHEMA = %s AND REFERENCED_TABLE_NAME IS NOT NULL
+                       ORDER BY TABLE_NAME, COLUMN_NAME """, [database])
+
+    return [tuple(row) for row in cursor.fetchall()]
+
+def table_checksums(cursor, tables):
+    """
+        Returns a change marker of each table (dict key = table), with one statement.
+        MySQL: CHECKSUM TABLE (content of the table).
+        SQLite: row count and maximum rowid (in place updates are not detected).
+    """
+    if _backend == "sqlite":
+        cursor.execute("SELECT " + ", ".join(f"(SELECT COUNT(*) || ':' || IFNULL(MAX(rowid), 0) FROM `{table}`)" for table in tables))
+        return dict(zip(tables, cursor.fetchone()))
+
+    cursor.execute("CHECKSUM TABLE " + ", ".join(f"`{table}`" for table in tables))
+    # The table names are returned as <database>.<table>
+    return { table.split(".")[-1]:checksum for table, checksum in cursor.fetchall() }
+
+def secondary_indexes(cursor, database):
+    """
+        Returns the non-unique indexes that can be dropped: list of (table, index name, columns).
+        The indexes used by a foreign key (first column of the index in a foreign key) are not returned,
+        MySQL does not drop them.
+    """
+    fk_columns = set((table, column) for table, column, ref_table, ref_column in foreign_keys(cursor, database))
+    indexes = {} # key: (table, index name); value: list of columns
+
+    if _backend == "sqlite":
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name")
+        for (table,) in cursor.fetchall():
+            cursor.execute(f"PRAGMA index_list(`{table}`)")
+            for seq, name, unique, origin, partial in cursor.fetchall():
+                if unique or origin != "c":
+                    continue
+                cursor.execute(f"PRAGMA index_info(`{name}`)")
+                indexes[(table, name)] = [f"`{row[2]}`" for row in sorted(cursor.fetchall())]
+    else:
+        cursor.execute(""" SELECT TABLE_NAME, INDEX_NAME, COLUMN_NAME, SUB_PART
+                           FROM information_schema.STATISTICS
+                           WHERE TABLE_SCHEMA = %s AND NON_UNIQUE = 1 AND INDEX_NAME != 'PRIMARY'
+                           ORDER BY TABLE_NAME, INDEX_NAME, SEQ_IN_INDEX """, [database])
+        for table, name, column, sub_part in cursor.fetchall():
+            indexes.setdefault((table, name), []).append(f"`{column}`" + (f"({sub_part})" if sub_part else ""))
+
+    return [(table, name, columns) for (table, name), columns in indexes.items()
+            if (table, columns[0].split("`")[1]) not in fk_columns]
+
+def unique_keys(cursor, database):
+    """
+        Returns the unique keys, primary keys excluded: list of (table, index name, columns).
+        Columns indexed by a prefix are returned as LEFT(column, length).
+    """
+    keys = {} # key: (table, index name); value: list of columns
+
+    if _backend == "sqlite":
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name")
+        for (table,) in cursor.fetchall():
+            cursor.execute(f"PRAGMA index_list(`{table}`)")
+            for seq, name, unique, origin, partial in cursor.fetchall():
+                if not unique or origin == "pk":
+                    continue
+                cursor.execute(f"PRAGMA index_info(`{name}`)")
+                keys[(table, name)] = [f"`{row[2]}`" for row in sorted(cursor.fetchall())]
+    else:
+        cursor.execute(""" SELECT TABLE_NAME, INDEX_NAME, COLUMN_NAME, SUB_PART
+                           FROM information_schema.STATISTICS
+                           WHERE TABLE_SCHEMA = %s AND NON_UNIQUE = 0 AND INDEX_NAME != 'PRIMARY'
+                           ORDER BY TABLE_NAME, INDEX_NAME, SEQ_IN_INDEX """, [database])
+        for table, name, column, sub_part in cursor.fetchall():
+            keys.setdefault((table, name), []).append(f"LEFT(`{column}`, {sub_part})" if sub_part else f"`{column}`")
+
+    return [(table, name, columns) for (table, name), columns in keys.items()]
+
+def drop_index(cursor, table, name):
+    if _backend == "sqlite":
+        cursor.execute(f"DROP INDEX `{name}`")
+    else:
+        cursor.execute(f"ALTER TABLE `{table}` DROP INDEX `{name}`")
+
+def create_indexes(cursor, table, indexes):
+    """
+        Creates the indexes (index name, columns) of a table, with one ALTER TABLE in MySQL
+    """
+    if _backend == "sqlite":
+        for name, columns in indexes:
+            cursor.execute(f"CREATE INDEX `{name}` ON `{table}` ({', '.join(columns)})")
+    else:
+        cursor.execute(f"ALTER TABLE `{table}` " + ", ".join(f"ADD INDEX `{name}` ({', '.join(columns)})" for name, columns in indexes))
+
+_re_strings = re.compile(r"('(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\")")
+
+def translate_query(sql):
+    """
+        Translates a MySQL statement to SQLite:
+        placeholders (%s to ?), INSERT IGNORE, DROP TEMPORARY TABLE and BINARY comparisons
+    """
+    parts = _re_strings.split(sql)
+    for i in range(0, len(parts), 2):
+        part = parts[i].replace("%s", "?")
+        part = re.sub(r"\bINSERT\s+IGNORE\b", "INSERT OR IGNORE", part, flags=re.I)
+        part = re.sub(r"\bDROP\s+TEMPORARY\s+TABLE\b", "DROP TABLE", part, flags=re.I)
+        # SQLite compares and groups strings as binary by default
+        part = re.sub(r"\bBINARY\s+", "", part, flags=re.I)
+        parts[i] = part
+
+    return "".join(parts)
+
+_re_key = re.compile(r"^\s*(UNIQUE\s+|FULLTEXT\s+)?(KEY|INDEX)\s+`?(\w+)`?\s*\((.*)\)\s*,?\s*$", re.I)
+_re_table = re.compile(r"CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?`?(\w+)`?\s*\((.*)\)([^)]*)$", re.I | re.S)
+
+def _column_list(columns):
+    # Removes the prefix lengths: `value`(80)
+    return re.sub(r"\(\d+\)", "", columns)
+
+def _translate_column(definition):
+    column = re.sub(r"\b(tiny|small|medium|big)?int\(\d+\)(\s+unsigned)?", "INTEGER", definition, flags=re.I)
+    column = re.sub(r"\b(tiny|small|medium|big)?int\b(\s+unsigned)?", "INTEGER", column, flags=re.I)
+    column = re.sub(r"\bset\((?:'[^']*',?)+\)", "SETVALUES", column, flags=re.I)
+    column = re.sub(r"\benum\((?:'[^']*',?)+\)", "TEXT", column, flags=re.I)
+    column = re.sub(r"\b(double|float|decimal)(\(\d+,\s*\d+\))?(\s+unsigned)?", "REAL", column, flags=re.I)
+    column = re.sub(r"\bunsigned\b", "", column, flags=re.I)
+    column = re.sub(r"\bAUTO_INCREMENT\b", "", column, flags=re.I)
+    column = re.sub(r"\bCHARACTER\s+SET\s+\w+|\bCOLLATE\s+\w+", "", column, flags=re.I)
+    column = re.sub(r"\bON\s+UPDATE\s+CURRENT_TIMESTAMP(\(\))?", "", column, flags=re.I)
+    column = re.sub(r"\bCOMMENT\s+'(?:[^'\\]|\\.|'')*'", "", column, flags=re.I)
+
+    return column.rstrip()
+
+def translate_ddl(statement):
+    """
+        Translates a MySQL CREATE TABLE statement to SQLite.
+        Returns the list of SQLite statements: the CREATE TABLE and one CREATE INDEX per key.
+        Other statements (SET, LOCK, ...) return an empty list.
+    """
+    match = _re_table.match(statement.strip().rstrip(";"))
+    if not match:
+        if re.match(r"\s*(CREATE\s+(UNIQUE\s+)?INDEX|INSERT|UPDATE|DELETE)\b", statement, re.I):
+            return [translate_query(statement)]
+        return []
+
+    table = match.group(1)
+    body = match.group(2)
+    columns = []
+    indexes = []
+
+    for line in body.split("\n"):
+        line = line.strip()
+        if not line:
+            continue
+        key = _re_key.match(line)
+        if key:
+            unique = "UNIQUE " if key.group(1) and key.group(1).strip().upper() == "UNIQUE" else ""
+            indexes.append(f"CREATE {unique}INDEX `{table}_{key.group(3)}` ON `{table}` ({_column_list(key.group(4))})")
+            continue
+        line = line.rstrip(",")
+        if re.match(r"PRIMARY\s+KEY", line, re.I):
+            columns.append(_column_list(line))
+        elif re.match(r"(CONSTRAINT|FOREIGN\s+KEY)\b", line, re.I):
+            columns.append(re.sub(r"\s+ON\s+(DELETE|UPDATE)\s+(NO\s+ACTION|RESTRICT)", "", line, flags=re.I))
+        else:
+            columns.append(_translate_column(line))
+
+    return [f"CREATE TABLE `{table}` (\n  " + ",\n  ".join(columns) + "\n)"] + indexes
+
+def split_sql(content):
+    """
+        Returns the statements of a SQL script (MySQL comments removed)
+    """
+    content = re.sub(r"^\s*--[^\n]*$", "", content, flags=re.M)
+    content = re.sub(r"/\*.*?\*/;?", "", content, flags=re.S)
+
+    return [statement.strip() for statement in re.split(r";\s*\n", content) if statement.strip()]
+
+def load_schema(database, sql_file):
+    """
+        Creates the tables of a MySQL schema file in a SQLite database
+    """
+    with open(sql_file, encoding="utf-8") as fh:
+        statements = split_sql(fh.read())
+
+    connection = _sqlite_connect(database)
+    try:
+        for statement in statements:
+            for sqlite_statement in translate_ddl(statement):
+                connection.execute(sqlite_statement)
+        connection.commit()
+    finally:
+        connection.close()
+
+class SQLiteCursor:
+    """
+        Cursor with the same interface as the mysql-connector cursor
+    """
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, operation, params=None):
+        if params is None:
+            return self._cursor.execute(translate_query(operation))
+        return self._cursor.execute(translate_query(operation), tuple(params))
+
+    def executemany(self, operation, seq_params):
+        return self._cursor.executemany(translate_query(operation), [tuple(params) for params in seq_params])
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def fetchmany(self, size=1):
+        return self._cursor.fetchmany(size)
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def close(self):
+        self._cursor.close()
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+class SQLiteConnection:
+    """
+        Connection with the same interface as the mysql-connector connection
+    """
+
+    def __init__(self, connection):
+        self._connection = connection
+        self._connected = True
+
+    def is_connected(self):
+        return self._connected
+
+    def cursor(self, *args, **kwargs):
+        return SQLiteCursor(self._connection.cursor())
+
+    def commit(self):
+        self._connection.commit()
+
+    def rollback(self):
+        self._connection.rollback()
+
+    def close(self):
+        if self._connected:
+            self._connection.close()
+            self._connected = False
@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+    Downloads the G2P panel files (CSV.gz) used by update_gencc.py.
+
+    The files are downloaded concurrently to <output_dir>/<date>/<date>_<file> (same names as
+    download_file.sh). The ETag and Last-Modified headers of each file are saved in
+    <output_dir>/download_state.json with the sha256 of the file: the next download sends
+    If-None-Match/If-Modified-Since and an unchanged file (HTTP 304) is not downloaded again,
+    the path of the previous download is returned.
+
+    With archive, the files are stored once by sha256 in <output_dir>/objects/<sha256[:2]>/<sha256>.csv.gz
+    and each download writes <output_dir>/<date>/manifest.json with the object of each file, a
+    file that did not change since a previous date is not stored again. The archive command moves
+    the files of the existing dated directories to the archive (one manifest by date).
+
+    The serve command starts a local server with the files of a directory (ETag, Last-Modified
+    and HTTP 304 support), to run update_gencc.py without the G2P website.
+
+    Usage:
+        import download_panels
+        paths, downloaded_bytes = download_panels.download_files(output_dir, base_url)
+
+        python download_panels.py download --output_dir GenCC_create
+        python download_panels.py serve --directory panel_files --port 8766
+        python download_panels.py download --output_dir GenCC_create --base_url http://127.0.0.1:8766
+        python download_panels.py download --output_dir GenCC_create --archive
+        python download_panels.py archive --output_dir GenCC_create
+"""
+
+import os
+import json
+import time
+import hashlib
+import argparse
+import threading
+from datetime import date
+from email.utils import formatdate, parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from functools import partial
+
+import requests
+
+default_base_url = "https://www.ebi.ac.uk/gene2phenotype/downloads"
+
+panel_files = ["CancerG2P.csv.gz",
+               "CardiacG2P.csv.gz",
+               "DDG2P.csv.gz",
+               "EyeG2P.csv.gz",
+               "SkinG2P.csv.gz",
+               "SkeletalG2P.csv.gz",
+               "Hearing_lossG2P.csv.gz"]
+
+state_file_name = "download_state.json"
+manifest_file_name = "manifest.json"
+objects_dir_name = "objects"
+
+chunk_size = 1024 * 1024
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+def read_state(output_dir):
+    path = os.path.join(output_dir, state_file_name)
+    if not os.path.isfile(path):
+        return {}
+
+    with open(path, encoding="utf-8") as fh:
+        return json.load(fh)
+
+def write_state(output_dir, state):
+    path = os.path.join(output_dir, state_file_name)
+    with open(f"{path}.tmp", "w", encoding="utf-8") as output:
+        json.dump(state, output, indent=2, sort_keys=True)
+    os.replace(f"{path}.tmp", path)
+
+def object_path(output_dir, sha256):
+    """
+        Returns the path of a file of the archive
+    """
+    return os.path.join(output_dir, objects_dir_name, sha256[:2], f"{sha256}.csv.gz")
+
+def archive_file(output_dir, path, sha256):
+    """
+        Moves a file to the archive, the file is removed if the archive already has it.
+        Returns the path of the file in the archive.
+    """
+    archived_path = object_path(output_dir, sha256)
+    if os.path.isfile(archived_path):
+        os.remove(path)
+    else:
+        os.makedirs(os.path.dirname(archived_path), exist_ok=True)
+        os.replace(path, archived_path)
+
+    return archived_path
+
+def read_manifest(directory):
+    """
+        Returns the manifest of a dated directory (dict key = file; value = { path, sha256, size }),
+        None if the directory has no manifest. The paths are relative to the output directory.
+    """
+    path = os.path.join(directory, manifest_file_name)
+    if not os.path.isfile(path):
+        return None
+
+    with open(path, encoding="utf-8") as fh:
+        return json.load(fh)
+
+def write_manifest(directory, manifest):
+    path = os.path.join(directory, manifest_file_name)
+    with open(f"{path}.tmp", "w", encoding="utf-8") as output:
+        json.dump(manifest, output, indent=2, sort_keys=True)
+    os.replace(f"{path}.tmp", path)
+
+def download_file(session, url, path, previous=None, timeout=60, archive_dir=None):
+    """
+        Downloads url to path, unless the file is the same as the previous download.
+        With archive_dir the file is moved to the archive of archive_dir (path is only
+        the temporary download).
+        Returns the state of the file (path, sha256, size, etag, last_modified, status).
+    """
+    headers = {}
+    # The previous file is only reused if it was not modified since the download
+    if previous and os.path.isfile(previous['path']) and file_sha256(previous['path']) == previous['sha256']:
+        if previous.get('etag'):
+            headers['If-None-Match'] = previous['etag']
+        if previous.get('last_modified'):
+            headers['If-Modified-Since'] = previous['last_modified']
+
+    with session.get(url, headers=headers, stream=True, timeout=timeout) as response:
+        if response.status_code == 304 and headers:
+            return dict(previous, status="unchanged")
+        response.raise_for_status()
+
+        digest = hashlib.sha256()
+        size = 0
+        with open(f"{path}.tmp", "wb") as output:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                output.write(chunk)
+                digest.update(chunk)
+                size += len(chunk)
+        if archive_dir:
+            path = archive_file(archive_dir, f"{path}.tmp", digest.hexdigest())
+        else:
+            os.replace(f"{path}.tmp", path)
+
+        return { 'path':path,
+                 'sha256':digest.hexdigest(),
+                 'size':size,
+                 'etag':response.headers.get('ETag'),
+                 'last_modified':response.headers.get('Last-Modified'),
+                 'status':"downloaded" }
+
+def download_files(output_dir, base_url=default_base_url, files=None, workers=None, download_date=None, archive=False):
+    """
+        Downloads the panel files to <output_dir>/<date>, or to the archive of output_dir
+        with a manifest in <output_dir>/<date> (archive).
+        Returns the paths of the files (same order as files), unchanged files keep the
+        path of the previous download, and the number of bytes downloaded (unchanged files
+        not included).
+        Raises requests.RequestException if a file can't be downloaded.
+    """
+    files = files or panel_files
+    download_date = str(download_date or date.today())
+    directory = os.path.join(output_dir, download_date)
+    os.makedirs(directory, exist_ok=True)
+
+    state = read_state(output_dir)
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=max(len(files), 10))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers or len(files)) as executor:
+        futures = {}
+        for file in files:
+            url = f"{base_url.rstrip('/')}/{file}"
+            path = os.path.join(directory, f"{download_date}_{file}")
+            futures[file] = executor.submit(download_file, session, url, path, state.get(file),
+                                            archive_dir=output_dir if archive else None)
+
+        results = {}
+        try:
+            for file, future in futures.items():
+                results[file] = future.result()
+        finally:
+            # The files downloaded before an error are not downloaded again by the next run
+            for file, result in results.items():
+                state[file] = { key:value for key, value in result.items() if key != 'status' }
+            write_state(output_dir, state)
+
+    if archive:
+        write_manifest(directory, { file:{ 'path':os.path.relpath(results[file]['path'], output_dir),
+                                           'sha256':results[file]['sha256'],
+                                           'size':results[file]['size'] } for file in files })
+
+    for file in files:
+        result = results[file]
+        print(f"INFO: {file}: {result['status']} ({result['size']} bytes, sha256 {result['sha256'][:12]}) {result['path']}")
+    downloaded_bytes = sum(result['size'] for result in results.values() if result['status'] == "downloaded")
+    print(f"INFO: {len(files)} files in {time.perf_counter() - start:.2f} s ({downloaded_bytes} bytes downloaded)")
+
+    return [results[file]['path'] for file in files], downloaded_bytes
+
+def archive_directories(output_dir, files=None):
+    """
+        Moves the files of the dated directories (<date>/<date>_<file>) to the archive and
+        writes the manifest of each directory. The paths of the download state are updated.
+        Returns the number of files archived and the number of bytes saved.
+    """
+    files = files or panel_files
+    state = read_state(output_dir)
+    moved = {}
+    n_files = 0
+    saved = 0
+
+    for directory in sorted(os.listdir(output_dir)):
+        try:
+            date.fromisoformat(directory)
+        except ValueError:
+            continue
+        manifest = read_manifest(os.path.join(output_dir, directory)) or {}
+
+        for file in files:
+            path = os.path.join(output_dir, directory, f"{directory}_{file}")
+            if not os.path.isfile(path) or os.path.islink(path):
+                continue
+            sha256 = file_sha256(path)
+            size = os.path.getsize(path)
+            if os.path.isfile(object_path(output_dir, sha256)):
+                saved += size
+            archived_path = archive_file(output_dir, path, sha256)
+            manifest[file] = { 'path':os.path.relpath(archived_path, output_dir), 'sha256':sha256, 'size':size }
+            moved[os.path.abspath(path)] = archived_path
+            n_files += 1
+
+        if manifest:
+            write_manifest(os.path.join(output_dir, directory), manifest)
+
+    for file, previous in state.items():
+        if os.path.abspath(previous['path']) in moved:
+            previous['path'] = moved[os.path.abspath(previous['path'])]
+    write_state(output_dir, state)
+
+    return n_files, saved
+
+class PanelFilesHandler(SimpleHTTPRequestHandler):
+    """
+        Serves the files of a directory with ETag and Last-Modified headers,
+        answers HTTP 304 to If-None-Match and If-Modified-Since
+    """
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            return super().send_head()
+
+        stat = os.stat(path)
+        etag = f'"{stat.st_size:x}-{int(stat.st_mtime_ns):x}"'
+        last_modified = formatdate(int(stat.st_mtime), usegmt=True)
+
+        not_modified = False
+        if "If-None-Match" in self.headers:
+            not_modified = self.headers["If-None-Match"] == etag
+        elif "If-Modified-Since" in self.headers:
+            try:
+                not_modified = int(stat.st_mtime) <= parsedate_to_datetime(self.headers["If-Modified-Since"]).timestamp()
+            except (TypeError, ValueError):
+                not_modified = False
+
+        if not_modified:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return None
+
+        fh = open(path, "rb")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/gzip")
+        self.send_header("Content-Length", str(stat.st_size))
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", last_modified)
+        self.end_headers()
+
+        return fh
+
+    def log_message(self, format, *args):
+        pass
+
+def start_server(directory, host="127.0.0.1", port=0):
+    """
+        Starts the server of the panel files in a thread and returns it
+    """
+    server = ThreadingHTTPServer((host, port), partial(PanelFilesHandler, directory=directory))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Downloads the G2P panel files used by the GenCC submission")
+    parser.add_argument("command", choices=["download", "archive", "serve"], help="download: download the panel files; archive: move the files of the dated directories to the archive; serve: start a local server with the files of a directory")
+    parser.add_argument("--output_dir", default=".", help="Download and archive: directory of the dated directories and of the download state (default: .)")
+    parser.add_argument("--base_url", default=default_base_url, help=f"Download: URL of the panel files (default: {default_base_url})")
+    parser.add_argument("--workers", type=int, default=None, help="Download: number of files downloaded at the same time (default: all)")
+    parser.add_argument("--archive", action="store_true", help="Download: store the files in the archive of the output directory (one copy by sha256) with a manifest by date")
+    parser.add_argument("--directory", default=".", help="Serve: directory with the panel files (default: .)")
+    parser.add_argument("--host", default="127.0.0.1", help="Serve: server host (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8766, help="Serve: server port (default: 8766)")
+
+    args = parser.parse_args()
+
+    if args.command == "download":
+        download_files(args.output_dir, args.base_url, workers=args.workers, archive=args.archive)
+        return
+
+    if args.command == "archive":
+        n_files, saved = archive_directories(args.output_dir)
+        print(f"INFO: {n_files} files archived, {saved} bytes saved")
+        return
+
+    server = start_server(args.directory, args.host, args.port)
+    print(f"INFO: Serving {args.directory} on http://{args.host}:{server.server_address[1]} (Ctrl-C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
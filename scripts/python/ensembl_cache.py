@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+    Local cache of the Ensembl core data used by the migration (gene coordinates and synonyms).
+
+    The data of a core db does not change within a release, the cache is built once per
+    core db and reused by the next runs:
+      - <cache_dir>/<ensembl_db>.parquet: one row per gene with the columns
+        stable_id, name, seq_region, start, end, strand, synonyms
+      - <cache_dir>/<ensembl_db>.json: checksum (sha256) of the core meta table and the
+        number of rows. The cache is rebuilt if the checksum of the core db is different.
+
+    The parquet files are written with pandas and pyarrow. If pyarrow is not installed
+    the cache is not used and the data is read from the core db.
+
+    Usage:
+        import ensembl_cache
+        cache = ensembl_cache.load_or_build(cache_dir, ensembl_host, ensembl_port, ensembl_db, ensembl_user, ensembl_password)
+        if cache is not None:
+            genes = cache.genes                 # key: stable_id; value: sequence, start, end, strand
+            gene_synonyms = cache.gene_synonyms # key: gene name; value: stable_id, synonyms
+
+        python ensembl_cache.py --ensembl_host ... --ensembl_database homo_sapiens_core_110_38 --cache_dir ensembl_cache
+"""
+
+import os
+import json
+import hashlib
+import argparse
+import importlib.util
+from datetime import datetime
+
+import pandas as pd
+
+import db_backend
+from db_backend import Error
+
+columns = ["stable_id", "name", "seq_region", "start", "end", "strand", "synonyms"]
+
+# Same queries as populates_locus and populates_gene_synonyms (migrate_data_2024.py)
+sql_genes = """ SELECT g.stable_id, s.name, g.seq_region_start, g.seq_region_end, g.seq_region_strand
+                FROM gene g
+                LEFT JOIN seq_region s on s.seq_region_id = g.seq_region_id
+                WHERE s.coord_system_id = 4
+            """
+
+sql_synonyms = """ SELECT ga.value, g.stable_id, e.synonym
+                   FROM gene g
+                   LEFT JOIN gene_attrib ga ON ga.gene_id = g.gene_id
+                   LEFT JOIN external_synonym e ON e.xref_id = g.display_xref_id
+                   WHERE (g.source = 'ensembl_havana' or g.source = 'havana') AND ga.attrib_type_id = 4 AND e.synonym IS NOT NULL
+               """
+
+sql_meta = """ SELECT meta_id, species_id, meta_key, meta_value
+               FROM meta
+               ORDER BY meta_id
+           """
+
+def parquet_available():
+    return importlib.util.find_spec("pyarrow") is not None
+
+def cache_files(cache_dir, ensembl_db):
+    return os.path.join(cache_dir, f"{ensembl_db}.parquet"), os.path.join(cache_dir, f"{ensembl_db}.json")
+
+class CoreCache:
+    """
+        Genes of a core db, in the format used by populates_locus and populates_gene_synonyms
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.genes = {}
+        self.gene_synonyms = {}
+
+        for row in data.itertuples(index=False):
+            if row.seq_region is not None and row.stable_id not in self.genes:
+                self.genes[row.stable_id] = { 'sequence':row.seq_region,
+                                              'start':int(row.start),
+                                              'end':int(row.end),
+                                              'strand':int(row.strand) }
+            if row.name is not None and len(row.synonyms) != 0:
+                if row.name not in self.gene_synonyms:
+                    self.gene_synonyms[row.name] = { 'stable_id':row.stable_id,
+                                                     'synonyms':set() }
+                self.gene_synonyms[row.name]['synonyms'].update(row.synonyms)
+
+def meta_checksum(cursor):
+    """
+        Returns the sha256 of the content of the core meta table
+    """
+    digest = hashlib.sha256()
+    cursor.execute(sql_meta)
+    for row in cursor.fetchall():
+        digest.update(("\t".join("" if value is None else str(value) for value in row) + "\n").encode("utf-8"))
+
+    return digest.hexdigest()
+
+def fetch_core_data(cursor):
+    """
+        Returns a DataFrame with one row per gene (stable_id, name) of the core db
+    """
+    records = {} # key: (stable_id, name)
+    gene_names = {} # key: stable_id; value: name
+
+    cursor.execute(sql_genes)
+    for row in cursor.fetchall():
+        key = (row[0], None)
+        if key not in records:
+            records[key] = { 'stable_id':row[0], 'name':None, 'seq_region':row[1],
+                             'start':row[2], 'end':row[3], 'strand':row[4], 'synonyms':set() }
+
+    cursor.execute(sql_synonyms)
+    for name, stable_id, synonym in cursor.fetchall():
+        # The first name of the gene is stored in the row with the coordinates
+        if gene_names.setdefault(stable_id, name) == name and (stable_id, None) in records:
+            key = (stable_id, None)
+        else:
+            key = (stable_id, name)
+            if key not in records:
+                records[key] = { 'stable_id':stable_id, 'name':None, 'seq_region':None,
+                                 'start':None, 'end':None, 'strand':None, 'synonyms':set() }
+        records[key]['name'] = name
+        records[key]['synonyms'].add(synonym)
+
+    for record in records.values():
+        record['synonyms'] = sorted(record['synonyms'])
+
+    data = pd.DataFrame(list(records.values()), columns=columns)
+    for column in ["start", "end", "strand"]:
+        data[column] = data[column].astype("Int64")
+
+    return data
+
+def read_cache(cache_dir, ensembl_db, checksum):
+    """
+        Returns the cached data if the cache exists and matches the checksum of the core db
+    """
+    data_file, info_file = cache_files(cache_dir, ensembl_db)
+    if not os.path.isfile(data_file) or not os.path.isfile(info_file):
+        return None
+
+    with open(info_file, encoding="utf-8") as fh:
+        info = json.load(fh)
+    if info.get('meta_checksum') != checksum:
+        print(f"INFO: Ensembl cache {data_file} does not match the core db meta table, it will be rebuilt")
+        return None
+
+    data = pd.read_parquet(data_file)
+    data = data.astype(object).where(data.notna(), None)
+    data['synonyms'] = [list(synonyms) for synonyms in data['synonyms']]
+    if len(data) != info.get('rows'):
+        print(f"INFO: Ensembl cache {data_file} is incomplete, it will be rebuilt")
+        return None
+
+    return data
+
+def write_cache(cache_dir, ensembl_db, checksum, data):
+    data_file, info_file = cache_files(cache_dir, ensembl_db)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # Written to temporary files first, an interrupted run does not leave a partial cache
+    data.to_parquet(f"{data_file}.tmp", index=False)
+    os.replace(f"{data_file}.tmp", data_file)
+    info = { 'ensembl_db':ensembl_db,
+             'meta_checksum':checksum,
+             'rows':len(data),
+             'created':datetime.now().strftime("%Y-%m-%d %H:%M:%S") }
+    with open(f"{info_file}.tmp", "w", encoding="utf-8") as output:
+        json.dump(info, output, indent=2)
+    os.replace(f"{info_file}.tmp", info_file)
+
+def load_or_build(cache_dir, ensembl_host, ensembl_port, ensembl_db, ensembl_user, ensembl_password, rebuild=False):
+    """
+        Returns the cached core data (CoreCache), building the cache if needed.
+        Returns None if the cache can't be used (pyarrow not installed or error).
+    """
+    if not parquet_available():
+        print("WARNING: pyarrow is not installed, the Ensembl cache is not used")
+        return None
+
+    data = None
+
+    connection = db_backend.connect(host=ensembl_host,
+                                    database=ensembl_db,
+                                    user=ensembl_user,
+                                    port=ensembl_port,
+                                    password=ensembl_password)
+
+    try:
+        if connection.is_connected():
+            cursor = connection.cursor()
+            checksum = meta_checksum(cursor)
+            if not rebuild:
+                data = read_cache(cache_dir, ensembl_db, checksum)
+            if data is not None:
+                print(f"INFO: Using Ensembl cache {cache_files(cache_dir, ensembl_db)[0]} ({len(data)} genes)")
+            else:
+                data = fetch_core_data(cursor)
+                write_cache(cache_dir, ensembl_db, checksum, data)
+                print(f"INFO: Ensembl cache {cache_files(cache_dir, ensembl_db)[0]} built ({len(data)} genes)")
+
+    except Error as e:
+        print("Error while connecting to MySQL", e)
+    finally:
+        if connection.is_connected():
+            cursor.close()
+            connection.close()
+
+    if data is None:
+        return None
+
+    return CoreCache(data)
+
+def main():
+    parser = argparse.ArgumentParser(description="Builds the local cache of the Ensembl core data used by the G2P migration")
+    parser.add_argument("--ensembl_host", required=True, help="Ensembl core Database host")
+    parser.add_argument("--ensembl_port", required=True, help="Ensembl core Host port")
+    parser.add_argument("--ensembl_database", required=True, help="Ensembl core Database name")
+    parser.add_argument("--ensembl_user", required=True, help="Ensembl core Username")
+    parser.add_argument("--ensembl_password", default='', help="Ensembl core Password (default: '')")
+    parser.add_argument("--cache_dir", required=True, help="Cache directory")
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild the cache even if it matches the core db")
+
+    args = parser.parse_args()
+
+    load_or_build(args.cache_dir, args.ensembl_host, args.ensembl_port, args.ensembl_database,
+                  args.ensembl_user, args.ensembl_password, args.rebuild)
+
+if __name__ == '__main__':
+    main()
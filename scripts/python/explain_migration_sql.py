@@ -0,0 +1,439 @@
+#!/usr/bin/env python3
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+    Preflight check for the SQL used by the migration scripts.
+
+    Extracts every SQL statement defined in the scripts (variables named sql_*),
+    runs them through EXPLAIN FORMAT=JSON against the database they are executed on
+    and reports full table scans, filesorts, temporary tables and dependent subqueries.
+    For each problem found it suggests the index that would remove it.
+
+    Statements from the dump_* functions (and from update_gencc.py) run against the old
+    schema, the Ensembl core queries run against the core database and all other
+    statements run against the new schema. Only the statements for the databases
+    given in the command line are checked.
+
+    EXPLAIN does not execute the statement, it is safe to run it for DELETE and UPDATE.
+    Simple INSERT ... VALUES statements are skipped.
+
+    Usage:
+        python explain_migration_sql.py --host <old db host> --port <port> --database <old db> --user <user>
+                                        --new_host <new db host> --new_port <port> --new_database <new db> --new_user <user>
+                                        --ensembl_host ... [--fail_on_findings]
+"""
+
+import os
+import sys
+import re
+import ast
+import json
+import argparse
+import mysql.connector
+from mysql.connector import Error
+
+# Statements that run against the Ensembl core database
+core_statements = {
+    ('populates_locus', 'sql_genes'),
+    ('populates_gene_synonyms', 'sql_get_synonym')
+}
+
+# Functions that read the old schema
+old_schema_functions = ('dump_', 'fetch_attribs', 'fetch_g2p_')
+
+sql_keywords = {
+    'on', 'where', 'left', 'right', 'inner', 'outer', 'join', 'group', 'order',
+    'limit', 'set', 'using', 'union', 'having', 'and', 'or', 'straight_join'
+}
+
+def extract_statements(script):
+    """
+        Returns the SQL statements defined in a python script.
+        Only the assignments to variables starting with 'sql' inside a function are considered.
+
+        Output: list of dicts with keys script, function, variable, line, sql and target
+                (target is 'old', 'new' or 'core')
+    """
+    statements = []
+
+    with open(script) as f:
+        tree = ast.parse(f.read(), filename=script)
+
+    script_name = os.path.basename(script)
+
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.FunctionDef):
+            continue
+
+        for child in ast.walk(node):
+            if not isinstance(child, ast.Assign) or len(child.targets) != 1:
+                continue
+            target = child.targets[0]
+            if not isinstance(target, ast.Name) or not target.id.startswith("sql"):
+                continue
+
+            sql = None
+            if isinstance(child.value, ast.Constant) and isinstance(child.value.value, str):
+                sql = child.value.value
+            # f-strings without placeholders
+            elif isinstance(child.value, ast.JoinedStr) and all(isinstance(v, ast.Constant) for v in child.value.values):
+                sql = "".join(v.value for v in child.value.values)
+
+            if sql is None:
+                continue
+
+            if (node.name, target.id) in core_statements:
+                db_target = 'core'
+            elif script_name == 'update_gencc.py' or node.name.startswith(old_schema_functions):
+                db_target = 'old'
+            else:
+                db_target = 'new'
+
+            statements.append({ 'script':script_name,
+                                'function':node.name,
+                                'variable':target.id,
+                                'line':child.lineno,
+                                'sql':sql.strip(),
+                                'target':db_target })
+
+    statements.sort(key=lambda x: (x['script'], x['line']))
+
+    return statements
+
+def is_explainable(sql):
+    """
+        Simple INSERT ... VALUES statements always use the primary key, there is nothing to explain.
+    """
+    first_word = sql.split(None, 1)[0].upper()
+
+    if first_word in ('SELECT', 'UPDATE', 'DELETE'):
+        return True
+    if first_word == 'INSERT' and re.search(r"\bSELECT\b", sql, re.I):
+        return True
+
+    return False
+
+def prepare_statement(sql):
+    """
+        Replaces the placeholders with a string literal.
+        A string literal can be compared with numeric and string columns without disabling indexes.
+    """
+    return sql.replace("%s", "'1'")
+
+def table_aliases(sql):
+    """
+        Returns the tables used in the statement and their aliases.
+        Output: dict key = alias (or table name); value = table name
+    """
+    aliases = {}
+
+    for match in re.finditer(r"\b(?:FROM|JOIN|UPDATE|INTO)\s+`?(\w+)`?(?:\s+(?:AS\s+)?`?(\w+)`?)?", sql, re.I):
+        table = match.group(1)
+        aliases[table] = table
+        alias = match.group(2)
+        if alias and alias.lower() not in sql_keywords:
+            aliases[alias] = table
+
+    return aliases
+
+def condition_columns(sql, aliases):
+    """
+        Returns the columns used in equality/range/IN conditions and joins for each table.
+        Output: dict key = table name; value = list of columns (in order of appearance)
+    """
+    columns = {}
+
+    # Left and right side of the conditions
+    matches = list(re.finditer(r"\b(\w+)\.(\w+)\s*(?=[=<>]|\bIN\b|\bIS\b)", sql, re.I))
+    matches += list(re.finditer(r"(?<=[=<>])\s*(\w+)\.(\w+)", sql))
+    matches.sort(key=lambda x: x.start())
+
+    for match in matches:
+        table = aliases.get(match.group(1))
+        column = match.group(2)
+        if table is None:
+            continue
+        if column not in columns.setdefault(table, []):
+            columns[table].append(column)
+
+    # Conditions without alias, only if the statement uses a single table
+    tables = set(aliases.values())
+    if len(tables) == 1:
+        table = tables.pop()
+        where = re.search(r"\bWHERE\b(.*)", sql, re.I | re.S)
+        if where:
+            for match in re.finditer(r"(?<![\.\w])(\w+)\s*(?:=|<=|>=|<|>|\bIN\b)", where.group(1), re.I):
+                column = match.group(1)
+                if column.lower() not in sql_keywords and column not in columns.setdefault(table, []):
+                    columns[table].append(column)
+
+    return columns
+
+def sort_columns(sql, aliases):
+    """
+        Returns the table and columns used in GROUP BY / ORDER BY if they all belong to the same table.
+        Output: (table, list of columns, uses BINARY)
+    """
+    match = re.search(r"\b(?:GROUP|ORDER)\s+BY\s+(.*?)(?:\bORDER\s+BY\b|\bLIMIT\b|\bHAVING\b|$)", sql, re.I | re.S)
+    if not match:
+        return None, [], False
+
+    clause = match.group(1)
+    uses_binary = re.search(r"\bBINARY\b", clause, re.I) is not None
+    tables = set()
+    columns = []
+    for col_match in re.finditer(r"\b(\w+)\.(\w+)", clause):
+        table = aliases.get(col_match.group(1))
+        if table:
+            tables.add(table)
+            columns.append(col_match.group(2))
+
+    if len(tables) == 1:
+        return tables.pop(), columns, uses_binary
+
+    return None, columns, uses_binary
+
+def walk_plan(plan, findings):
+    """
+        Walks the EXPLAIN JSON output (MySQL and MariaDB formats) and collects the problems.
+    """
+    if isinstance(plan, list):
+        for item in plan:
+            walk_plan(item, findings)
+        return
+
+    if not isinstance(plan, dict):
+        return
+
+    if plan.get('using_filesort') is True or 'filesort' in plan:
+        findings['filesort'] = True
+    if plan.get('using_temporary_table') is True or 'temporary_table' in plan:
+        findings['temporary_table'] = True
+    if plan.get('dependent') is True or plan.get('expression_cache', {}).get('state') == 'disabled':
+        findings['dependent_subquery'] = True
+
+    table = plan.get('table')
+    if isinstance(table, dict) and 'table_name' in table:
+        access_type = table.get('access_type')
+        if access_type in ('ALL', 'index'):
+            findings['full_scans'].append({ 'table':table['table_name'],
+                                            'access_type':access_type,
+                                            'rows':table.get('rows_examined_per_scan', table.get('rows')),
+                                            'possible_keys':table.get('possible_keys') })
+
+    for value in plan.values():
+        if isinstance(value, (dict, list)):
+            walk_plan(value, findings)
+
+def suggest_indexes(sql, findings, existing_indexes):
+    """
+        Suggests the indexes that would remove the full scans and the filesorts.
+        existing_indexes: dict key = table; value = list of tuples of indexed columns
+    """
+    suggestions = []
+    aliases = table_aliases(sql)
+    aliases_by_table = {}
+    for alias, table in aliases.items():
+        aliases_by_table.setdefault(table, []).append(alias)
+    columns = condition_columns(sql, aliases)
+
+    def is_indexed(table, cols):
+        for index_cols in existing_indexes.get(table, []):
+            if tuple(index_cols[:len(cols)]) == tuple(cols):
+                return True
+        return False
+
+    for scan in findings['full_scans']:
+        # EXPLAIN reports the alias as table_name
+        table = aliases.get(scan['table'], scan['table'])
+        table_columns = columns.get(table, [])
+        if not table_columns:
+            scan['note'] = "no filter on this table, full scan expected"
+            continue
+        for column in table_columns:
+            if not is_indexed(table, [column]):
+                suggestions.append(f"ALTER TABLE {table} ADD INDEX {table}_{column}_idx ({column});")
+            else:
+                scan['note'] = f"index on {table}({column}) exists but was not used (check the column types and collations)"
+
+    if findings['filesort'] or findings['temporary_table']:
+        table, sort_cols, uses_binary = sort_columns(sql, aliases)
+        if uses_binary:
+            suggestions.append("GROUP BY/ORDER BY on BINARY expression cannot use an index: use a column with a binary (case sensitive) collation instead")
+        elif table and sort_cols and not is_indexed(table, sort_cols):
+            suggestions.append(f"ALTER TABLE {table} ADD INDEX {table}_{'_'.join(sort_cols)}_idx ({', '.join(sort_cols)});")
+
+    if findings['dependent_subquery']:
+        suggestions.append("Dependent subquery is executed once per row: rewrite IN (SELECT ...) as a JOIN or EXISTS")
+
+    # Remove duplicated suggestions but keep the order
+    return list(dict.fromkeys(suggestions))
+
+def fetch_indexes(cursor, db):
+    """
+        Returns the existing indexes of the database.
+        Output: dict key = table; value = list of lists of indexed columns
+    """
+    indexes = {}
+
+    sql_query = """ SELECT table_name, index_name, column_name
+                    FROM information_schema.statistics
+                    WHERE table_schema = %s
+                    ORDER BY table_name, index_name, seq_in_index """
+
+    cursor.execute(sql_query, [db])
+    data = cursor.fetchall()
+    tmp = {}
+    for row in data:
+        tmp.setdefault((row[0], row[1]), []).append(row[2])
+    for (table, index_name), cols in tmp.items():
+        indexes.setdefault(table, []).append(cols)
+
+    return indexes
+
+def explain_statements(host, port, db, user, password, statements):
+    """
+        Runs EXPLAIN FORMAT=JSON for each statement and returns the statements with their findings.
+    """
+    results = []
+
+    connection = mysql.connector.connect(host=host,
+                                         database=db,
+                                         user=user,
+                                         port=port,
+                                         password=password)
+
+    try:
+        if connection.is_connected():
+            cursor = connection.cursor()
+            existing_indexes = fetch_indexes(cursor, db)
+
+            for statement in statements:
+                findings = { 'full_scans':[], 'filesort':False, 'temporary_table':False,
+                             'dependent_subquery':False, 'suggestions':[], 'error':None }
+                try:
+                    cursor.execute("EXPLAIN FORMAT=JSON " + prepare_statement(statement['sql']))
+                    data = cursor.fetchall()
+                    plan = json.loads(data[0][0])
+                    walk_plan(plan, findings)
+                    findings['suggestions'] = suggest_indexes(statement['sql'], findings, existing_indexes)
+                except Error as e:
+                    findings['error'] = str(e)
+
+                results.append({ **statement, 'findings':findings })
+
+    except Error as e:
+        print("Error while connecting to MySQL", e)
+    finally:
+        if connection.is_connected():
+            cursor.close()
+            connection.close()
+
+    return results
+
+def print_report(results):
+    """
+        Prints the findings for each statement.
+        Returns the number of statements with problems.
+    """
+    n_problems = 0
+
+    for result in results:
+        findings = result['findings']
+        problems = []
+
+        if findings['error']:
+            problems.append(f"ERROR: {findings['error']}")
+        for scan in findings['full_scans']:
+            if 'note' in scan and scan['note'].startswith("no filter"):
+                continue
+            scan_type = "full table scan" if scan['access_type'] == 'ALL' else "full index scan"
+            problem = f"{scan_type} on {scan['table']} (rows: {scan['rows']}, possible keys: {scan['possible_keys']})"
+            if 'note' in scan:
+                problem += f" - {scan['note']}"
+            problems.append(problem)
+        if findings['filesort']:
+            problems.append("filesort")
+        if findings['temporary_table']:
+            problems.append("temporary table")
+        if findings['dependent_subquery']:
+            problems.append("dependent subquery")
+
+        label = f"{result['script']}:{result['line']} {result['function']}.{result['variable']} ({result['target']})"
+        if not problems:
+            print(f"OK     {label}")
+            continue
+
+        n_problems += 1
+        print(f"CHECK  {label}")
+        for problem in problems:
+            print(f"         - {problem}")
+        for suggestion in findings['suggestions']:
+            print(f"         > {suggestion}")
+
+    return n_problems
+
+def main():
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+
+    parser = argparse.ArgumentParser(description="Runs the SQL of the migration scripts through EXPLAIN and suggests indexes")
+    parser.add_argument("--scripts", nargs='+',
+                        default=[os.path.join(script_dir, "migrate_data_2024.py"), os.path.join(script_dir, "update_gencc.py")],
+                        help="Scripts to check (default: migrate_data_2024.py and update_gencc.py)")
+    parser.add_argument("--host", default='', help="Old Database host")
+    parser.add_argument("--port", default='', help="Old Host port")
+    parser.add_argument("--database", default='', help="Old Database name")
+    parser.add_argument("--user", default='', help="Old Username")
+    parser.add_argument("--password", default='', help="Old Password (default: '')")
+    parser.add_argument("--new_host", default='', help="New Database host")
+    parser.add_argument("--new_port", default='', help="New Host port")
+    parser.add_argument("--new_database", default='', help="New Database name")
+    parser.add_argument("--new_user", default='', help="New Username")
+    parser.add_argument("--new_password", default='', help="New Password (default: '')")
+    parser.add_argument("--ensembl_host", default='', help="Ensembl core Database host")
+    parser.add_argument("--ensembl_port", default='', help="Ensembl core Host port")
+    parser.add_argument("--ensembl_database", default='', help="Ensembl core Database name")
+    parser.add_argument("--ensembl_user", default='', help="Ensembl core Username")
+    parser.add_argument("--ensembl_password", default='', help="Ensembl core Password (default: '')")
+    parser.add_argument("--fail_on_findings", action="store_true", help="Exit with error if any statement has problems")
+
+    args = parser.parse_args()
+
+    databases = {
+        'old': (args.host, args.port, args.database, args.user, args.password),
+        'new': (args.new_host, args.new_port, args.new_database, args.new_user, args.new_password),
+        'core': (args.ensembl_host, args.ensembl_port, args.ensembl_database, args.ensembl_user, args.ensembl_password)
+    }
+
+    statements = []
+    for script in args.scripts:
+        statements.extend(extract_statements(script))
+
+    n_problems = 0
+    for target, (host, port, db, user, password) in databases.items():
+        if not host or not db:
+            continue
+
+        target_statements = [s for s in statements if s['target'] == target and is_explainable(s['sql'])]
+        print(f"\n### {target} database: {db} ({len(target_statements)} statements) ###")
+        results = explain_statements(host, port, db, user, password, target_statements)
+        n_problems += print_report(results)
+
+    print(f"\n{n_problems} statements to check")
+
+    if args.fail_on_findings and n_problems > 0:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
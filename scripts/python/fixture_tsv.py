@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+    Reads and writes the table files of the test-genome-DBs fixtures:
+    <directory>/<table>.txt, tab separated, MySQL escapes (\\N is NULL), as written by
+    mysqldump/SELECT INTO OUTFILE.
+
+    Usage:
+        import fixture_tsv
+        rows = fixture_tsv.read_fixture(fixtures_dir, "disease")
+        fixture_tsv.write_fixture(output_dir, "disease", rows)
+"""
+
+import os
+import re
+
+mysql_escapes = { '0':'\0', 'b':'\b', 'n':'\n', 'r':'\r', 't':'\t', 'Z':'\x1a' }
+
+def escape(value):
+    """
+        Encodes a value (None is \\N)
+    """
+    if value is None:
+        return "\\N"
+
+    value = str(value)
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace("\r", "\\r").replace("\t", "\\t")
+
+def unescape(value):
+    """
+        Decodes a value written by mysqldump/SELECT INTO OUTFILE (\\N is NULL)
+    """
+    if value == "\\N":
+        return None
+    if "\\" not in value:
+        return value
+
+    return re.sub(r"\\(.)", lambda m: mysql_escapes.get(m.group(1), m.group(1)), value, flags=re.S)
+
+def read_fixture(fixtures_dir, table):
+    """
+        Reads a fixture file (tab separated, MySQL escapes)
+        Returns a list of rows, empty if the file does not exist
+    """
+    rows = []
+    file_path = os.path.join(fixtures_dir, f"{table}.txt")
+    if not os.path.isfile(file_path):
+        return rows
+
+    # Binary mode only splits lines on \n, the carriage returns can be part of the values
+    with open(file_path, "rb") as fh:
+        for line in fh:
+            line = line.decode("utf-8").rstrip("\n")
+            if not line:
+                continue
+            rows.append([unescape(value) for value in line.split("\t")])
+
+    return rows
+
+def write_fixture(output_dir, table, rows):
+    """
+        Writes a fixture file (tab separated, MySQL escapes)
+    """
+    with open(os.path.join(output_dir, f"{table}.txt"), "w", encoding="utf-8", newline="") as output:
+        for row in rows:
+            output.write("\t".join(escape(value) for value in row) + "\n")
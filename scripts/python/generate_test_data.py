@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+    Generates a synthetic old schema (gene2phenotype) dataset for load testing.
+
+    The output directory has the same layout as the test-genome-DBs fixtures: table.sql
+    and one tab separated file per table (\\N is NULL). It can be loaded with the old
+    schema table.sql or used directly by benchmark_migration.py (--fixtures).
+
+    The reference tables (attrib, attrib_type, panel, organ, organ_panel, user, meta) are
+    copied from the fixtures. The other tables are generated with sizes relative to the
+    fixtures (scale 1 is close to the production data). The attrib combinations of the
+    G2P records and panels follow the distribution found in the fixtures.
+    The same scale and seed always generate the same data.
+
+    Usage:
+        python generate_test_data.py --output_dir g2p_x10 --scale 10 --seed 1
+"""
+
+import os
+import sys
+import random
+import shutil
+import string
+import argparse
+from datetime import datetime, timedelta
+
+import fixture_tsv
+
+default_fixtures = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..",
+                                "modules", "t", "test-genome-DBs", "homo_sapiens", "gene2phenotype")
+
+# Tables copied from the fixtures
+reference_tables = ["attrib", "attrib_type", "panel", "organ", "organ_panel", "user", "meta"]
+
+# Number of rows at scale 1
+base_sizes = { 'genomic_feature':2573,
+               'disease':4497,
+               'phenotype':4639,
+               'publication':8000,
+               'genomic_feature_disease':3341 }
+
+# Average number of rows per G2P record (genomic_feature_disease)
+per_gfd = { 'organ':1.9,
+            'phenotype':10.2,
+            'publication':2.3,
+            'extra_panel':0.12,
+            'disease_synonym':0.12,
+            'comment':0.065,
+            'log_update':0.03,
+            'panel_log_update':0.15 }
+
+first_date = datetime(2015, 7, 22, 16, 14, 7)
+last_date = datetime(2024, 6, 1, 0, 0, 0)
+
+words = ["abnormal", "atrophy", "brain", "cardiac", "cerebellar", "congenital", "cortical", "deafness",
+         "deficiency", "developmental", "dysplasia", "dystrophy", "encephalopathy", "epilepsy", "hypoplasia",
+         "intellectual", "kidney", "macular", "metabolic", "microcephaly", "muscular", "myopathy", "neuropathy",
+         "ocular", "progressive", "renal", "retinal", "skeletal", "spastic", "syndromic", "visual", "disorder"]
+
+def table_names(table_sql):
+    names = []
+    with open(table_sql, encoding="utf-8") as fh:
+        for line in fh:
+            if line.startswith("CREATE TABLE"):
+                names.append(line.split("`")[1])
+
+    return names
+
+def random_date(rnd, after=first_date):
+    seconds = int((last_date - after).total_seconds())
+    return after + timedelta(seconds=rnd.randint(0, max(seconds, 0)))
+
+def random_text(rnd, min_words, max_words):
+    return " ".join(rnd.choice(words) for _ in range(rnd.randint(min_words, max_words)))
+
+def generate_genes(rnd, n_genes):
+    """
+        Returns genomic_feature and genomic_feature_synonym rows
+    """
+    genes = []
+    synonyms = []
+    symbols = set()
+
+    for gf_id in range(1, n_genes + 1):
+        symbol = None
+        while symbol is None or symbol in symbols:
+            symbol = "".join(rnd.choice(string.ascii_uppercase) for _ in range(rnd.randint(3, 5))) + str(rnd.randint(1, 30))
+        symbols.add(symbol)
+        genes.append((gf_id, symbol, 1000 + gf_id, 10000 + gf_id, 100000 + gf_id, f"ENSG{gf_id:011}",
+                      None, None, None, None))
+
+        gene_synonyms = set()
+        for _ in range(rnd.randint(0, 9)):
+            gene_synonyms.add(symbol + rnd.choice(string.ascii_uppercase) + str(rnd.randint(1, 9)))
+        for synonym in sorted(gene_synonyms):
+            synonyms.append((gf_id, synonym))
+
+    return genes, synonyms
+
+def generate_diseases(rnd, n_diseases):
+    """
+        Returns disease, ontology_term and disease_ontology_mapping rows
+    """
+    diseases = []
+    ontology_terms = []
+    mappings = []
+
+    for disease_id in range(1, n_diseases + 1):
+        name = random_text(rnd, 2, 6).upper()
+        if rnd.random() < 0.3:
+            name += f", TYPE {rnd.randint(1, 20)}"
+        mim = 100000 + disease_id if rnd.random() < 0.7 else None
+        diseases.append((disease_id, name, mim))
+
+        # MONDO terms mapped to 30% of the diseases
+        if rnd.random() < 0.3:
+            term_id = len(ontology_terms) + 1
+            ontology_terms.append((term_id, f"MONDO:{disease_id:07}", f"{name.lower()} ({term_id})"))
+            mapped_by = sorted(rnd.sample(range(437, 445), rnd.randint(1, 2)))
+            mappings.append((len(mappings) + 1, disease_id, term_id, ",".join(str(i) for i in mapped_by)))
+
+    return diseases, ontology_terms, mappings
+
+def generate_phenotypes(rnd, n_phenotypes):
+    return [(phenotype_id, f"HP:{phenotype_id:07}", random_text(rnd, 2, 5).capitalize(), None, "HP")
+            for phenotype_id in range(1, n_phenotypes + 1)]
+
+def generate_publications(rnd, n_publications):
+    publications = []
+    for publication_id in range(1, n_publications + 1):
+        pmid = 10000000 + publication_id * 7 if rnd.random() < 0.98 else None
+        title = random_text(rnd, 6, 20).capitalize() + "."
+        if rnd.random() < 0.1:
+            title = f"<i>{title}</i>"
+        source = f"{random_text(rnd, 1, 3).title()}. {rnd.randint(1990, 2024)}" if rnd.random() < 0.9 else None
+        publications.append((publication_id, pmid, title, source))
+
+    return publications
+
+def generate_gfds(rnd, fixtures_dir, n_gfds, genes, diseases, phenotypes, publications, organ_ids, user_ids):
+    """
+        Returns the rows of the G2P record tables, the comments and the logs
+        key: table name; value: list of rows
+    """
+    tables = { name:[] for name in ["genomic_feature_disease", "genomic_feature_disease_panel",
+                                    "genomic_feature_disease_organ", "genomic_feature_disease_phenotype",
+                                    "genomic_feature_disease_publication", "GFD_disease_synonym",
+                                    "genomic_feature_disease_comment", "GFD_publication_comment",
+                                    "GFD_phenotype_comment", "genomic_feature_disease_log",
+                                    "genomic_feature_disease_panel_log", "GFD_phenotype_log"] }
+
+    # Attrib combinations found in the fixtures, picked with the same frequency
+    gfd_attribs = [tuple(row[3:11]) for row in fixture_tsv.read_fixture(fixtures_dir, "genomic_feature_disease")]
+    panel_attribs = [(row[2], row[3], row[4], row[5], row[6]) for row in fixture_tsv.read_fixture(fixtures_dir, "genomic_feature_disease_panel")]
+    if not gfd_attribs or not panel_attribs:
+        sys.exit(f"ERROR: {fixtures_dir} does not have genomic_feature_disease and genomic_feature_disease_panel data")
+
+    unique_gfds = set()
+    gfd_id = 0
+    while gfd_id < n_gfds:
+        gene = rnd.choice(genes)
+        disease = rnd.choice(diseases)
+        attribs = rnd.choice(gfd_attribs)
+        # unique key: genomic_feature_id, allelic_requirement_attrib, mutation_consequence_attrib, disease_id
+        key = (gene[0], attribs[1], attribs[4], disease[0])
+        if key in unique_gfds:
+            continue
+        unique_gfds.add(key)
+        gfd_id += 1
+
+        created = random_date(rnd)
+        user_id = rnd.choice(user_ids)
+        tables["genomic_feature_disease"].append((gfd_id, gene[0], disease[0]) + attribs)
+        tables["genomic_feature_disease_log"].append([gfd_id, gene[0], disease[0]] + list(attribs[:7]) + [created, user_id, "create"])
+        if rnd.random() < per_gfd['log_update']:
+            tables["genomic_feature_disease_log"].append([gfd_id, gene[0], disease[0]] + list(attribs[:7]) + [random_date(rnd, created), rnd.choice(user_ids), "update"])
+
+        # Panels
+        panels = {}
+        n_panels = 1 + (1 if rnd.random() < per_gfd['extra_panel'] else 0)
+        while len(panels) < n_panels:
+            panel = rnd.choice(panel_attribs)
+            panels[panel[4]] = panel
+        for panel in panels.values():
+            gfd_panel_id = len(tables["genomic_feature_disease_panel"]) + 1
+            tables["genomic_feature_disease_panel"].append((gfd_panel_id, gfd_id) + panel)
+            tables["genomic_feature_disease_panel_log"].append([gfd_panel_id, gfd_id] + list(panel) + [created, user_id, "create"])
+            if rnd.random() < per_gfd['panel_log_update']:
+                tables["genomic_feature_disease_panel_log"].append([gfd_panel_id, gfd_id] + list(panel) + [random_date(rnd, created), rnd.choice(user_ids), "update"])
+        first_panel = next(iter(panels))
+
+        for organ_id in rnd.sample(organ_ids, min(len(organ_ids), max(0, round(rnd.gauss(per_gfd['organ'], 1))))):
+            tables["genomic_feature_disease_organ"].append((len(tables["genomic_feature_disease_organ"]) + 1, gfd_id, organ_id))
+
+        for phenotype in rnd.sample(phenotypes, min(len(phenotypes), round(rnd.expovariate(1 / per_gfd['phenotype'])))):
+            gfd_phenotype_id = len(tables["genomic_feature_disease_phenotype"]) + 1
+            tables["genomic_feature_disease_phenotype"].append((gfd_phenotype_id, gfd_id, phenotype[0]))
+            if rnd.random() < 0.02:
+                tables["GFD_phenotype_log"].append((gfd_phenotype_id, gfd_id, phenotype[0], 1, first_panel,
+                                                    random_date(rnd, created), rnd.choice(user_ids), "create"))
+            if rnd.random() < 0.001:
+                tables["GFD_phenotype_comment"].append((gfd_phenotype_id, random_text(rnd, 3, 10), random_date(rnd, created), rnd.choice(user_ids)))
+
+        for publication in rnd.sample(publications, min(len(publications), round(rnd.expovariate(1 / per_gfd['publication'])))):
+            gfd_publication_id = len(tables["genomic_feature_disease_publication"]) + 1
+            tables["genomic_feature_disease_publication"].append((gfd_publication_id, gfd_id, publication[0]))
+            if rnd.random() < 0.01:
+                tables["GFD_publication_comment"].append((gfd_publication_id, random_text(rnd, 5, 15), random_date(rnd, created), rnd.choice(user_ids)))
+
+        if rnd.random() < per_gfd['disease_synonym']:
+            tables["GFD_disease_synonym"].append((len(tables["GFD_disease_synonym"]) + 1, gfd_id, rnd.choice(diseases)[0]))
+
+        if rnd.random() < per_gfd['comment']:
+            tables["genomic_feature_disease_comment"].append((len(tables["genomic_feature_disease_comment"]) + 1, gfd_id,
+                                                              random_text(rnd, 5, 30), random_date(rnd, created),
+                                                              rnd.choice(user_ids), rnd.randint(0, 1)))
+
+    # Add the primary keys of the comments and logs
+    for table in ["GFD_publication_comment", "GFD_phenotype_comment", "GFD_phenotype_log"]:
+        tables[table] = [(i + 1,) + tuple(row) for i, row in enumerate(tables[table])]
+    # The logs are ordered by date like in production
+    for table in ["genomic_feature_disease_log", "genomic_feature_disease_panel_log"]:
+        date_column = len(tables[table][0]) - 3
+        tables[table].sort(key=lambda row: row[date_column])
+        tables[table] = [(i + 1,) + tuple(row) for i, row in enumerate(tables[table])]
+
+    return tables
+
+def generate(fixtures_dir, output_dir, scale, seed):
+    """
+        Generates the dataset and returns the number of rows per table
+    """
+    rnd = random.Random(seed)
+    counts = {}
+
+    os.makedirs(output_dir, exist_ok=True)
+    table_sql = os.path.join(fixtures_dir, "table.sql")
+    shutil.copy(table_sql, os.path.join(output_dir, "table.sql"))
+
+    tables = {}
+    for table in reference_tables:
+        tables[table] = fixture_tsv.read_fixture(fixtures_dir, table)
+
+    organ_ids = [int(row[0]) for row in tables["organ"]]
+    user_ids = [int(row[0]) for row in tables["user"]]
+
+    genes, tables["genomic_feature_synonym"] = generate_genes(rnd, max(1, round(base_sizes['genomic_feature'] * scale)))
+    tables["genomic_feature"] = genes
+    diseases, tables["ontology_term"], tables["disease_ontology_mapping"] = generate_diseases(rnd, max(1, round(base_sizes['disease'] * scale)))
+    tables["disease"] = diseases
+    tables["phenotype"] = phenotypes = generate_phenotypes(rnd, max(1, round(base_sizes['phenotype'] * scale)))
+    tables["publication"] = publications = generate_publications(rnd, max(1, round(base_sizes['publication'] * scale)))
+
+    n_gfds = max(1, round(base_sizes['genomic_feature_disease'] * scale))
+    if n_gfds > len(genes) * len(diseases):
+        sys.exit("ERROR: scale too small to generate unique G2P records")
+    tables.update(generate_gfds(rnd, fixtures_dir, n_gfds, genes, diseases, phenotypes, publications, organ_ids, user_ids))
+
+    # Tables not generated are written empty so that every table has a file
+    for table in table_names(table_sql):
+        rows = tables.get(table, [])
+        fixture_tsv.write_fixture(output_dir, table, rows)
+        counts[table] = len(rows)
+
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description="Generates a synthetic old schema dataset for load testing")
+    parser.add_argument("--output_dir", required=True, help="Output directory")
+    parser.add_argument("--scale", type=float, default=1, help="Scale factor, 1 is close to production size (default: 1)")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed (default: 1)")
+    parser.add_argument("--fixtures", default=default_fixtures, help="Directory with table.sql and the reference tables")
+
+    args = parser.parse_args()
+
+    if not os.path.isfile(os.path.join(args.fixtures, "table.sql")):
+        sys.exit(f"ERROR: {args.fixtures}/table.sql not found")
+    if args.scale <= 0:
+        sys.exit("ERROR: --scale has to be greater than 0")
+
+    counts = generate(args.fixtures, args.output_dir, args.scale, args.seed)
+
+    print(f"INFO: Data written to {args.output_dir} (scale {args.scale}, seed {args.seed})")
+    for table, count in sorted(counts.items()):
+        if count:
+            print(f"    {table}: {count}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+    Record/replay of the HTTP requests made by the G2P python scripts (OLS, OMIM, EuropePMC).
+
+    Record mode sends the requests to the live endpoints and saves the responses to a
+    cassette (gzipped JSON lines) when the script exits.
+    Replay mode answers the requests from the cassette, in-process (transport adapter)
+    or through a local HTTP server. Replay can add latency and errors (HTTP 503)
+    to measure the behaviour of the scripts with slow or unreliable services.
+    The errors are picked with a fixed seed, the same run always fails the same requests.
+
+    The OMIM API key is removed from the URLs before they are saved.
+
+    Usage:
+        import http_cassette
+        http_cassette.install("ols_omim_epmc.jsonl.gz", mode="record")
+        http_cassette.install("ols_omim_epmc.jsonl.gz", mode="replay", latency=0.05, error_rate=0.01)
+
+        python http_cassette.py serve --cassette ols_omim_epmc.jsonl.gz --port 8765 --latency 0.05
+        python migrate_data_2024.py ... --http_cassette ols_omim_epmc.jsonl.gz --http_mode replay --http_server http://127.0.0.1:8765
+        python http_cassette.py info --cassette ols_omim_epmc.jsonl.gz
+"""
+
+import sys
+import gzip
+import json
+import time
+import base64
+import random
+import atexit
+import argparse
+import threading
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+modes = ["record", "replay"]
+
+# Query parameters not saved in the cassette
+secret_params = {"apikey"}
+
+def normalise_url(url):
+    """
+        Returns the URL without secrets and with the query parameters sorted
+    """
+    parts = urlsplit(url)
+    query = [(key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+             if key.lower() not in secret_params]
+
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, urlencode(sorted(query)), ""))
+
+def request_key(method, url):
+    return f"{method.upper()} {normalise_url(url)}"
+
+class Cassette:
+    """
+        Responses saved by request (method + normalised URL)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {} # key: request key; value: dict with status, reason, headers, body
+        self.lock = threading.Lock()
+
+    def load(self):
+        with gzip.open(self.path, "rt", encoding="utf-8") as fh:
+            for line in fh:
+                entry = json.loads(line)
+                self.entries[entry['key']] = entry
+
+        return self
+
+    def save(self):
+        with self.lock:
+            with gzip.open(self.path, "wt", encoding="utf-8") as output:
+                for key in sorted(self.entries):
+                    output.write(json.dumps(self.entries[key], sort_keys=True) + "\n")
+
+    def add(self, method, url, response):
+        entry = { 'key':request_key(method, url),
+                  'status':response.status_code,
+                  'reason':response.reason,
+                  'headers':{ 'Content-Type':response.headers.get('Content-Type', '') } }
+        try:
+            entry['body'] = response.content.decode("utf-8")
+        except UnicodeDecodeError:
+            entry['body_base64'] = base64.b64encode(response.content).decode("ascii")
+
+        with self.lock:
+            self.entries[entry['key']] = entry
+
+    def get(self, method, url):
+        return self.entries.get(request_key(method, url))
+
+def entry_body(entry):
+    if 'body_base64' in entry:
+        return base64.b64decode(entry['body_base64'])
+
+    return entry['body'].encode("utf-8")
+
+class Faults:
+    """
+        Latency and errors added to the replayed responses
+    """
+
+    def __init__(self, latency=0, error_rate=0, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def apply(self):
+        """
+            Waits for the latency and returns True if the request has to fail
+        """
+        if self.latency:
+            time.sleep(self.latency)
+        if not self.error_rate:
+            return False
+        with self.lock:
+            return self.random.random() < self.error_rate
+
+class CassetteAdapter(BaseAdapter):
+    """
+        Transport adapter that records the responses or replays them from the cassette
+    """
+
+    def __init__(self, cassette, mode, faults=None, server_url=None):
+        super().__init__()
+        self.cassette = cassette
+        self.mode = mode
+        self.faults = faults or Faults()
+        self.server_url = server_url
+        self.http = HTTPAdapter()
+        self.counts = { 'requests':0, 'missing':0, 'errors':0 }
+
+    def send(self, request, **kwargs):
+        self.counts['requests'] += 1
+
+        if self.mode == "record":
+            response = self.http.send(request, **kwargs)
+            self.cassette.add(request.method, request.url, response)
+            return response
+
+        if self.server_url:
+            # The server adds the latency and errors
+            parts = urlsplit(request.url)
+            request.url = f"{self.server_url}/{parts.netloc}{parts.path}" + (f"?{parts.query}" if parts.query else "")
+            return self.http.send(request, **kwargs)
+
+        if self.faults.apply():
+            self.counts['errors'] += 1
+            return self.build_response(request, 503, "Service Unavailable", {}, b"")
+
+        entry = self.cassette.get(request.method, request.url)
+        if entry is None:
+            self.counts['missing'] += 1
+            return self.build_response(request, 404, "Not Found", {}, b"")
+
+        return self.build_response(request, entry['status'], entry['reason'], entry['headers'], entry_body(entry))
+
+    def build_response(self, request, status, reason, headers, body):
+        response = requests.Response()
+        response.status_code = status
+        response.reason = reason
+        response.headers = CaseInsensitiveDict(headers)
+        response._content = body
+        response.encoding = "utf-8"
+        response.url = request.url
+        response.request = request
+        response.connection = self
+
+        return response
+
+    def close(self):
+        self.http.close()
+
+_adapter = None
+
+def install(cassette_file, mode="replay", latency=0, error_rate=0, seed=0, server_url=None):
+    """
+        Sends all the requests made with the requests module through the cassette.
+        In record mode the cassette is saved when the script exits.
+        Returns the adapter (adapter.counts has the number of requests, missing responses and errors).
+    """
+    global _adapter
+
+    if mode not in modes:
+        raise ValueError(f"Unknown cassette mode '{mode}', use one of: {', '.join(modes)}")
+
+    if _adapter is not None and _adapter.cassette.path == cassette_file and _adapter.mode == mode:
+        return _adapter
+
+    cassette = Cassette(cassette_file)
+    if mode == "replay" and not server_url:
+        cassette.load()
+
+    _adapter = CassetteAdapter(cassette, mode, Faults(latency, error_rate, seed), server_url)
+    requests.Session.get_adapter = lambda session, url: _adapter
+
+    if mode == "record":
+        atexit.register(cassette.save)
+
+    return _adapter
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    """
+        Answers /<host>/<path>?<query> with the response saved for https://<host>/<path>?<query>
+        (or http://)
+    """
+    cassette = None
+    faults = None
+
+    def do_GET(self):
+        host, _, path = self.path.lstrip("/").partition("/")
+        entry = self.cassette.get("GET", f"https://{host}/{path}") or self.cassette.get("GET", f"http://{host}/{path}")
+
+        if self.faults.apply():
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        if entry is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        body = entry_body(entry)
+        self.send_response(entry['status'])
+        self.send_header("Content-Type", entry['headers'].get('Content-Type', 'application/json'))
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_server(cassette_file, host="127.0.0.1", port=0, latency=0, error_rate=0, seed=0):
+    """
+        Starts the replay server in a thread and returns it
+    """
+    ReplayHandler.cassette = Cassette(cassette_file).load()
+    ReplayHandler.faults = Faults(latency, error_rate, seed)
+    server = ThreadingHTTPServer((host, port), ReplayHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Record/replay of the HTTP requests made by the G2P scripts")
+    parser.add_argument("command", choices=["serve", "info"], help="serve: start the replay server; info: summary of the cassette")
+    parser.add_argument("--cassette", required=True, help="Cassette file (.jsonl.gz)")
+    parser.add_argument("--host", default="127.0.0.1", help="Server host (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8765, help="Server port (default: 8765)")
+    parser.add_argument("--latency", type=float, default=0, help="Latency added to each response in seconds (default: 0)")
+    parser.add_argument("--error_rate", type=float, default=0, help="Fraction of requests that fail with HTTP 503 (default: 0)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed to pick the failed requests (default: 0)")
+
+    args = parser.parse_args()
+
+    if args.command == "info":
+        cassette = Cassette(args.cassette).load()
+        hosts = {}
+        for key, entry in cassette.entries.items():
+            host = urlsplit(key.split(" ", 1)[1]).netloc
+            hosts.setdefault(host, {}).setdefault(entry['status'], 0)
+            hosts[host][entry['status']] += 1
+        print(f"{len(cassette.entries)} responses in {args.cassette}")
+        for host, statuses in sorted(hosts.items()):
+            print(f"    {host}: " + ", ".join(f"{status}={count}" for status, count in sorted(statuses.items())))
+        return
+
+    server = start_server(args.cassette, args.host, args.port, args.latency, args.error_rate, args.seed)
+    print(f"INFO: Replaying {args.cassette} on http://{args.host}:{server.server_address[1]} (Ctrl-C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+        sys.exit(0)
+
+if __name__ == '__main__':
+    main()
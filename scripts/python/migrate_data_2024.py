@@ -16,19 +16,46 @@
 
 """
 
+import os
 import sys
+import json
+import time
 import argparse
 import re
-import mysql.connector
-from mysql.connector import Error
+import db_backend
+from db_backend import Error
 import requests
 from datetime import datetime, date
+from contextlib import contextmanager
 import faulthandler
 import pytz
 import pandas as pd
+import query_stats
+import http_cassette
+import ensembl_cache
+import check_integrity
 
 faulthandler.enable()
 
+stage_timings = {} # key: stage name; value: run time in seconds
+
+@contextmanager
+def timed_stage(name):
+    """
+        Records the run time of a stage of the migration in stage_timings
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_timings[name] = time.perf_counter() - start
+
+def print_stage_timings():
+    print("INFO: Run time per stage:")
+    for stage_name, run_time in stage_timings.items():
+        print(f"    {stage_name}: {run_time:.2f} s")
+    print(f"INFO: Total run time: {sum(stage_timings.values()):.2f} s\n")
+
 ### Fetch data from current db ###
 
 """
@@ -52,11 +79,11 @@ def fetch_attribs(host, port, db, user, password):
                      FROM attrib a
                      LEFT JOIN attrib_type at ON a.attrib_type_id = at.attrib_type_id """
     
-    connection = mysql.connector.connect(host=host,
-                                         database=db,
-                                         user=user,
-                                         port=port,
-                                         password=password)
+    connection = db_backend.connect(host=host,
+                                    database=db,
+                                    user=user,
+                                    port=port,
+                                    password=password)
 
     try:
         if connection.is_connected():
@@ -104,11 +131,11 @@ def dump_panels(host, port, db, user, password):
     sql_query = f""" SELECT name, is_visible
                      FROM panel """
     
-    connection = mysql.connector.connect(host=host,
-                                         database=db,
-                                         user=user,
-                                         port=port,
-                                         password=password)
+    connection = db_backend.connect(host=host,
+                                    database=db,
+                                    user=user,
+                                    port=port,
+                                    password=password)
 
     try:
         if connection.is_connected():
@@ -136,11 +163,11 @@ def dump_users(host, port, db, user, password, attribs):
     sql_query_user = f""" SELECT username, email, panel_attrib
                           FROM user """
     
-    connection = mysql.connector.connect(host=host,
-                                         database=db,
-                                         user=user,
-                                         port=port,
-                                         password=password)
+    connection = db_backend.connect(host=host,
+                                    database=db,
+                                    user=user,
+                                    port=port,
+                                    password=password)
 
     try:
         if connection.is_connected():
@@ -186,11 +213,11 @@ def dump_publications(host, port, db, user, password):
                          FROM genomic_feature_disease_publication
                          WHERE publication_id in ( SELECT publication_id FROM publication WHERE pmid = %s ) """
 
-    connection = mysql.connector.connect(host=host,
-                                         database=db,
-                                         user=user,
-                                         port=port,
-                                         password=password)
+    connection = db_backend.connect(host=host,
+                                    database=db,
+                                    user=user,
+                                    port=port,
+                                    password=password)
 
     try:
         if connection.is_connected():
@@ -238,11 +265,11 @@ def dump_phenotype(host, port, db, user, password):
     sql_query_user = f""" SELECT phenotype_id, stable_id, name, description, source
                           FROM phenotype """
     
-    connection = mysql.connector.connect(host=host,
-                                         database=db,
-                                         user=user,
-                                         port=port,
-                                         password=password)
+    connection = db_backend.connect(host=host,
+                                    database=db,
+                                    user=user,
+                                    port=port,
+                                    password=password)
 
     try:
         if connection.is_connected():
@@ -274,11 +301,11 @@ def dump_organ(host, port, db, user, password):
     sql_query_user = f""" SELECT organ_id, name
                           FROM organ """
     
-    connection = mysql.connector.connect(host=host,
-                                         database=db,
-                                         user=user,
-                                         port=port,
-                                         password=password)
+    connection = db_backend.connect(host=host,
+                                    database=db,
+                                    user=user,
+                                    port=port,
+                                    password=password)
 
     try:
         if connection.is_connected():
@@ -305,11 +332,11 @@ def dump_ontology(host, port, db, user, password, attribs):
                             LEFT JOIN ontology_term o ON d.ontology_term_id = o.ontology_term_id
                         """
 
-    connection = mysql.connector.connect(host=host,
-                                         database=db,
-                                         user=user,
-                                         port=port,
-                                         password=password)
+    connection = db_backend.connect(host=host,
+                                    database=db,
+                                    user=user,
+                                    port=port,
+                                    password=password)
 
     try:
         if connection.is_connected():
@@ -372,11 +399,11 @@ def dump_diseases(host, port, db, user, password):
                     where gf.gene_symbol is not null and gfdp.panel_attrib is not null
                     GROUP BY BINARY d.name, gf.gene_symbol order by d.name """
 
-    connection = mysql.connector.connect(host=host,
-                                         database=db,
-                                         user=user,
-                                         port=port,
-                                         password=password)
+    connection = db_backend.connect(host=host,
+                                    database=db,
+                                    user=user,
+                                    port=port,
+                                    password=password)
 
     try:
         if connection.is_connected():
@@ -420,11 +447,11 @@ def dump_genes(host, port, db, user, password):
     sql_query = f""" SELECT genomic_feature_id, gene_symbol, hgnc_id, mim, ensembl_stable_id
                      FROM genomic_feature """
     
-    connection = mysql.connector.connect(host=host,
-                                         database=db,
-                                         user=user,
-                                         port=port,
-                                         password=password)
+    connection = db_backend.connect(host=host,
+                                    database=db,
+                                    user=user,
+                                    port=port,
+                                    password=password)
 
     try:
         if connection.is_connected():
@@ -447,7 +474,12 @@ def dump_genes(host, port, db, user, password):
 
     return result
 
-def dump_gfd(host, port, db, user, password, attribs):
+def dump_gfd(host, port, db, user, password, attribs, gfd_ids=None):
+    """
+        Returns the GFDs in a panel (except panel 46) with their data, the dates of the last updates
+        and the disease synonyms.
+        If gfd_ids is defined only these GFDs are returned (delta migration).
+    """
     result = {}
     last_update = {}
     last_update_panel = {}
@@ -502,16 +534,27 @@ def dump_gfd(host, port, db, user, password, attribs):
                                         LEFT JOIN disease d ON d.disease_id = g.disease_id
                                     """
 
-    connection = mysql.connector.connect(host=host,
-                                         database=db,
-                                         user=user,
-                                         port=port,
-                                         password=password)
+    gfd_params = None
+    if gfd_ids is not None:
+        if len(gfd_ids) == 0:
+            return result, last_update, last_update_panel, disease_synonyms
+        gfd_params = sorted(gfd_ids)
+        placeholders = ", ".join(["%s"] * len(gfd_params))
+        sql_query += f" WHERE gfd.genomic_feature_disease_id IN ({placeholders})"
+        sql_query_date += f" AND gfd.genomic_feature_disease_id IN ({placeholders})"
+        sql_query_date_panel += f" AND gfd.genomic_feature_disease_id IN ({placeholders})"
+        sql_query_gfd_disease_synonym += f" WHERE g.genomic_feature_disease_id IN ({placeholders})"
+
+    connection = db_backend.connect(host=host,
+                                    database=db,
+                                    user=user,
+                                    port=port,
+                                    password=password)
 
     try:
         if connection.is_connected():
             cursor = connection.cursor()
-            cursor.execute(sql_query)
+            cursor.execute(sql_query, gfd_params)
             data = cursor.fetchall()
             for row in data:
                 save = 0
@@ -534,24 +577,11 @@ def dump_gfd(host, port, db, user, password, attribs):
                 #     print("--- Not found in panel ---")
                 
                 if save == 1:
-                    allelic_requirement = attribs[int(list(row[4])[0])]['attrib_value']
-                    cross_cutting_modifier = []
-                    if row[5] is not None:
-                        for ccm in list(row[5]):
-                            cross_cutting_modifier.append(attribs[int(ccm)]['attrib_value'])
-
-                    mutation_consequence = []
-                    for mc in list(row[6]):
-                        mutation_consequence.append(attribs[int(mc)]['attrib_value'])
-                    mc_flag = []
-                    if row[7] is not None:
-                        for mc in list(row[7]):
-                            mc_flag.append(attribs[int(mc)]['attrib_value'])
-
-                    variant_consequence = []
-                    if row[8] is not None:
-                        for mc in list(row[8]):
-                            variant_consequence.append(attribs[int(mc)]['attrib_value'])
+                    allelic_requirement = first_set_attrib(row[4], attribs)
+                    cross_cutting_modifier = decode_set_attrib(row[5], attribs)
+                    mutation_consequence = decode_set_attrib(row[6], attribs)
+                    mc_flag = decode_set_attrib(row[7], attribs)
+                    variant_consequence = decode_set_attrib(row[8], attribs)
 
                     organs = []
                     cursor.execute(sql_query_organ, [gfd_id])
@@ -602,7 +632,7 @@ def dump_gfd(host, port, db, user, password, attribs):
                                         'phenotypes':phenotypes,
                                         'comments': comments }
 
-            cursor.execute(sql_query_date)
+            cursor.execute(sql_query_date, gfd_params)
             data_date = cursor.fetchall()
             for row_date in data_date:
                 if row_date[0] in last_update:
@@ -611,7 +641,7 @@ def dump_gfd(host, port, db, user, password, attribs):
                 else:
                     last_update[row_date[0]] = row_date[1]
 
-            cursor.execute(sql_query_date_panel)
+            cursor.execute(sql_query_date_panel, gfd_params)
             data_date = cursor.fetchall()
             for row_date in data_date:
                 if row_date[0] in last_update_panel:
@@ -620,7 +650,7 @@ def dump_gfd(host, port, db, user, password, attribs):
                 else:
                     last_update_panel[row_date[0]] = row_date[1]
 
-            cursor.execute(sql_query_gfd_disease_synonym)
+            cursor.execute(sql_query_gfd_disease_synonym, gfd_params)
             data_syn = cursor.fetchall()
             for row_date in data_syn:
                 if row_date[0] in disease_synonyms:
@@ -637,7 +667,17 @@ def dump_gfd(host, port, db, user, password, attribs):
 
     return result, last_update, last_update_panel, disease_synonyms
 
-def dump_logs(host, port, db, user, password):
+# Log tables of the old schema (table, id column), the delta migration reads the logs by id
+log_tables = [ ("genomic_feature_disease_log", "genomic_feature_disease_log_id"),
+               ("genomic_feature_disease_panel_log", "genomic_feature_disease_panel_log_id"),
+               ("GFD_phenotype_log", "GFD_phenotype_log_id") ]
+
+def dump_logs(host, port, db, user, password, since=None, until=None):
+    """
+        Returns the logs of the GFDs, panels and phenotypes by GFD id.
+        since and until (log ids by log table, see fetch_log_high_water_mark()) select the logs
+        after since and up to until (delta migration).
+    """
     gfd_log = {}
     gfd_panel_log = {}
     gfd_phenotype_log = {}
@@ -654,16 +694,34 @@ def dump_logs(host, port, db, user, password):
                                       FROM GFD_phenotype_log l 
                                       LEFT JOIN user u ON u.user_id = l.user_id """
 
-    connection = mysql.connector.connect(host=host,
-                                         database=db,
-                                         user=user,
-                                         port=port,
-                                         password=password)
+    log_params = {}
+    for table, id_column in log_tables:
+        log_filter = []
+        log_params[table] = []
+        if since is not None:
+            log_filter.append(f"l.{id_column} > %s")
+            log_params[table].append(since.get(table, 0))
+        if until is not None:
+            log_filter.append(f"l.{id_column} <= %s")
+            log_params[table].append(until.get(table, 0))
+        if log_filter:
+            if table == "genomic_feature_disease_log":
+                sql_query_gfd_log += " WHERE " + " AND ".join(log_filter)
+            elif table == "genomic_feature_disease_panel_log":
+                sql_query_gfd_panel_log += " WHERE " + " AND ".join(log_filter)
+            else:
+                sql_query_gfd_phenotype_log += " WHERE " + " AND ".join(log_filter)
+
+    connection = db_backend.connect(host=host,
+                                    database=db,
+                                    user=user,
+                                    port=port,
+                                    password=password)
 
     try:
         if connection.is_connected():
             cursor = connection.cursor()
-            cursor.execute(sql_query_gfd_log)
+            cursor.execute(sql_query_gfd_log, log_params["genomic_feature_disease_log"] or None)
             data = cursor.fetchall()
             for row in data:
                 if row[0] not in gfd_log:
@@ -677,7 +735,7 @@ def dump_logs(host, port, db, user, password):
                                              'username':row[3]
                                            })
 
-            cursor.execute(sql_query_gfd_panel_log)
+            cursor.execute(sql_query_gfd_panel_log, log_params["genomic_feature_disease_panel_log"] or None)
             data = cursor.fetchall()
             for row in data:
                 if row[0] not in gfd_panel_log:
@@ -691,7 +749,7 @@ def dump_logs(host, port, db, user, password):
                                                    'username':row[3]
                                                 })
 
-            cursor.execute(sql_query_gfd_phenotype_log)
+            cursor.execute(sql_query_gfd_phenotype_log, log_params["GFD_phenotype_log"] or None)
             data = cursor.fetchall()
             for row in data:
                 if row[0] not in gfd_phenotype_log:
@@ -753,6 +811,56 @@ def get_omim(id):
 
     return disease, description
 
+def decode_set_attrib(value, attribs):
+    """
+        Decodes a SET column with attrib ids into the list of attrib values, sorted by attrib id
+        (the SET is returned as a python set, its order changes with the hash seed of the process).
+        Returns an empty list if the column is NULL.
+    """
+    if value is None:
+        return []
+
+    return [attribs[attrib_id]['attrib_value'] for attrib_id in sorted(int(attrib_id) for attrib_id in value)]
+
+def first_set_attrib(value, attribs):
+    """
+        Returns the value of a SET column with one attrib expected (e.g. allelic requirement):
+        the value with the lowest attrib id if the SET has several values, None if the column is NULL.
+    """
+    values = decode_set_attrib(value, attribs)
+
+    return values[0] if values else None
+
+def make_date_aware(date_value):
+    """
+        Returns the datetime (seconds precision) aware of the Europe/London timezone
+    """
+    timezone = pytz.timezone("Europe/London")
+    date_str = date_value.strftime("%Y-%m-%d %H:%M:%S")
+    date_obj = datetime.strptime(date_str, '%Y-%m-%d %H:%M:%S')
+
+    return timezone.localize(date_obj)
+
+def make_dates_aware(dates):
+    """
+        Returns a dict with the datetimes (seconds precision) aware of the Europe/London timezone
+        key: naive datetime; value: aware datetime
+        The Europe/London offset only changes on the hour, it is calculated once per hour.
+        Same result as make_date_aware().
+    """
+    timezone = pytz.timezone("Europe/London")
+    hour_tzinfo = {}
+    aware_dates = {}
+
+    for date_value in dates:
+        date_obj = date_value.replace(microsecond=0)
+        hour = date_obj.replace(minute=0, second=0)
+        if hour not in hour_tzinfo:
+            hour_tzinfo[hour] = timezone.localize(hour).tzinfo
+        aware_dates[date_value] = date_obj.replace(tzinfo=hour_tzinfo[hour])
+
+    return aware_dates
+
 def clean_title(title):
     new_title = title.replace("<i>", "").replace("</i>", "").replace("<b>", "").replace("</b>", "").replace("Ã¨", "e").replace("Ã¼", "u").replace("Ã©", "e").replace("Ã¤", "a")
 
@@ -824,11 +932,11 @@ def populate_source(host, port, db, user, password):
                      VALUES (%s, %s, %s)
                  """
     
-    connection = mysql.connector.connect(host=host,
-                                         database=db,
-                                         user=user,
-                                         port=port,
-                                         password=password)
+    connection = db_backend.connect(host=host,
+                                    database=db,
+                                    user=user,
+                                    port=port,
+                                    password=password)
 
     try:
         if connection.is_connected():
@@ -844,31 +952,32 @@ def populate_source(host, port, db, user, password):
             cursor.close()
             connection.close()
 
+# Allelic requirement and cross cutting modifier: old attrib value -> new attrib value
+ar_mapping = {
+    'biallelic_autosomal':'biallelic_autosomal',
+    'biallelic_PAR':'biallelic_PAR',
+    'mitochondrial':'mitochondrial',
+    'monoallelic_autosomal':'monoallelic_autosomal',
+    'monoallelic_PAR':'monoallelic_PAR',
+    'monoallelic_X_hem':'monoallelic_X_hemizygous',
+    'monoallelic_X_het':'monoallelic_X_heterozygous',
+    'monoallelic_Y_hem':'monoallelic_Y_hemizygous'
+}
+
+ccm_mapping = {
+    'imprinted':'imprinted region',
+    'potential IF':'potential secondary finding',
+    # 'requires heterozygosity':'requires heterozygosity', # not being migrated
+    'typically de novo':'typically de novo',
+    'typically mosaic':'typically mosaic',
+    # 'typified by age related penetrance':'typified by age related penetrance', # not being migrated
+    'typified by reduced penetrance':'typified by incomplete penetrance',
+    # 'incomplete penetrance':'incomplete penetrance' # not being migrated
+}
+
 def populate_attribs(host, port, db, user, password, attribs):
     attrib_types = {}
 
-    ar_mapping = {
-        'biallelic_autosomal':'biallelic_autosomal',
-        'biallelic_PAR':'biallelic_PAR',
-        'mitochondrial':'mitochondrial',
-        'monoallelic_autosomal':'monoallelic_autosomal',
-        'monoallelic_PAR':'monoallelic_PAR',
-        'monoallelic_X_hem':'monoallelic_X_hemizygous',
-        'monoallelic_X_het':'monoallelic_X_heterozygous',
-        'monoallelic_Y_hem':'monoallelic_Y_hemizygous'
-    }
-
-    ccm_mapping = {
-        'imprinted':'imprinted region',
-        'potential IF':'potential secondary finding',
-        # 'requires heterozygosity':'requires heterozygosity',# not being migrated
-        'typically de novo':'typically de novo',
-        'typically mosaic':'typically mosaic',
-        # 'typified by age related penetrance':'typified by age related penetrance', # not being migrated
-        'typified by reduced penetrance':'typified by incomplete penetrance',
-        # 'incomplete penetrance':'incomplete penetrance' # not being migrated
-    }
-
     ccm_description = {
         'imprinted region': 'Requires that the abnormal allele be paternal or maternal in origin, depending on the disease-gene relationship. Imprinting refers to a normal developmental process in which either the paternal or maternal allele is inactivated, depending on the specific locus, thus leading to expression from only one copy of the gene. Disease typically manifests when a deleterious variant is inherited from a parent whose copy of the gene would normally be expressed, but not when a deleterious variant is inherited from a parent whose copy of the gene would normally be inactivated.',
         'potential secondary finding': 'This includes ACMG Secondary Findings and/or late onset conditions.'
@@ -932,11 +1041,11 @@ def populate_attribs(host, port, db, user, password, attribs):
     inserted_attrib = {}
     group_type_id = 1
 
-    connection = mysql.connector.connect(host=host,
-                                         database=db,
-                                         user=user,
-                                         port=port,
-                                         password=password)
+    connection = db_backend.connect(host=host,
+                                    database=db,
+                                    user=user,
+                                    port=port,
+                                    password=password)
 
     try:
         if connection.is_connected():
@@ -1102,11 +1211,11 @@ def populate_new_attribs(host, port, db, user, password):
 
     inserted = {}
 
-    connection = mysql.connector.connect(host=host,
-                                         database=db,
-                                         user=user,
-                                         port=port,
-                                         password=password)
+    connection = db_backend.connect(host=host,
+                                    database=db,
+                                    user=user,
+                                    port=port,
+                                    password=password)
 
     try:
         if connection.is_connected():
@@ -1195,11 +1304,11 @@ def populates_user_panel(host, port, db, user, password, user_panel_data, panels
     # set a fake password
     fake_password = "g2p_default_2024"
 
-    connection = mysql.connector.connect(host=host,
-                                         database=db,
-                                         user=user,
-                                         port=port,
-                                         password=password)
+    connection = db_backend.connect(host=host,
+                                    database=db,
+                                    user=user,
+                                    port=port,
+                                    password=password)
 
     try:
         if connection.is_connected():
@@ -1257,11 +1366,11 @@ def populates_publications(host, port, db, user, password, publication_data):
     inserted_publication = {}
     pmids = {}
 
-    connection = mysql.connector.connect(host=host,
-                                         database=db,
-                                         user=user,
-                                         port=port,
-                                         password=password)
+    connection = db_backend.connect(host=host,
+                                    database=db,
+                                    user=user,
+                                    port=port,
+                                    password=password)
 
     try:
         if connection.is_connected():
@@ -1316,11 +1425,11 @@ def populates_phenotypes(host, port, db, user, password, phenotype_data):
     group_type_id = fetch_attrib(host, port, db, user, password, 'phenotype')
     source_id = fetch_source(host, port, db, user, password, 'HPO')
 
-    connection = mysql.connector.connect(host=host,
-                                         database=db,
-                                         user=user,
-                                         port=port,
-                                         password=password)
+    connection = db_backend.connect(host=host,
+                                    database=db,
+                                    user=user,
+                                    port=port,
+                                    password=password)
 
     try:
         if connection.is_connected():
@@ -1348,11 +1457,11 @@ def populates_organs(host, port, db, user, password, organ_data):
                      VALUES (%s)
                  """
 
-    connection = mysql.connector.connect(host=host,
-                                         database=db,
-                                         user=user,
-                                         port=port,
-                                         password=password)
+    connection = db_backend.connect(host=host,
+                                    database=db,
+                                    user=user,
+                                    port=port,
+                                    password=password)
 
     try:
         if connection.is_connected():
@@ -1414,11 +1523,11 @@ def populates_disease(host, port, db, user, password, disease_data, disease_onto
     omim_ontology_inserted = {}
     omim_ontology_term_inserted = {}
 
-    connection = mysql.connector.connect(host=host,
-                                         database=db,
-                                         user=user,
-                                         port=port,
-                                         password=password)
+    connection = db_backend.connect(host=host,
+                                    database=db,
+                                    user=user,
+                                    port=port,
+                                    password=password)
 
     try:
         if connection.is_connected():
@@ -1568,12 +1677,51 @@ def populates_disease(host, port, db, user, password, disease_data, disease_onto
 
     return inserted_disease_by_name, disease_genes
 
-def populates_locus(host, port, db, user, password, genomic_feature_data, ensembl_host, ensembl_port, ensembl_db, ensembl_user, ensembl_password):
+# Ways of fetching the genes from the Ensembl core db:
+#   all: full scan of the core tables, filtered in python
+#   in_list: only the genes used by G2P, selected with IN lists of chunk_size values
+#   temp_table: only the genes used by G2P, joined with a temporary table on the core server
+core_fetch_modes = ["all", "in_list", "temp_table"]
+
+def fetch_core_rows(cursor, sql, column, values, mode="in_list", chunk_size=1000):
+    """
+        Runs a query on the Ensembl core db and returns the rows where column is one of values.
+        The query ends with a WHERE clause, the filter is added to it.
+        With mode 'all' the filter is not applied (all the rows are returned).
+    """
+    if mode not in core_fetch_modes:
+        raise ValueError(f"Unknown core fetch mode '{mode}', use one of: {', '.join(core_fetch_modes)}")
+
+    if mode == "all":
+        cursor.execute(sql)
+        return cursor.fetchall()
+
+    values = sorted(set(value for value in values if value is not None))
+    rows = []
+
+    if mode == "in_list":
+        for i in range(0, len(values), chunk_size):
+            chunk = values[i:i + chunk_size]
+            placeholders = ", ".join(["%s"] * len(chunk))
+            cursor.execute(f"{sql} AND {column} IN ({placeholders})", chunk)
+            rows.extend(cursor.fetchall())
+        return rows
+
+    cursor.execute("DROP TEMPORARY TABLE IF EXISTS g2p_core_filter")
+    cursor.execute("CREATE TEMPORARY TABLE g2p_core_filter (value VARCHAR(255) NOT NULL PRIMARY KEY)")
+    for i in range(0, len(values), chunk_size):
+        cursor.executemany("INSERT IGNORE INTO g2p_core_filter (value) VALUES (%s)", [[value] for value in values[i:i + chunk_size]])
+    cursor.execute(f"{sql} AND {column} IN (SELECT value FROM g2p_core_filter)")
+    rows = cursor.fetchall()
+    cursor.execute("DROP TEMPORARY TABLE g2p_core_filter")
+
+    return rows
+
+def populates_locus(host, port, db, user, password, genomic_feature_data, ensembl_host, ensembl_port, ensembl_db, ensembl_user, ensembl_password, core_fetch="in_list", core_cache=None):
     sql_genes = """ SELECT g.stable_id, s.name, g.seq_region_start, g.seq_region_end, g.seq_region_strand
                     FROM gene g
                     LEFT JOIN seq_region s on s.seq_region_id = g.seq_region_id
-                    WHERE s.coord_system_id = 4
-                """
+                    WHERE s.coord_system_id = 4"""
 
     sql_sequence = f""" INSERT INTO sequence (name, reference_id)
                         VALUES (%s, %s)
@@ -1593,31 +1741,34 @@ def populates_locus(host, port, db, user, password, genomic_feature_data, ensemb
 
     genes = {}
 
-    # Connect to Ensembl db
-    connection_ensembl = mysql.connector.connect(host=ensembl_host,
-                                                 database=ensembl_db,
-                                                 user=ensembl_user,
-                                                 port=ensembl_port,
-                                                 password=ensembl_password)
-
-    try:
-        if connection_ensembl.is_connected():
-            cursor = connection_ensembl.cursor()
-            cursor.execute(sql_genes)
-            data_genes = cursor.fetchall()
-            for gene in data_genes:
-                if gene[0] not in genes.keys():
-                    genes[gene[0]] = { 'sequence':gene[1],
-                                        'start':gene[2],
-                                        'end':gene[3],
-                                        'strand':gene[4] }
-
-    except Error as e:
-        print("Error while connecting to MySQL", e)
-    finally:
-        if connection_ensembl.is_connected():
-            cursor.close()
-            connection_ensembl.close()
+    if core_cache is not None:
+        genes = core_cache.genes
+    else:
+        # Connect to Ensembl db
+        connection_ensembl = db_backend.connect(host=ensembl_host,
+                                                database=ensembl_db,
+                                                user=ensembl_user,
+                                                port=ensembl_port,
+                                                password=ensembl_password)
+
+        try:
+            if connection_ensembl.is_connected():
+                cursor = connection_ensembl.cursor()
+                stable_ids = [info['ensembl_stable_id'] for info in genomic_feature_data.values()]
+                data_genes = fetch_core_rows(cursor, sql_genes, "g.stable_id", stable_ids, core_fetch)
+                for gene in data_genes:
+                    if gene[0] not in genes.keys():
+                        genes[gene[0]] = { 'sequence':gene[1],
+                                            'start':gene[2],
+                                            'end':gene[3],
+                                            'strand':gene[4] }
+
+        except Error as e:
+            print("Error while connecting to MySQL", e)
+        finally:
+            if connection_ensembl.is_connected():
+                cursor.close()
+                connection_ensembl.close()
 
     locus_type_id = fetch_attrib(host, port, db, user, password, 'gene')
     reference_id = fetch_attrib(host, port, db, user, password, 'grch38')
@@ -1630,11 +1781,11 @@ def populates_locus(host, port, db, user, password, genomic_feature_data, ensemb
     genes_ids = {}
     sequence_ids = {}
 
-    connection = mysql.connector.connect(host=host,
-                                         database=db,
-                                         user=user,
-                                         port=port,
-                                         password=password)
+    connection = db_backend.connect(host=host,
+                                    database=db,
+                                    user=user,
+                                    port=port,
+                                    password=password)
 
     try:
         if connection.is_connected():
@@ -1678,13 +1829,12 @@ def populates_locus(host, port, db, user, password, genomic_feature_data, ensemb
             cursor.close()
             connection.close()
 
-def populates_gene_synonyms(host, port, db, user, password, ensembl_host, ensembl_port, ensembl_db, ensembl_user, ensembl_password):
+def populates_gene_synonyms(host, port, db, user, password, ensembl_host, ensembl_port, ensembl_db, ensembl_user, ensembl_password, core_fetch="in_list", core_cache=None):
     sql_get_synonym = """ SELECT ga.value, g.stable_id, g.description, g.biotype, e.synonym
                           FROM gene g
                           LEFT JOIN gene_attrib ga ON ga.gene_id = g.gene_id
                           LEFT JOIN external_synonym e ON e.xref_id = g.display_xref_id
-                          WHERE (g.source = 'ensembl_havana' or g.source = 'havana') AND ga.attrib_type_id = 4 AND e.synonym IS NOT NULL
-                      """
+                          WHERE (g.source = 'ensembl_havana' or g.source = 'havana') AND ga.attrib_type_id = 4 AND e.synonym IS NOT NULL"""
 
     sql_get_gene_info = """ SELECT id, name
                             FROM locus
@@ -1704,55 +1854,76 @@ def populates_gene_synonyms(host, port, db, user, password, ensembl_host, ensemb
     gene_synonyms = {}
     # gene_list_g2p = {}
     attrib_id = None
+    g2p_genes = []
 
-    # Connect to Ensembl core db
-    connection = mysql.connector.connect(host=ensembl_host,
-                                         database=ensembl_db,
-                                         user=ensembl_user,
-                                         port=ensembl_port,
-                                         password=ensembl_password)
+    # Connect to G2P db
+    connection_g2p = db_backend.connect(host=host,
+                                        database=db,
+                                        user=user,
+                                        port=port,
+                                        password=password)
 
     try:
-        if connection.is_connected():
-            cursor = connection.cursor()
-            cursor.execute(sql_get_synonym)
-            data = cursor.fetchall()
-            if len(data) != 0:
-                for row in data:
-                    gene_name = row[0]
-                    if gene_name not in gene_synonyms.keys():
-                        synonyms_list = set()
-                        synonyms_list.add(row[4])
-                        gene_synonyms[gene_name] = { 'stable_id':row[1],
-                                                     'synonyms':synonyms_list }
-                    else:
-                        gene_synonyms[gene_name]['synonyms'].add(row[4])
+        if connection_g2p.is_connected():
+            cursor = connection_g2p.cursor()
+            cursor.execute(sql_attrib)
+            data_attrib = cursor.fetchall()
+            if len(data_attrib) != 0:
+                attrib_id = data_attrib[0][0]
+
+            cursor.execute(sql_get_gene_info)
+            g2p_genes = cursor.fetchall()
 
     except Error as e:
         print("Error while connecting to MySQL", e)
     finally:
-        if connection.is_connected():
+        if connection_g2p.is_connected():
             cursor.close()
-            connection.close()
+            connection_g2p.close()
+
+    if core_cache is not None:
+        gene_synonyms = core_cache.gene_synonyms
+    else:
+        # Connect to Ensembl core db
+        connection = db_backend.connect(host=ensembl_host,
+                                        database=ensembl_db,
+                                        user=ensembl_user,
+                                        port=ensembl_port,
+                                        password=ensembl_password)
+
+        try:
+            if connection.is_connected():
+                cursor = connection.cursor()
+                data = fetch_core_rows(cursor, sql_get_synonym, "ga.value", [row[1] for row in g2p_genes], core_fetch)
+                if len(data) != 0:
+                    for row in data:
+                        gene_name = row[0]
+                        if gene_name not in gene_synonyms.keys():
+                            synonyms_list = set()
+                            synonyms_list.add(row[4])
+                            gene_synonyms[gene_name] = { 'stable_id':row[1],
+                                                         'synonyms':synonyms_list }
+                        else:
+                            gene_synonyms[gene_name]['synonyms'].add(row[4])
+
+        except Error as e:
+            print("Error while connecting to MySQL", e)
+        finally:
+            if connection.is_connected():
+                cursor.close()
+                connection.close()
 
     # Connect to G2P db
-    connection_g2p = mysql.connector.connect(host=host,
-                                             database=db,
-                                             user=user,
-                                             port=port,
-                                             password=password)
+    connection_g2p = db_backend.connect(host=host,
+                                        database=db,
+                                        user=user,
+                                        port=port,
+                                        password=password)
 
     try:
         if connection_g2p.is_connected():
             cursor = connection_g2p.cursor()
-            cursor.execute(sql_attrib)
-            data_attrib = cursor.fetchall()
-            if len(data_attrib) != 0:
-                attrib_id = data_attrib[0][0]
-
-            cursor.execute(sql_get_gene_info)
-            data = cursor.fetchall()
-            for row in data:
+            for row in g2p_genes:
                 if row[1] in gene_synonyms.keys():
                     # stable_id = gene_synonyms[row[1]]['stable_id']
                     synonyms = gene_synonyms[row[1]]['synonyms']
@@ -1772,7 +1943,303 @@ def populates_gene_synonyms(host, port, db, user, password, ensembl_host, ensemb
             cursor.close()
             connection_g2p.close()
 
-def populates_lgd(host, port, db, user, password, gfd_data, inserted_publications, inserted_phenotypes, last_updates, last_update_panel, inserted_disease_by_name, disease_genes, inserted_organs):
+def prepare_lgd(host, port, db, user, password, gfd, data, inserted_publications, inserted_phenotypes, last_updates, last_update_panel, inserted_disease_by_name, disease_genes, undetermined_id):
+    """
+        Maps the data of an old GFD to the new schema ids.
+        Returns a dict with the LGD key (locus-disease-genotype-mechanism), the LGD columns
+        and the data of the children tables, or None if the new disease was not found.
+    """
+    gene_symbol = data['gene_symbol']
+    locus_id = fetch_locus_id(host, port, db, user, password, gene_symbol)
+
+    # Clean the disease name to be able to match to the new disease id
+    # This process removes a few duplicates
+    disease_name = data['disease_name']
+    # print("\nDisease name:", disease_name, "; Gene symbol:", data['gene_symbol'])
+    # Some disease names were updated to include 'gene-related'
+    # We have to add 'gene-related' to 'disease_name' before fetching the new disease id from 'inserted_disease_by_name'
+    genes = disease_genes[disease_name]
+    # print("Genes:", genes)
+    # Add 'gene-related' to the disease name
+    # It's easier to do it if there is only one gene linked to the disease name
+    list_names = format_disease_name(disease_name, genes)
+    disease_id = None
+
+    for disease_name_with_gene in list_names:
+        if(gene_symbol.lower() in disease_name_with_gene.lower()):
+            new_disease_name = clean_up_disease_name(disease_name_with_gene)
+            # print("Clean disease name:", new_disease_name)
+            disease_id = inserted_disease_by_name[new_disease_name]['new_disease_id']
+            # print("New disease id:", disease_id)
+
+    if(disease_id is None):
+        print(f"({gene_symbol}) {disease_name}: {list_names}, genes: {genes}")
+        return None
+
+    genotype_id = fetch_attrib(host, port, db, user, password, ar_mapping[data['allelic_requirement_attrib']])
+
+    # Get date last update
+    date = None
+    if gfd in last_updates:
+        # last_updates[gfd] is a datetime - convert it to string
+        date = last_updates[gfd].strftime("%Y-%m-%d %H:%M:%S")
+
+    if gfd in last_update_panel and (date is None or (last_update_panel[gfd] is not None and date < last_update_panel[gfd].strftime("%Y-%m-%d %H:%M:%S"))):
+        date = last_update_panel[gfd].strftime("%Y-%m-%d %H:%M:%S")
+
+    if date is None:
+        date = '2010-01-01 00:00:00' # TODO: which date to use?
+
+    # make the date aware of the timezone
+    timezone = pytz.timezone("Europe/London")
+    date_obj = datetime.strptime(date, '%Y-%m-%d %H:%M:%S')
+    date_timezone = timezone.localize(date_obj)
+
+    # cross cutting modifier
+    ccm_id = []
+    for ccm in data['cross_cutting_modifier_attrib']:
+        if(ccm != "requires heterozygosity" and ccm != "typified by age related penetrance"
+           and ccm != "incomplete penetrance"):
+            ccm_attrib_id = fetch_attrib(host, port, db, user, password, ccm_mapping[ccm])
+            ccm_id.append(ccm_attrib_id)
+
+    # variant consequence (new: variant type)
+    mechanism = None
+    variant_type_list = []
+    for var_type in data['variant_consequence_attrib']:
+        # This is a molecular mechanism
+        if var_type == 'gain_of_function_variant':
+            mechanism = fetch_mechanism(host, port, db, user, password, 'gain of function', 'mechanism')
+        elif var_type == 'loss_of_function_variant':
+            mechanism = fetch_mechanism(host, port, db, user, password, 'loss of function', 'mechanism')
+        else:
+            variant_type_list.append(fetch_ontology(host, port, db, user, password, var_type))
+            # Set empty mechanism to 'undetermined'
+            mechanism = undetermined_id
+
+    # Set empty mechanism to 'undetermined'
+    if mechanism is None:
+        mechanism = undetermined_id
+
+    legacy_mutation_consequence_flag = []
+    # mutation consequence flag "restricted repertoire of mutations" is now ccm "restricted mutation set"
+    for mutation_cons_flag in data['mutation_consequence_flag_attrib']:
+        # save the mutation consequence flag data in the legacy table 'lgd_mutation_consequence_flag'
+        legacy_mc_flag_id = fetch_attrib(host, port, db, user, password, mutation_cons_flag)
+        legacy_mutation_consequence_flag.append(legacy_mc_flag_id)
+
+        if mutation_cons_flag == "restricted repertoire of mutations":
+            ccm_attrib_id = fetch_attrib(host, port, db, user, password, "restricted mutation set")
+            ccm_id.append(ccm_attrib_id)
+        # mutation consequence flag "dominant negative" is now mechanism "dominant negative"
+        if mutation_cons_flag == "dominant negative":
+            mechanism_tmp = fetch_mechanism(host, port, db, user, password, 'dominant negative', 'mechanism')
+            # check if mechanism is already assigned
+            if mechanism != undetermined_id:
+                print(f"WARNING: multiple mechanisms for gfd_id {gfd}")
+            else:
+                mechanism = mechanism_tmp
+        # mutation consequence flag "activating" is now mechanism "gain of function"
+        if mutation_cons_flag == "activating":
+            mechanism_tmp = fetch_mechanism(host, port, db, user, password, 'gain of function', 'mechanism')
+            # check if mechanism is already assigned
+            if mechanism != undetermined_id:
+                print(f"WARNING: multiple mechanisms for gfd_id {gfd}")
+            else:
+                mechanism = mechanism_tmp
+
+    # multiple mutation_consequence_attrib
+    # some mutation consequences are now variant type
+    variant_gencc_consequences = []
+    variant_gencc_consequences_support = fetch_attrib(host, port, db, user, password, 'inferred')
+    for mc in data['mutation_consequence_attrib']:
+        if (mc == '5_prime or 3_prime UTR mutation' or mc == 'cis-regulatory or promotor mutation') and '5_prime_UTR_variant' not in data['variant_consequence_attrib'] and '3_prime_UTR_variant' not in data['variant_consequence_attrib'] and 'regulatory_region_variant' not in data['variant_consequence_attrib']:
+            variant_type_list.append(fetch_ontology(host, port, db, user, password, 'regulatory_region_variant'))
+        elif mc != '5_prime or 3_prime UTR mutation' and mc != 'cis-regulatory or promotor mutation':
+            variant_gencc_consequences.append(fetch_ontology(host, port, db, user, password, mc))
+
+    # fetch panel id
+    panels = []
+    confidence = {}
+    final_confidence = None
+    for panel, panel_data in data['panels'].items():
+        panel_id = fetch_panel(host, port, db, user, password, panel)
+        panels.append(panel_id)
+        confidence[panel_id] = fetch_attrib(host, port, db, user, password, panel_data['confidence_category'])
+        final_confidence = confidence[panel_id]
+
+    # publications
+    publications = []
+    for pub_id, pub_data in data['publications'].items():
+        if pub_id in inserted_publications:
+            publications.append(inserted_publications[pub_id]['new_id'])
+        else:
+            print(f"Publication id (old): {pub_id} not found")
+
+        # publication comments - TODO
+        # if pub_data['comment'] is not None:
+
+    # phenotypes
+    phenotypes = []
+    for pheno_id in data['phenotypes']:
+        phenotypes.append(inserted_phenotypes[pheno_id]['new_id'])
+
+    # print(f"locus: {locus_id}, disease: {disease_id}, genotype: {genotype_id}, variant consequence: {variant_gencc_consequences}, panels confidence: {confidence}")
+
+    key = f"{locus_id}-{disease_id}-{genotype_id}-{mechanism}" # TODO: Change to support disease updates
+
+    return { 'key':key,
+             'locus_id':locus_id,
+             'disease_id':disease_id,
+             'genotype_id':genotype_id,
+             'mechanism':mechanism,
+             'date':date_timezone,
+             'confidence':confidence,
+             'final_confidence':final_confidence,
+             'ccm':ccm_id,
+             'publications':publications,
+             'variant_gencc_consequence':variant_gencc_consequences,
+             'variant_gencc_consequence_support':variant_gencc_consequences_support,
+             'variant_types':variant_type_list,
+             'phenotypes':phenotypes,
+             'mutation_consequence_flag':legacy_mutation_consequence_flag }
+
+sql_query_lgd_panel = """ INSERT INTO lgd_panel (is_deleted, relevance_id, lgd_id, panel_id)
+                          VALUES (%s, %s, %s, %s)
+                      """
+
+sql_query_lgd_comment = """ INSERT INTO lgd_comment (is_deleted, is_public, lgd_id, user_id, date, comment)
+                            VALUES (%s, %s, %s, %s, %s, %s)
+                        """
+
+sql_query_lgd_ccm = """ INSERT INTO lgd_cross_cutting_modifier (is_deleted, ccm_id, lgd_id)
+                        VALUES (%s, %s, %s)
+                    """
+
+sql_query_lgd_pub = """ INSERT INTO lgd_publication (is_deleted, publication_id, lgd_id)
+                        VALUES (%s, %s, %s)
+                    """
+
+sql_query_lgd_gencc = """ INSERT INTO lgd_variant_gencc_consequence (is_deleted, support_id, lgd_id, variant_consequence_id)
+                          VALUES (%s, %s, %s, %s)
+                      """
+
+sql_query_lgd_var = """ INSERT INTO lgd_variant_type (is_deleted, lgd_id, variant_type_ot_id, inherited, de_novo, unknown_inheritance)
+                        VALUES (%s, %s, %s, %s, %s, %s)
+                    """
+
+sql_query_lgd_pheno = """ INSERT INTO lgd_phenotype (is_deleted, lgd_id, phenotype_id)
+                          VALUES (%s, %s, %s)
+                      """
+
+sql_query_lgd_mc_flag = """ INSERT INTO lgd_mutation_consequence_flag (mutation_consequence_flag_id, lgd_id)
+                            VALUES (%s, %s)
+                        """
+
+sql_query_lgd_organ = """ INSERT INTO lgd_organ (lgd_id, organ_id)
+                          VALUES (%s, %s)
+                      """
+
+# Tables with the data of a LGD, deleted before the LGD is inserted again by the delta migration
+lgd_children_tables = ["lgd_panel", "lgd_cross_cutting_modifier", "lgd_publication", "lgd_variant_gencc_consequence",
+                       "lgd_variant_type", "lgd_phenotype", "lgd_mutation_consequence_flag", "lgd_organ", "lgd_comment"]
+
+def insert_lgd_children(host, port, db, user, password, connection, cursor, lgd_id, lgd, data, inserted_organs):
+    """
+        Inserts the panels, cross cutting modifiers, publications, variant consequences, variant types,
+        phenotypes, mutation consequence flags, organs and comments of a new LGD
+    """
+    # Insert lgd_panel
+    for panel_id in lgd['confidence']:
+        cursor.execute(sql_query_lgd_panel, [0, lgd['confidence'][panel_id], lgd_id, panel_id])
+        connection.commit()
+
+    # Insert cross cutting modifier
+    for ccm_data in lgd['ccm']:
+        cursor.execute(sql_query_lgd_ccm, [0, ccm_data, lgd_id])
+        connection.commit()
+
+    # Insert publications
+    for pub in lgd['publications']:
+        cursor.execute(sql_query_lgd_pub, [0, pub, lgd_id])
+        connection.commit()
+
+    # Insert gencc variant consequence
+    for var_cons_gencc in lgd['variant_gencc_consequence']:
+        cursor.execute(sql_query_lgd_gencc, [0, lgd['variant_gencc_consequence_support'], lgd_id, var_cons_gencc])
+        connection.commit()
+
+    # Insert variant type
+    for var_id in lgd['variant_types']:
+        cursor.execute(sql_query_lgd_var, [0, lgd_id, var_id, 0, 0, 0])
+        connection.commit()
+
+    # Insert phenotypes
+    for new_pheno_id in lgd['phenotypes']:
+        cursor.execute(sql_query_lgd_pheno, [0, lgd_id, new_pheno_id])
+        connection.commit()
+
+    # Insert mutation consequence flag (legacy)
+    for mc_flag_id in lgd['mutation_consequence_flag']:
+        cursor.execute(sql_query_lgd_mc_flag, [mc_flag_id, lgd_id])
+        connection.commit()
+
+    # Insert organs (legacy)
+    for organ_old_id in data['organs']:
+        cursor.execute(sql_query_lgd_organ, [lgd_id, inserted_organs[organ_old_id]['new_id']])
+        connection.commit()
+
+    # Insert comments
+    for comment in data['comments']:
+        user_id = fetch_user(host, port, db, user, password, comment['username'])
+        cursor.execute(sql_query_lgd_comment, [0, comment['is_public'], lgd_id, user_id, comment['created'], comment['comment']])
+
+def merge_lgd_children(connection, cursor, lgd_id, lgd, inserted):
+    """
+        Adds the data of a GFD to a LGD already inserted with the same key
+        (panels, cross cutting modifiers, publications, variant types and phenotypes not in the LGD)
+    """
+    # Insert lgd_panel
+    for panel_id in lgd['confidence']:
+        if panel_id not in inserted['confidence']:
+            cursor.execute(sql_query_lgd_panel, [0, lgd['confidence'][panel_id], lgd_id, panel_id])
+            connection.commit()
+    # Insert cross cutting modifier
+    for ccm_data in lgd['ccm']:
+        if ccm_data not in inserted['ccm']:
+            cursor.execute(sql_query_lgd_ccm, [0, ccm_data, lgd_id])
+            connection.commit()
+    # Insert publications
+    for pub in lgd['publications']:
+        if pub not in inserted['publications']:
+            cursor.execute(sql_query_lgd_pub, [0, pub, lgd_id])
+            connection.commit()
+    # Insert variant type
+    for var_id in lgd['variant_types']:
+        if var_id not in inserted['variant_types']:
+            cursor.execute(sql_query_lgd_var, [0, lgd_id, var_id, 0, 0, 0])
+            connection.commit()
+    # Insert phenotypes
+    for new_pheno_id in lgd['phenotypes']:
+        if new_pheno_id not in inserted['phenotypes']:
+            cursor.execute(sql_query_lgd_pheno, [0, lgd_id, new_pheno_id])
+            connection.commit()
+
+    # TODO: update last_updated
+
+def populates_lgd(host, port, db, user, password, gfd_data, inserted_publications, inserted_phenotypes, last_updates, last_update_panel, inserted_disease_by_name, disease_genes, inserted_organs, lgd_groups=None, existing_lgds=None, prepared_lgds=None):
+    """
+        Populates locus_genotype_disease and the LGD tables.
+        GFDs with the same key (locus-disease-genotype-mechanism) are merged into one LGD.
+        Returns the mapping between the old GFD id and the new LGD id (first GFD of each LGD).
+
+        Delta migration:
+          - lgd_groups (dict) is filled with the key and the GFDs of each LGD, and the GFDs with the
+            same key that were not merged (different confidence or gencc consequences)
+          - existing_lgds (key: LGD key; value: LGD id): LGDs already in the db, they are updated
+            and their data replaced instead of inserting a new LGD. The keys used are removed from the dict.
+          - prepared_lgds (key: GFD id): output of prepare_lgd() for the GFDs
+    """
     # url = "https://www.ebi.ac.uk/gene2phenotype/gfd?search_type=gfd&dbID="
 
     # # Check panels confidence: if they don't agree print entries to be reviewed
@@ -1787,28 +2254,6 @@ def populates_lgd(host, port, db, user, password, gfd_data, inserted_publication
     #         for panel, panel_info in info['panels'].items():
     #             print(f"{gfd_id}\t{panel}\t{panel_info['confidence_category']}\t{url}{gfd_id}")
 
-    ar_mapping = {
-        'biallelic_autosomal':'biallelic_autosomal',
-        'biallelic_PAR':'biallelic_PAR',
-        'mitochondrial':'mitochondrial',
-        'monoallelic_autosomal':'monoallelic_autosomal',
-        'monoallelic_PAR':'monoallelic_PAR',
-        'monoallelic_X_hem':'monoallelic_X_hemizygous',
-        'monoallelic_X_het':'monoallelic_X_heterozygous',
-        'monoallelic_Y_hem':'monoallelic_Y_hemizygous'
-    }
-
-    ccm_mapping = {
-        'imprinted':'imprinted region',
-        'potential IF':'potential secondary finding',
-        # 'requires heterozygosity':'requires heterozygosity', # not being migrated
-        'typically de novo':'typically de novo',
-        'typically mosaic':'typically mosaic',
-        # 'typified by age related penetrance':'typified by age related penetrance', # not being migrated
-        'typified by reduced penetrance':'typified by incomplete penetrance',
-        # 'incomplete penetrance':'incomplete penetrance' # not being migrated
-    }
-
     sql_query_lgd = f""" INSERT INTO locus_genotype_disease (stable_id, date_review, is_reviewed, 
                          is_deleted, confidence_id, disease_id, genotype_id, locus_id, mechanism_id, mechanism_support_id)
                          VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
@@ -1818,43 +2263,18 @@ def populates_lgd(host, port, db, user, password, gfd_data, inserted_publication
                                VALUES (%s, %s, %s)
                            """
 
-    sql_query_lgd_panel = f""" INSERT INTO lgd_panel (is_deleted, relevance_id, lgd_id, panel_id)
-                               VALUES (%s, %s, %s, %s)
-                           """
-    
-    sql_query_lgd_comment = f""" INSERT INTO lgd_comment (is_deleted, is_public, lgd_id, user_id, date, comment)
-                                 VALUES (%s, %s, %s, %s, %s, %s)
-                             """
-
-    sql_query_lgd_ccm = f""" INSERT INTO lgd_cross_cutting_modifier (is_deleted, ccm_id, lgd_id)
-                             VALUES (%s, %s, %s)
-                         """
-
-    sql_query_lgd_pub = f""" INSERT INTO lgd_publication (is_deleted, publication_id, lgd_id)
-                             VALUES (%s, %s, %s)
-                         """
-
-    sql_query_lgd_gencc = f""" INSERT INTO lgd_variant_gencc_consequence (is_deleted, support_id, lgd_id, variant_consequence_id)
-                               VALUES (%s, %s, %s, %s)
-                           """
-
-    sql_query_lgd_var = f""" INSERT INTO lgd_variant_type (is_deleted, lgd_id, variant_type_ot_id, inherited, de_novo, unknown_inheritance)
-                               VALUES (%s, %s, %s, %s, %s, %s)
-                           """
-
-    sql_query_lgd_pheno = f""" INSERT INTO lgd_phenotype (is_deleted, lgd_id, phenotype_id)
-                               VALUES (%s, %s, %s)
-                           """
-
-    sql_query_lgd_mc_flag = f""" INSERT INTO lgd_mutation_consequence_flag (mutation_consequence_flag_id, lgd_id)
-                                 VALUES (%s, %s)
-                             """
+    sql_update_lgd = """ UPDATE locus_genotype_disease SET date_review = %s, is_deleted = 0, confidence_id = %s, disease_id = %s,
+                         genotype_id = %s, locus_id = %s, mechanism_id = %s, mechanism_support_id = %s
+                         WHERE id = %s
+                     """
 
-    sql_query_lgd_organ = f""" INSERT INTO lgd_organ (lgd_id, organ_id)
-                               VALUES (%s, %s)
+    sql_update_stable_id = """ UPDATE g2p_stableid SET is_live = 1, is_deleted = 0
+                               WHERE id = (SELECT stable_id FROM locus_genotype_disease WHERE id = %s)
                            """
 
     stable_id = 0
+    if existing_lgds is not None:
+        stable_id = fetch_last_stable_id(host, port, db, user, password)
     inserted_lgd = {}
     map_old_new_gfd = {}
 
@@ -1862,157 +2282,48 @@ def populates_lgd(host, port, db, user, password, gfd_data, inserted_publication
     undetermined_id = fetch_mechanism(host, port, db, user, password, 'undetermined', 'mechanism')
     mechanism_support = fetch_mechanism(host, port, db, user, password, 'inferred', "support")
 
-    connection = mysql.connector.connect(host=host,
-                                         database=db,
-                                         user=user,
-                                         port=port,
-                                         password=password)
+    connection = db_backend.connect(host=host,
+                                    database=db,
+                                    user=user,
+                                    port=port,
+                                    password=password)
 
     try:
         if connection.is_connected():
             cursor = connection.cursor()
             for gfd, data in gfd_data.items():
-                gene_symbol = data['gene_symbol']
-                locus_id = fetch_locus_id(host, port, db, user, password, gene_symbol)
-
-                # Clean the disease name to be able to match to the new disease id
-                # This process removes a few duplicates
-                disease_name = data['disease_name']
-                # print("\nDisease name:", disease_name, "; Gene symbol:", data['gene_symbol'])
-                # Some disease names were updated to include 'gene-related'
-                # We have to add 'gene-related' to 'disease_name' before fetching the new disease id from 'inserted_disease_by_name'
-                genes = disease_genes[disease_name]
-                # print("Genes:", genes)
-                # Add 'gene-related' to the disease name
-                # It's easier to do it if there is only one gene linked to the disease name
-                list_names = format_disease_name(disease_name, genes)
-                disease_id = None
-
-                for disease_name_with_gene in list_names:
-                    if(gene_symbol.lower() in disease_name_with_gene.lower()):
-                        new_disease_name = clean_up_disease_name(disease_name_with_gene)
-                        # print("Clean disease name:", new_disease_name)
-                        disease_id = inserted_disease_by_name[new_disease_name]['new_disease_id']
-                        # print("New disease id:", disease_id)
-
-                if(disease_id is None):
-                    print(f"({gene_symbol}) {disease_name}: {list_names}, genes: {genes}")
+                if prepared_lgds is not None:
+                    lgd = prepared_lgds[gfd]
+                else:
+                    lgd = prepare_lgd(host, port, db, user, password, gfd, data, inserted_publications, inserted_phenotypes,
+                                      last_updates, last_update_panel, inserted_disease_by_name, disease_genes, undetermined_id)
+                if lgd is None:
                     sys.exit(0)
 
-                genotype_id = fetch_attrib(host, port, db, user, password, ar_mapping[data['allelic_requirement_attrib']])
-
-                # Get date last update
-                date = None
-                if gfd in last_updates:
-                    # last_updates[gfd] is a datetime - convert it to string
-                    date = last_updates[gfd].strftime("%Y-%m-%d %H:%M:%S")
-
-                if gfd in last_update_panel and (date is None or (last_update_panel[gfd] is not None and date < last_update_panel[gfd].strftime("%Y-%m-%d %H:%M:%S"))):
-                    date = last_update_panel[gfd].strftime("%Y-%m-%d %H:%M:%S")
-
-                if date is None:
-                    date = '2010-01-01 00:00:00' # TODO: which date to use?
-
-                # make the date aware of the timezone
-                timezone = pytz.timezone("Europe/London")
-                date_obj = datetime.strptime(date, '%Y-%m-%d %H:%M:%S')
-                date_timezone = timezone.localize(date_obj)
-
-                # cross cutting modifier
-                ccm_id = []
-                for ccm in data['cross_cutting_modifier_attrib']:
-                    if(ccm != "requires heterozygosity" and ccm != "typified by age related penetrance"
-                       and ccm != "incomplete penetrance"):
-                        ccm_attrib_id = fetch_attrib(host, port, db, user, password, ccm_mapping[ccm])
-                        ccm_id.append(ccm_attrib_id)
-
-                # variant consequence (new: variant type)
-                mechanism = None
-                variant_type_list = []
-                for var_type in data['variant_consequence_attrib']:
-                    # This is a molecular mechanism
-                    if var_type == 'gain_of_function_variant':
-                        mechanism = fetch_mechanism(host, port, db, user, password, 'gain of function', 'mechanism')
-                    elif var_type == 'loss_of_function_variant':
-                        mechanism = fetch_mechanism(host, port, db, user, password, 'loss of function', 'mechanism')
-                    else:
-                        variant_type_list.append(fetch_ontology(host, port, db, user, password, var_type))
-                        # Set empty mechanism to 'undetermined'
-                        mechanism = undetermined_id
-
-                # Set empty mechanism to 'undetermined'
-                if mechanism is None:
-                    mechanism = undetermined_id
-
-                legacy_mutation_consequence_flag = []
-                # mutation consequence flag "restricted repertoire of mutations" is now ccm "restricted mutation set"
-                for mutation_cons_flag in data['mutation_consequence_flag_attrib']:
-                    # save the mutation consequence flag data in the legacy table 'lgd_mutation_consequence_flag'
-                    legacy_mc_flag_id = fetch_attrib(host, port, db, user, password, mutation_cons_flag)
-                    legacy_mutation_consequence_flag.append(legacy_mc_flag_id)
-
-                    if mutation_cons_flag == "restricted repertoire of mutations":
-                        ccm_attrib_id = fetch_attrib(host, port, db, user, password, "restricted mutation set")
-                        ccm_id.append(ccm_attrib_id)
-                    # mutation consequence flag "dominant negative" is now mechanism "dominant negative"
-                    if mutation_cons_flag == "dominant negative":
-                        mechanism_tmp = fetch_mechanism(host, port, db, user, password, 'dominant negative', 'mechanism')
-                        # check if mechanism is already assigned
-                        if mechanism != undetermined_id:
-                            print(f"WARNING: multiple mechanisms for gfd_id {gfd}")
-                        else:
-                            mechanism = mechanism_tmp
-                    # mutation consequence flag "activating" is now mechanism "gain of function"
-                    if mutation_cons_flag == "activating":
-                        mechanism_tmp = fetch_mechanism(host, port, db, user, password, 'gain of function', 'mechanism')
-                        # check if mechanism is already assigned
-                        if mechanism != undetermined_id:
-                            print(f"WARNING: multiple mechanisms for gfd_id {gfd}")
-                        else:
-                            mechanism = mechanism_tmp
-
-                # multiple mutation_consequence_attrib
-                # some mutation consequences are now variant type
-                variant_gencc_consequences = []
-                variant_gencc_consequences_support = fetch_attrib(host, port, db, user, password, 'inferred')
-                for mc in data['mutation_consequence_attrib']:
-                    if (mc == '5_prime or 3_prime UTR mutation' or mc == 'cis-regulatory or promotor mutation') and '5_prime_UTR_variant' not in data['variant_consequence_attrib'] and '3_prime_UTR_variant' not in data['variant_consequence_attrib'] and 'regulatory_region_variant' not in data['variant_consequence_attrib']:
-                        variant_type_list.append(fetch_ontology(host, port, db, user, password, 'regulatory_region_variant'))
-                    elif mc != '5_prime or 3_prime UTR mutation' and mc != 'cis-regulatory or promotor mutation':
-                        variant_gencc_consequences.append(fetch_ontology(host, port, db, user, password, mc))
-
-                # fetch panel id
-                panels = []
-                confidence = {}
-                final_confidence = None
-                for panel, panel_data in data['panels'].items():
-                    panel_id = fetch_panel(host, port, db, user, password, panel)
-                    panels.append(panel_id)
-                    confidence[panel_id] = fetch_attrib(host, port, db, user, password, panel_data['confidence_category'])
-                    final_confidence = confidence[panel_id]
-
-                # publications
-                publications = []
-                for pub_id, pub_data in data['publications'].items():
-                    if pub_id in inserted_publications:
-                        publications.append(inserted_publications[pub_id]['new_id'])
-                    else:
-                        print(f"Publication id (old): {pub_id} not found")
+                key = lgd['key']
+                final_confidence = lgd['final_confidence']
+                confidence = lgd['confidence']
 
-                    # publication comments - TODO
-                    # if pub_data['comment'] is not None:
+                # Insert LGD
+                # Skip entries with multiple confidence
+                if key not in inserted_lgd.keys() and existing_lgds is not None and key in existing_lgds:
+                    # Delta migration: update the LGD and replace its data
+                    lgd_id = existing_lgds.pop(key)
+                    cursor.execute(sql_update_lgd, [lgd['date'], final_confidence, lgd['disease_id'], lgd['genotype_id'], lgd['locus_id'], lgd['mechanism'], mechanism_support, lgd_id])
+                    cursor.execute(sql_update_stable_id, [lgd_id])
+                    for table in lgd_children_tables:
+                        cursor.execute(f"DELETE FROM {table} WHERE lgd_id = %s", [lgd_id])
+                    connection.commit()
+                    inserted_lgd[key] = dict(lgd, id=lgd_id)
 
-                # phenotypes
-                phenotypes = []
-                for pheno_id in data['phenotypes']:
-                    phenotypes.append(inserted_phenotypes[pheno_id]['new_id'])
+                    map_old_new_gfd[gfd] = lgd_id
+                    if lgd_groups is not None:
+                        lgd_groups[lgd_id] = { 'key':key, 'gfds':[gfd], 'unmerged':[] }
 
-                # print(f"locus: {locus_id}, disease: {disease_id}, genotype: {genotype_id}, variant consequence: {variant_gencc_consequences}, panels confidence: {confidence}")
+                    insert_lgd_children(host, port, db, user, password, connection, cursor, lgd_id, lgd, data, inserted_organs)
 
-                key = f"{locus_id}-{disease_id}-{genotype_id}-{mechanism}" # TODO: Change to support disease updates
+                    continue
 
-                # Insert LGD
-                # Skip entries with multiple confidence
                 if key not in inserted_lgd.keys():
                     # Insert stable ID
                     stable_id += 1
@@ -2020,101 +2331,40 @@ def populates_lgd(host, port, db, user, password, gfd_data, inserted_publication
                     connection.commit()
                     stable_id_pk = cursor.lastrowid
 
-                    cursor.execute(sql_query_lgd, [stable_id_pk, date_timezone, 1, 0, final_confidence, disease_id, genotype_id, locus_id, mechanism, mechanism_support])
+                    cursor.execute(sql_query_lgd, [stable_id_pk, lgd['date'], 1, 0, final_confidence, lgd['disease_id'], lgd['genotype_id'], lgd['locus_id'], lgd['mechanism'], mechanism_support])
                     connection.commit()
-                    inserted_lgd[key] = { 'id':cursor.lastrowid, 'variant_gencc_consequence':variant_gencc_consequences,
-                                        'confidence':confidence, 'ccm':ccm_id, 'publications':publications,
-                                        'variant_types':variant_type_list, 'phenotypes':phenotypes,
-                                        'final_confidence':final_confidence, 'mechanism':mechanism }
+                    inserted_lgd[key] = dict(lgd, id=cursor.lastrowid)
 
                     # Store the mapping between old and new gfd id
                     map_old_new_gfd[gfd] = inserted_lgd[key]["id"]
+                    if lgd_groups is not None:
+                        lgd_groups[inserted_lgd[key]["id"]] = { 'key':key, 'gfds':[gfd], 'unmerged':[] }
 
-                    # Insert lgd_panel
-                    for panel_id in confidence:
-                        cursor.execute(sql_query_lgd_panel, [0, confidence[panel_id], inserted_lgd[key]['id'], panel_id])
-                        connection.commit()
-
-                    # Insert cross cutting modifier
-                    for ccm_data in ccm_id:
-                        cursor.execute(sql_query_lgd_ccm, [0, ccm_data, inserted_lgd[key]['id']])
-                        connection.commit()
-
-                    # Insert publications
-                    for pub in publications:
-                        cursor.execute(sql_query_lgd_pub, [0, pub, inserted_lgd[key]['id']])
-                        connection.commit()
-
-                    # Insert gencc variant consequence
-                    for var_cons_gencc in variant_gencc_consequences:
-                        cursor.execute(sql_query_lgd_gencc, [0, variant_gencc_consequences_support, inserted_lgd[key]['id'], var_cons_gencc])
-                        connection.commit()
-
-                    # Insert variant type
-                    for var_id in variant_type_list:
-                        cursor.execute(sql_query_lgd_var, [0, inserted_lgd[key]['id'], var_id, 0, 0, 0])
-                        connection.commit()
-
-                    # Insert phenotypes
-                    for new_pheno_id in phenotypes:
-                        cursor.execute(sql_query_lgd_pheno, [0, inserted_lgd[key]['id'], new_pheno_id])
-                        connection.commit()
+                    insert_lgd_children(host, port, db, user, password, connection, cursor, inserted_lgd[key]['id'], lgd, data, inserted_organs)
 
-                    # Insert mutation consequence flag (legacy)
-                    for mc_flag_id in legacy_mutation_consequence_flag:
-                        cursor.execute(sql_query_lgd_mc_flag, [mc_flag_id, inserted_lgd[key]['id']])
-                        connection.commit()
-
-                    # Insert organs (legacy)
-                    for organ_old_id in data['organs']:
-                        cursor.execute(sql_query_lgd_organ, [inserted_lgd[key]['id'], inserted_organs[organ_old_id]['new_id']])
-                        connection.commit()
+                    continue
 
-                    # Insert comments
-                    for comment in data['comments']:
-                        user_id = fetch_user(host, port, db, user, password, comment['username'])
-                        cursor.execute(sql_query_lgd_comment, [0, comment['is_public'], inserted_lgd[key]['id'], user_id, comment['created'], comment['comment']])
+                if lgd_groups is not None:
+                    lgd_groups[inserted_lgd[key]["id"]]['gfds'].append(gfd)
 
                 # Merge entries - disease is the same
-                elif set(variant_gencc_consequences) == set(inserted_lgd[key]['variant_gencc_consequence']) and final_confidence == inserted_lgd[key]['final_confidence']:
+                if set(lgd['variant_gencc_consequence']) == set(inserted_lgd[key]['variant_gencc_consequence']) and final_confidence == inserted_lgd[key]['final_confidence']:
                     lgd_id = inserted_lgd[key]['id']
                     print(f"Merge entries: {lgd_id}")
                     # print(f"variant consequences: {variant_gencc_consequences} = {inserted_lgd[key]['variant_gencc_consequence']}")
-                    # Insert lgd_panel
-                    for panel_id in confidence:
-                        if panel_id not in inserted_lgd[key]['confidence']:
-                            cursor.execute(sql_query_lgd_panel, [0, confidence[panel_id], lgd_id, panel_id])
-                            connection.commit()
-                    # Insert cross cutting modifier
-                    for ccm_data in ccm_id:
-                        if ccm_data not in inserted_lgd[key]['ccm']:
-                            cursor.execute(sql_query_lgd_ccm, [0, ccm_data, lgd_id])
-                            connection.commit()
-                    # Insert publications
-                    for pub in publications:
-                        if pub not in inserted_lgd[key]['publications']:
-                            cursor.execute(sql_query_lgd_pub, [0, pub, lgd_id])
-                            connection.commit()
-                    # Insert variant type
-                    for var_id in variant_type_list:
-                        if var_id not in inserted_lgd[key]['variant_types']:
-                            cursor.execute(sql_query_lgd_var, [0, lgd_id, var_id, 0, 0, 0])
-                            connection.commit()
-                    # Insert phenotypes
-                    for new_pheno_id in phenotypes:
-                        if new_pheno_id not in inserted_lgd[key]['phenotypes']:
-                            cursor.execute(sql_query_lgd_pheno, [0, lgd_id, new_pheno_id])
-                            connection.commit()
-
-                    # TODO: update last_updated
+                    merge_lgd_children(connection, cursor, lgd_id, lgd, inserted_lgd[key])
 
                 elif final_confidence != inserted_lgd[key]['final_confidence']:
+                    if lgd_groups is not None:
+                        lgd_groups[inserted_lgd[key]["id"]]['unmerged'].append(gfd)
                     # print(f"\nKey already inserted with id: {inserted_lgd[key]}")
-                    print(f"(Different confidence) Key already in db: {key}, locus: {locus_id}, disease: {disease_id}, genotype: {genotype_id}, panels confidence: {confidence}")
+                    print(f"(Different confidence) Key already in db: {key}, locus: {lgd['locus_id']}, disease: {lgd['disease_id']}, genotype: {lgd['genotype_id']}, panels confidence: {confidence}")
 
                 else:
+                    if lgd_groups is not None:
+                        lgd_groups[inserted_lgd[key]["id"]]['unmerged'].append(gfd)
                     # print(f"\nKey already inserted with id: {inserted_lgd[key]}")
-                    print(f"Key already in db: {key}, locus: {locus_id}, disease: {disease_id}, genotype: {genotype_id}, panels confidence: {confidence}")
+                    print(f"Key already in db: {key}, locus: {lgd['locus_id']}, disease: {lgd['disease_id']}, genotype: {lgd['genotype_id']}, panels confidence: {confidence}")
 
     except Error as e:
         print("Error while connecting to MySQL", e)
@@ -2142,11 +2392,11 @@ def populates_disease_synonyms(host, port, db, user, password, disease_synonyms,
                         WHERE id = %s
                     """
 
-    connection = mysql.connector.connect(host=host,
-                                         database=db,
-                                         user=user,
-                                         port=port,
-                                         password=password)
+    connection = db_backend.connect(host=host,
+                                    database=db,
+                                    user=user,
+                                    port=port,
+                                    password=password)
 
     try:
         if connection.is_connected():
@@ -2178,9 +2428,44 @@ def populates_disease_synonyms(host, port, db, user, password, disease_synonyms,
 
     return 1
 
-def populates_history(host, port, db, user, password, map_old_new_gfd, gfd_log, gfd_panel_log, gfd_phenotype_log):
-    timezone = pytz.timezone("Europe/London")
-
+def history_rows(logs, map_old_new_gfd, user_ids, aware_dates, missing_users=None):
+    """
+        Returns the history rows (lgd_id, date, history_type, user_id) of the logs
+        of the migrated records.
+        The usernames not found in user_ids (see fetch_users()) are added to missing_users.
+    """
+    rows = []
+
+    for old_gfd_id, log_data_list in logs.items():
+        if old_gfd_id not in map_old_new_gfd:
+            continue
+        new_gfd_id = map_old_new_gfd[old_gfd_id]
+        for log_data in log_data_list:
+            history_type = None
+            if log_data["action"] == "create":
+                history_type = "+"
+            elif log_data["action"] == "update":
+                history_type = "~"
+            else:
+                print(f"Invalid log for lgd_id = {new_gfd_id} (action: {log_data['action']})")
+
+            if(history_type and log_data["username"] != "diana_lemos" and log_data["username"] != "ola_austine"
+               and log_data["username"] != "sarah_hunt"):
+                user_id = None
+                if log_data["username"] is not None:
+                    user_id = user_ids.get(username_key(log_data["username"]))
+                    if user_id is None and missing_users is not None:
+                        missing_users.add(log_data["username"])
+                rows.append((new_gfd_id, aware_dates[log_data["date"]], history_type, user_id))
+
+    return rows
+
+def populates_history(host, port, db, user, password, map_old_new_gfd, gfd_log, gfd_panel_log, gfd_phenotype_log, batch_size=1000):
+    """
+        Populates the history tables from the logs of the old schema.
+        The users are fetched once, the dates are converted to Europe/London in one pass
+        and the rows are inserted in batches.
+    """
     sql_insert_lgd_log = """ INSERT INTO gene2phenotype_app_historicallocusgenotypedisease (id, date_review, history_date, history_type, history_user_id, is_deleted, is_reviewed)
                              VALUES (%s, %s, %s, %s, %s, %s, %s)
                          """
@@ -2193,87 +2478,235 @@ def populates_history(host, port, db, user, password, map_old_new_gfd, gfd_log,
                                        VALUES (%s, %s, %s, %s, %s, %s)
                                    """
 
-    connection = mysql.connector.connect(host=host,
-                                         database=db,
-                                         user=user,
-                                         port=port,
-                                         password=password)
+    user_ids = fetch_users(host, port, db, user, password)
+
+    # make the dates aware of the timezone
+    dates = set()
+    for logs in (gfd_log, gfd_panel_log, gfd_phenotype_log):
+        for log_data_list in logs.values():
+            for log_data in log_data_list:
+                dates.add(log_data["date"])
+    aware_dates = make_dates_aware(dates)
+
+    missing_users = set()
+    lgd_rows = [[lgd_id, date_timezone, date_timezone, history_type, user_id, 0, 1]
+                for lgd_id, date_timezone, history_type, user_id in history_rows(gfd_log, map_old_new_gfd, user_ids, aware_dates, missing_users)]
+    lgd_panel_rows = [[0, lgd_id, date_timezone, history_type, user_id, 0]
+                      for lgd_id, date_timezone, history_type, user_id in history_rows(gfd_panel_log, map_old_new_gfd, user_ids, aware_dates, missing_users)]
+    lgd_phenotype_rows = [[0, lgd_id, date_timezone, history_type, user_id, 0]
+                          for lgd_id, date_timezone, history_type, user_id in history_rows(gfd_phenotype_log, map_old_new_gfd, user_ids, aware_dates, missing_users)]
+    if missing_users:
+        print(f"WARNING: {len(missing_users)} users of the logs not found in the new database, the history rows have no user: {sorted(missing_users)}")
+
+    connection = db_backend.connect(host=host,
+                                    database=db,
+                                    user=user,
+                                    port=port,
+                                    password=password)
 
     try:
         if connection.is_connected():
             cursor = connection.cursor()
-            for old_gfd_id, log_data_list in gfd_log.items():
-                for log_data in log_data_list:
-                    if(old_gfd_id in map_old_new_gfd):
-                        new_gfd_id = map_old_new_gfd[old_gfd_id]
-                        history_type = None
-                        if log_data["action"] == "create":
-                            history_type = "+"
-                        elif log_data["action"] == "update":
-                            history_type = "~"
-                        else:
-                            print(f"Invalid log for lgd_id = {new_gfd_id} (action: {log_data['action']})")
-                        
-                        # make the date aware of the timezone
-                        date_str = log_data["date"].strftime("%Y-%m-%d %H:%M:%S")
-                        date_obj = datetime.strptime(date_str, '%Y-%m-%d %H:%M:%S')
-                        date_timezone = timezone.localize(date_obj)
-
-                        if(history_type and log_data["username"] != "diana_lemos" and log_data["username"] != "ola_austine"
-                        and log_data["username"] != "sarah_hunt"):
-                            # Get the user id
-                            user_id = fetch_user(host, port, db, user, password, log_data["username"])
-
-                            cursor.execute(sql_insert_lgd_log, [new_gfd_id, date_timezone, date_timezone, history_type, user_id, 0, 1])
-
-            for old_gfd_id, log_data_panel_list in gfd_panel_log.items():
-                for log_data in log_data_panel_list:
-                    if(old_gfd_id in map_old_new_gfd):
-                        new_gfd_id = map_old_new_gfd[old_gfd_id]
-                        history_type = None
-                        if log_data["action"] == "create":
-                            history_type = "+"
-                        elif log_data["action"] == "update":
-                            history_type = "~"
-                        else:
-                            print(f"Invalid log for lgd_id = {new_gfd_id} (action: {log_data['action']})")
-
-                        # make the date aware of the timezone
-                        date_str = log_data["date"].strftime("%Y-%m-%d %H:%M:%S")
-                        date_obj = datetime.strptime(date_str, '%Y-%m-%d %H:%M:%S')
-                        date_timezone = timezone.localize(date_obj)
-
-                        if(history_type and log_data["username"] != "diana_lemos" and log_data["username"] != "ola_austine"
-                        and log_data["username"] != "sarah_hunt"):
-                            # Get the user id
-                            user_id = fetch_user(host, port, db, user, password, log_data["username"])
-
-                            cursor.execute(sql_insert_lgd_panel_log, [0, new_gfd_id, date_timezone, history_type, user_id, 0])
-
-            for old_gfd_id, log_data_pheno_list in gfd_phenotype_log.items():
-                for log_data in log_data_pheno_list:
-                    if(old_gfd_id in map_old_new_gfd):
-                        new_gfd_id = map_old_new_gfd[old_gfd_id]
-                        history_type = None
-                        if log_data["action"] == "create":
-                            history_type = "+"
-                        elif log_data["action"] == "update":
-                            history_type = "~"
-                        else:
-                            print(f"Invalid action log for lgd_id = {new_gfd_id} (action: {log_data['action']})")
-                        
-                        # make the date aware of the timezone
-                        date_str = log_data["date"].strftime("%Y-%m-%d %H:%M:%S")
-                        date_obj = datetime.strptime(date_str, '%Y-%m-%d %H:%M:%S')
-                        date_timezone = timezone.localize(date_obj)
+            for sql_insert, rows in ((sql_insert_lgd_log, lgd_rows),
+                                     (sql_insert_lgd_panel_log, lgd_panel_rows),
+                                     (sql_insert_lgd_phenotype_log, lgd_phenotype_rows)):
+                for i in range(0, len(rows), batch_size):
+                    cursor.executemany(sql_insert, rows[i:i + batch_size])
 
-                        if(history_type and log_data["username"] != "diana_lemos" and log_data["username"] != "ola_austine"
-                        and log_data["username"] != "sarah_hunt"):
-                            # Get the user id
-                            user_id = fetch_user(host, port, db, user, password, log_data["username"])
+            connection.commit()
 
-                            cursor.execute(sql_insert_lgd_phenotype_log, [0, new_gfd_id, date_timezone, history_type, user_id, 0])
+    except Error as e:
+        print("Error while connecting to MySQL", e)
+    finally:
+        if connection.is_connected():
+            cursor.close()
+            connection.close()
 
+    return 1
+
+def fetch_log_high_water_mark(host, port, db, user, password, created_until=None):
+    """
+        Returns the id of the last log of each log table (GFD, panel, phenotype) of the old schema.
+        The ids are used instead of the dates: several logs can be created in the same second.
+        created_until (datetime) returns the last logs created up to this date.
+    """
+    high_water_mark = None
+
+    connection = db_backend.connect(host=host,
+                                    database=db,
+                                    user=user,
+                                    port=port,
+                                    password=password)
+
+    try:
+        if connection.is_connected():
+            cursor = connection.cursor()
+            high_water_mark = {}
+            for table, id_column in log_tables:
+                if created_until is None:
+                    cursor.execute(f"SELECT MAX({id_column}) FROM {table}")
+                else:
+                    cursor.execute(f"SELECT MAX({id_column}) FROM {table} WHERE created <= %s", [created_until])
+                high_water_mark[table] = cursor.fetchone()[0] or 0
+
+    except Error as e:
+        print("Error while connecting to MySQL", e)
+    finally:
+        if connection.is_connected():
+            cursor.close()
+            connection.close()
+
+    return high_water_mark
+
+def save_migration_state(state_file, high_water_mark, map_old_new_gfd, lgd_groups, inserted_publications, inserted_phenotypes,
+                         inserted_organs, inserted_disease_by_name, disease_genes, pending_gfds=()):
+    """
+        Saves the data needed by the delta migration (JSON):
+        ids of the last logs migrated, mapping between old and new ids, LGD groups (key and GFDs)
+        and GFDs that could not be migrated by the last delta migration
+    """
+    state = { 'high_water_mark':high_water_mark,
+              'map_old_new_gfd':{ str(old_id):new_id for old_id, new_id in map_old_new_gfd.items() },
+              'lgd_groups':{ str(lgd_id):group for lgd_id, group in lgd_groups.items() },
+              'publications':{ str(old_id):value['new_id'] for old_id, value in inserted_publications.items() },
+              'phenotypes':{ str(old_id):value['new_id'] for old_id, value in inserted_phenotypes.items() },
+              'organs':{ str(old_id):value['new_id'] for old_id, value in inserted_organs.items() },
+              'diseases':{ name:value['new_disease_id'] for name, value in inserted_disease_by_name.items() },
+              'disease_genes':disease_genes,
+              'pending_gfds':sorted(pending_gfds) }
+
+    with open(f"{state_file}.tmp", "w", encoding="utf-8") as output:
+        json.dump(state, output)
+    os.replace(f"{state_file}.tmp", state_file)
+
+def load_migration_state(state_file):
+    """
+        Returns the data saved by save_migration_state() in the format used by the migration
+    """
+    with open(state_file, encoding="utf-8") as fh:
+        state = json.load(fh)
+
+    # The state files written before the log ids were used have the date of the last log
+    high_water_mark = state['high_water_mark']
+    if isinstance(high_water_mark, str):
+        high_water_mark = datetime.strptime(high_water_mark, "%Y-%m-%d %H:%M:%S")
+
+    return { 'high_water_mark':high_water_mark,
+             'map_old_new_gfd':{ int(old_id):new_id for old_id, new_id in state['map_old_new_gfd'].items() },
+             'lgd_groups':{ int(lgd_id):group for lgd_id, group in state['lgd_groups'].items() },
+             'inserted_publications':{ int(old_id):{ 'new_id':new_id } for old_id, new_id in state['publications'].items() },
+             'inserted_phenotypes':{ int(old_id):{ 'new_id':new_id } for old_id, new_id in state['phenotypes'].items() },
+             'inserted_organs':{ int(old_id):{ 'new_id':new_id } for old_id, new_id in state['organs'].items() },
+             'inserted_disease_by_name':{ name:{ 'new_disease_id':new_id } for name, new_id in state['diseases'].items() },
+             'disease_genes':state['disease_genes'],
+             'pending_gfds':set(state.get('pending_gfds', [])) }
+
+def populates_missing_references(host, port, db, user, password, new_host, new_port, new_db, new_user, new_password, gfd_data, inserted_publications, inserted_phenotypes):
+    """
+        Delta migration: inserts the publications and phenotypes used by the GFDs that are not in the new db yet.
+        Publications (pmid) and phenotypes (accession) already in the new db are only added to the mappings.
+    """
+    publication_ids = sorted(set(pub_id for data in gfd_data.values() for pub_id in data['publications'] if pub_id not in inserted_publications))
+    phenotype_ids = sorted(set(pheno_id for data in gfd_data.values() for pheno_id in data['phenotypes'] if pheno_id not in inserted_phenotypes))
+
+    if len(publication_ids) == 0 and len(phenotype_ids) == 0:
+        return
+
+    publication_data = {}
+    phenotype_data = {}
+
+    connection = db_backend.connect(host=host,
+                                    database=db,
+                                    user=user,
+                                    port=port,
+                                    password=password)
+
+    try:
+        if connection.is_connected():
+            cursor = connection.cursor()
+            if publication_ids:
+                placeholders = ", ".join(["%s"] * len(publication_ids))
+                cursor.execute(f"SELECT publication_id, pmid, title, source FROM publication WHERE publication_id IN ({placeholders})", publication_ids)
+                for row in cursor.fetchall():
+                    if row[2] is not None and row[2] != '':
+                        publication_data[row[0]] = { 'pmid':row[1], 'title':clean_title(row[2]), 'source':row[3] }
+            if phenotype_ids:
+                placeholders = ", ".join(["%s"] * len(phenotype_ids))
+                cursor.execute(f"SELECT phenotype_id, stable_id, name, description, source FROM phenotype WHERE phenotype_id IN ({placeholders})", phenotype_ids)
+                for row in cursor.fetchall():
+                    phenotype_data[row[0]] = { 'stable_id':row[1], 'name':row[2], 'description':row[3], 'source':row[4] }
+
+    except Error as e:
+        print("Error while connecting to MySQL", e)
+    finally:
+        if connection.is_connected():
+            cursor.close()
+            connection.close()
+
+    connection = db_backend.connect(host=new_host,
+                                    database=new_db,
+                                    user=new_user,
+                                    port=new_port,
+                                    password=new_password)
+
+    try:
+        if connection.is_connected():
+            cursor = connection.cursor()
+            pmids = [data['pmid'] for data in publication_data.values() if data['pmid'] is not None]
+            if pmids:
+                placeholders = ", ".join(["%s"] * len(pmids))
+                cursor.execute(f"SELECT id, pmid FROM publication WHERE pmid IN ({placeholders})", pmids)
+                new_ids = { row[1]:row[0] for row in cursor.fetchall() }
+                for old_id, data in list(publication_data.items()):
+                    if data['pmid'] in new_ids:
+                        inserted_publications[old_id] = { 'new_id':new_ids[data['pmid']] }
+                        del publication_data[old_id]
+            accessions = [data['stable_id'] for data in phenotype_data.values()]
+            if accessions:
+                placeholders = ", ".join(["%s"] * len(accessions))
+                cursor.execute(f"SELECT id, accession FROM ontology_term WHERE accession IN ({placeholders})", accessions)
+                new_ids = { row[1]:row[0] for row in cursor.fetchall() }
+                for old_id, data in list(phenotype_data.items()):
+                    if data['stable_id'] in new_ids:
+                        inserted_phenotypes[old_id] = { 'new_id':new_ids[data['stable_id']] }
+                        del phenotype_data[old_id]
+
+    except Error as e:
+        print("Error while connecting to MySQL", e)
+    finally:
+        if connection.is_connected():
+            cursor.close()
+            connection.close()
+
+    if publication_data:
+        inserted_publications.update(populates_publications(new_host, new_port, new_db, new_user, new_password, publication_data))
+    if phenotype_data:
+        inserted_phenotypes.update(populates_phenotypes(new_host, new_port, new_db, new_user, new_password, phenotype_data))
+    print(f"INFO: {len(publication_data)} publications and {len(phenotype_data)} phenotypes added")
+
+def delete_lgds(host, port, db, user, password, lgd_ids):
+    """
+        Delta migration: flags the LGDs as deleted (GFDs deleted in the old db or merged into other LGDs)
+    """
+    sql_lgd = """ UPDATE locus_genotype_disease SET is_deleted = 1
+                  WHERE id = %s
+              """
+
+    sql_stable_id = """ UPDATE g2p_stableid SET is_live = 0
+                        WHERE id = (SELECT stable_id FROM locus_genotype_disease WHERE id = %s)
+                    """
+
+    connection = db_backend.connect(host=host,
+                                    database=db,
+                                    user=user,
+                                    port=port,
+                                    password=password)
+
+    try:
+        if connection.is_connected():
+            cursor = connection.cursor()
+            cursor.executemany(sql_lgd, [[lgd_id] for lgd_id in lgd_ids])
+            cursor.executemany(sql_stable_id, [[lgd_id] for lgd_id in lgd_ids])
             connection.commit()
 
     except Error as e:
@@ -2283,7 +2716,122 @@ def populates_history(host, port, db, user, password, map_old_new_gfd, gfd_log,
             cursor.close()
             connection.close()
 
-    return 1
+def migrate_delta(host, port, db, user, password, new_host, new_port, new_db, new_user, new_password, state_file):
+    """
+        Migrates the GFDs changed since the last migration (full or delta).
+        The GFDs changed are the ones with logs (GFD, panel, phenotype) after the high water mark (last log ids)
+        saved in the state file. They are extracted again with the other GFDs of their LGDs, and the LGDs are
+        updated (data replaced), inserted or flagged as deleted. The history of the new logs is inserted.
+        Returns the GFDs not migrated because their disease or gene is not in the new database
+        (they are saved in the state file and need a full migration).
+    """
+    state = load_migration_state(state_file)
+    since = state['high_water_mark']
+    if isinstance(since, datetime):
+        since = fetch_log_high_water_mark(host, port, db, user, password, since)
+    map_old_new_gfd = state['map_old_new_gfd']
+    lgd_groups = state['lgd_groups']
+    inserted_publications = state['inserted_publications']
+    inserted_phenotypes = state['inserted_phenotypes']
+
+    with timed_stage("fetch_log_high_water_mark"):
+        until = fetch_log_high_water_mark(host, port, db, user, password)
+
+    with timed_stage("dump_logs"):
+        gfd_log, gfd_panel_log, gfd_phenotype_log = dump_logs(host, port, db, user, password, since, until)
+
+    changed = set(gfd_log) | set(gfd_panel_log) | set(gfd_phenotype_log) | state['pending_gfds']
+    print(f"INFO: {len(changed)} GFDs changed since the last migration")
+
+    failed = {} # key: GFD id; value: disease or gene not found in the new database
+    if changed:
+        with timed_stage("fetch_attribs"):
+            attribs = fetch_attribs(host, port, db, user, password)
+        undetermined_id = fetch_mechanism(new_host, new_port, new_db, new_user, new_password, 'undetermined', 'mechanism')
+
+        gfd_to_lgd = { gfd:lgd_id for lgd_id, group in lgd_groups.items() for gfd in group['gfds'] }
+        lgd_keys = { group['key']:lgd_id for lgd_id, group in lgd_groups.items() }
+
+        # The LGDs of the changed GFDs (and the LGDs with the same key as a changed GFD) are migrated again
+        # with all their GFDs
+        gfd_data = {}
+        last_updates = {}
+        last_update_panel = {}
+        prepared_lgds = {}
+        groups = set()
+        members = set(changed)
+        with timed_stage("dump_gfd"):
+            while True:
+                groups.update(gfd_to_lgd[gfd] for gfd in members if gfd in gfd_to_lgd)
+                groups.update(lgd_keys[lgd['key']] for lgd in prepared_lgds.values() if lgd is not None and lgd['key'] in lgd_keys)
+                members.update(gfd for lgd_id in groups for gfd in lgd_groups[lgd_id]['gfds'])
+                todo = members - set(prepared_lgds)
+                if not todo:
+                    break
+
+                data, dates, dates_panel, _ = dump_gfd(host, port, db, user, password, attribs, todo)
+                gfd_data.update(data)
+                last_updates.update(dates)
+                last_update_panel.update(dates_panel)
+                populates_missing_references(host, port, db, user, password, new_host, new_port, new_db, new_user, new_password,
+                                             data, inserted_publications, inserted_phenotypes)
+
+                for gfd in sorted(todo):
+                    prepared_lgds[gfd] = None
+                    if gfd not in data:
+                        continue
+                    # The delta migration does not insert diseases and genes
+                    try:
+                        lgd = prepare_lgd(new_host, new_port, new_db, new_user, new_password, gfd, data[gfd], inserted_publications, inserted_phenotypes,
+                                          last_updates, last_update_panel, state['inserted_disease_by_name'], state['disease_genes'], undetermined_id)
+                    except KeyError as e:
+                        failed[gfd] = f"disease {e}"
+                        continue
+                    if lgd is None:
+                        failed[gfd] = f"disease '{data[gfd]['disease_name']}'"
+                    elif lgd['locus_id'] is None:
+                        failed[gfd] = f"gene '{data[gfd]['gene_symbol']}'"
+                    else:
+                        prepared_lgds[gfd] = lgd
+
+        # LGDs with a GFD that can't be migrated are not changed, the GFDs are tried again by the next delta migration
+        for gfd in failed:
+            if gfd in gfd_to_lgd:
+                groups.discard(gfd_to_lgd[gfd])
+        members = set(gfd for gfd in members if gfd not in failed and (gfd not in gfd_to_lgd or gfd_to_lgd[gfd] in groups))
+
+        existing_lgds = { lgd_groups[lgd_id]['key']:lgd_id for lgd_id in groups }
+        delta_data = { gfd:gfd_data[gfd] for gfd in sorted(members) if prepared_lgds.get(gfd) is not None }
+        for gfd in members:
+            map_old_new_gfd.pop(gfd, None)
+        for lgd_id in groups:
+            del lgd_groups[lgd_id]
+
+        n_existing = len(existing_lgds)
+        with timed_stage("populates_lgd"):
+            delta_map = populates_lgd(new_host, new_port, new_db, new_user, new_password, delta_data, inserted_publications, inserted_phenotypes,
+                                      last_updates, last_update_panel, state['inserted_disease_by_name'], state['disease_genes'], state['inserted_organs'],
+                                      lgd_groups, existing_lgds, prepared_lgds)
+        map_old_new_gfd.update(delta_map)
+
+        # LGDs without GFDs
+        if existing_lgds:
+            delete_lgds(new_host, new_port, new_db, new_user, new_password, existing_lgds.values())
+            for key, lgd_id in existing_lgds.items():
+                lgd_groups[lgd_id] = { 'key':key, 'gfds':[], 'unmerged':[] }
+
+        n_updated = n_existing - len(existing_lgds)
+        print(f"INFO: {n_updated} LGDs updated, {len(delta_map) - n_updated} LGDs inserted, {len(existing_lgds)} LGDs deleted")
+        for gfd in sorted(failed):
+            print(f"ERROR: GFD {gfd} not migrated: {failed[gfd]} not found in the new database")
+
+        with timed_stage("populates_history"):
+            populates_history(new_host, new_port, new_db, new_user, new_password, map_old_new_gfd, gfd_log, gfd_panel_log, gfd_phenotype_log)
+
+    save_migration_state(state_file, until or since, map_old_new_gfd, lgd_groups, inserted_publications, inserted_phenotypes,
+                         state['inserted_organs'], state['inserted_disease_by_name'], state['disease_genes'], failed)
+
+    return sorted(failed)
 
 def populates_gencc_submission(host, port, db, user, password, gencc_file, map_old_new_gfd):
     lgd_stable_id = {} # key = lgd_id; value = g2p_stable_id pk
@@ -2300,7 +2848,7 @@ def populates_gencc_submission(host, port, db, user, password, gencc_file, map_o
     sql_insert = """ INSERT INTO gencc_submission (submission_id, old_g2p_id, date_of_submission, g2p_stable_id, type_of_submission)
                      VALUES (%s, %s, %s, %s, %s) """
 
-    connection = mysql.connector.connect(host=host, database=db, user=user, port=port, password=password)
+    connection = db_backend.connect(host=host, database=db, user=user, port=port, password=password)
 
     try:
         if connection.is_connected():
@@ -2346,11 +2894,11 @@ def fetch_locus_id(host, port, db, user, password, name):
                      WHERE name = %s
                  """
 
-    connection = mysql.connector.connect(host=host,
-                                         database=db,
-                                         user=user,
-                                         port=port,
-                                         password=password)
+    connection = db_backend.connect(host=host,
+                                    database=db,
+                                    user=user,
+                                    port=port,
+                                    password=password)
 
     try:
         if connection.is_connected():
@@ -2369,6 +2917,40 @@ def fetch_locus_id(host, port, db, user, password, name):
 
     return id
 
+def fetch_last_stable_id(host, port, db, user, password):
+    """
+        Returns the number of the last G2P stable id (G2P00123 -> 123)
+    """
+    sql_query = """ SELECT stable_id
+                    FROM g2p_stableid
+                    WHERE stable_id LIKE 'G2P%'
+                """
+
+    last_number = 0
+
+    connection = db_backend.connect(host=host,
+                                    database=db,
+                                    user=user,
+                                    port=port,
+                                    password=password)
+
+    try:
+        if connection.is_connected():
+            cursor = connection.cursor()
+            cursor.execute(sql_query)
+            for row in cursor.fetchall():
+                if row[0][3:].isdigit():
+                    last_number = max(last_number, int(row[0][3:]))
+
+    except Error as e:
+        print("Error while connecting to MySQL", e)
+    finally:
+        if connection.is_connected():
+            cursor.close()
+            connection.close()
+
+    return last_number
+
 def fetch_disease_by_name(host, port, db, user, password, name):
     id = None
 
@@ -2377,11 +2959,11 @@ def fetch_disease_by_name(host, port, db, user, password, name):
                      WHERE name = %s
                  """
 
-    connection = mysql.connector.connect(host=host,
-                                         database=db,
-                                         user=user,
-                                         port=port,
-                                         password=password)
+    connection = db_backend.connect(host=host,
+                                    database=db,
+                                    user=user,
+                                    port=port,
+                                    password=password)
 
     try:
         if connection.is_connected():
@@ -2462,11 +3044,11 @@ def fetch_attrib(host, port, db, user, password, value):
                      WHERE value = %s
                  """
 
-    connection = mysql.connector.connect(host=host,
-                                         database=db,
-                                         user=user,
-                                         port=port,
-                                         password=password)
+    connection = db_backend.connect(host=host,
+                                    database=db,
+                                    user=user,
+                                    port=port,
+                                    password=password)
 
     try:
         if connection.is_connected():
@@ -2493,11 +3075,11 @@ def fetch_attrib_type(host, port, db, user, password, code):
                      WHERE code = %s
                  """
 
-    connection = mysql.connector.connect(host=host,
-                                         database=db,
-                                         user=user,
-                                         port=port,
-                                         password=password)
+    connection = db_backend.connect(host=host,
+                                    database=db,
+                                    user=user,
+                                    port=port,
+                                    password=password)
 
     try:
         if connection.is_connected():
@@ -2524,11 +3106,11 @@ def fetch_mechanism(host, port, db, user, password, value, type):
                      WHERE value = %s AND type = %s
                  """
 
-    connection = mysql.connector.connect(host=host,
-                                         database=db,
-                                         user=user,
-                                         port=port,
-                                         password=password)
+    connection = db_backend.connect(host=host,
+                                    database=db,
+                                    user=user,
+                                    port=port,
+                                    password=password)
 
     try:
         if connection.is_connected():
@@ -2555,11 +3137,11 @@ def fetch_ontology(host, port, db, user, password, value):
                      WHERE term = %s
                  """
 
-    connection = mysql.connector.connect(host=host,
-                                         database=db,
-                                         user=user,
-                                         port=port,
-                                         password=password)
+    connection = db_backend.connect(host=host,
+                                    database=db,
+                                    user=user,
+                                    port=port,
+                                    password=password)
 
     try:
         if connection.is_connected():
@@ -2589,11 +3171,11 @@ def fetch_panel(host, port, db, user, password, name):
                      WHERE name = %s
                  """
 
-    connection = mysql.connector.connect(host=host,
-                                         database=db,
-                                         user=user,
-                                         port=port,
-                                         password=password)
+    connection = db_backend.connect(host=host,
+                                    database=db,
+                                    user=user,
+                                    port=port,
+                                    password=password)
 
     try:
         if connection.is_connected():
@@ -2620,11 +3202,11 @@ def fetch_source(host, port, db, user, password, value):
                      WHERE name = %s
                  """
 
-    connection = mysql.connector.connect(host=host,
-                                         database=db,
-                                         user=user,
-                                         port=port,
-                                         password=password)
+    connection = db_backend.connect(host=host,
+                                    database=db,
+                                    user=user,
+                                    port=port,
+                                    password=password)
 
     try:
         if connection.is_connected():
@@ -2643,6 +3225,46 @@ def fetch_source(host, port, db, user, password, value):
 
     return id
 
+def username_key(username):
+    """
+        Username compared like MySQL does with the default collation (case-insensitive,
+        trailing spaces ignored)
+    """
+    return username.rstrip().casefold()
+
+def fetch_users(host, port, db, user, password):
+    """
+        Returns the ids of all the users
+        key: username (see username_key()); value: user id
+    """
+    users = {}
+
+    sql_query = """ SELECT id, username
+                    FROM user
+                """
+
+    connection = db_backend.connect(host=host,
+                                    database=db,
+                                    user=user,
+                                    port=port,
+                                    password=password)
+
+    try:
+        if connection.is_connected():
+            cursor = connection.cursor()
+            cursor.execute(sql_query)
+            for row in cursor.fetchall():
+                users[username_key(row[1])] = row[0]
+
+    except Error as e:
+        print("Error while connecting to MySQL", e)
+    finally:
+        if connection.is_connected():
+            cursor.close()
+            connection.close()
+
+    return users
+
 def fetch_user(host, port, db, user, password, username):
     id = None
 
@@ -2651,11 +3273,11 @@ def fetch_user(host, port, db, user, password, username):
                      WHERE username = %s
                  """
 
-    connection = mysql.connector.connect(host=host,
-                                         database=db,
-                                         user=user,
-                                         port=port,
-                                         password=password)
+    connection = db_backend.connect(host=host,
+                                    database=db,
+                                    user=user,
+                                    port=port,
+                                    password=password)
 
     try:
         if connection.is_connected():
@@ -2711,11 +3333,11 @@ def update_attrib_description(host, port, db, user, password):
                       code = 'mutation_consequence')
                   """
 
-    connection = mysql.connector.connect(host=host,
-                                         database=db,
-                                         user=user,
-                                         port=port,
-                                         password=password)
+    connection = db_backend.connect(host=host,
+                                    database=db,
+                                    user=user,
+                                    port=port,
+                                    password=password)
 
     try:
         if connection.is_connected():
@@ -2736,6 +3358,181 @@ def update_attrib_description(host, port, db, user, password):
     return 1
 
 
+# Tables with the secondary indexes dropped by the fast load (name or prefix)
+fast_load_tables = ["locus_genotype_disease", "ontology_term"]
+fast_load_table_prefixes = ["lgd_", "gene2phenotype_app_historical"]
+
+def save_fast_load_indexes(indexes_file, db, indexes):
+    """
+        Saves the indexes dropped by the fast load (JSON), before they are dropped
+    """
+    with open(f"{indexes_file}.tmp", "w", encoding="utf-8") as output:
+        json.dump({ 'database':db, 'indexes':[[table, name, columns] for table, name, columns in indexes] }, output)
+    os.replace(f"{indexes_file}.tmp", indexes_file)
+
+def load_fast_load_indexes(indexes_file, db):
+    """
+        Returns the indexes saved by save_fast_load_indexes() for the database,
+        an empty list if there is no file (no fast load in progress)
+    """
+    if not os.path.isfile(indexes_file):
+        return []
+
+    with open(indexes_file, encoding="utf-8") as fh:
+        saved = json.load(fh)
+
+    if saved['database'] != db:
+        print(f"WARNING: {indexes_file} has the indexes of the database {saved['database']}, not {db}")
+        return []
+
+    return [(table, name, columns) for table, name, columns in saved['indexes']]
+
+def prepare_fast_load(host, port, db, user, password, indexes_file):
+    """
+        Fast load of an empty database: the foreign keys and the unique keys are not checked
+        by the next connections to the database and the secondary indexes of the large tables are dropped.
+        The indexes are saved to indexes_file before they are dropped, with the indexes of a previous
+        fast load that was not finished (already dropped).
+        Returns the dropped indexes (table, index name, columns), rebuilt by finish_fast_load(),
+        or None if the database is not empty.
+    """
+    indexes = None
+    previous_indexes = load_fast_load_indexes(indexes_file, db)
+
+    connection = db_backend.connect(host=host,
+                                    database=db,
+                                    user=user,
+                                    port=port,
+                                    password=password)
+
+    try:
+        if connection.is_connected():
+            cursor = connection.cursor()
+            cursor.execute("SELECT COUNT(*) FROM locus_genotype_disease")
+            if cursor.fetchone()[0] != 0:
+                print("WARNING: the new database is not empty, the fast load is not used")
+                if previous_indexes:
+                    print(f"WARNING: {len(previous_indexes)} indexes dropped by a previous fast load are missing, run with --rebuild_indexes")
+            else:
+                dropped = [(table, name, columns) for table, name, columns in db_backend.secondary_indexes(cursor, db)
+                           if table in fast_load_tables or table.startswith(tuple(fast_load_table_prefixes))]
+                saved = set((table, name) for table, name, columns in dropped)
+                indexes = dropped + [index for index in previous_indexes if (index[0], index[1]) not in saved]
+                save_fast_load_indexes(indexes_file, db, indexes)
+                for table, name, columns in dropped:
+                    db_backend.drop_index(cursor, table, name)
+                connection.commit()
+                print(f"INFO: Fast load: {len(dropped)} indexes dropped ({len(indexes)} saved to {indexes_file}), foreign key and unique checks disabled")
+
+    except Error as e:
+        print("Error while connecting to MySQL", e)
+    finally:
+        if connection.is_connected():
+            cursor.close()
+            connection.close()
+
+    if indexes is not None:
+        db_backend.set_bulk_load(db)
+
+    return indexes
+
+def finish_fast_load(host, port, db, user, password, indexes, indexes_file):
+    """
+        Rebuilds the indexes dropped by prepare_fast_load() that are still missing and enables the checks.
+        indexes_file is removed once the indexes are rebuilt.
+        Returns True if the indexes are rebuilt.
+    """
+    db_backend.set_bulk_load(db, False)
+    rebuilt = False
+
+    connection = db_backend.connect(host=host,
+                                    database=db,
+                                    user=user,
+                                    port=port,
+                                    password=password)
+
+    try:
+        if connection.is_connected():
+            cursor = connection.cursor()
+            existing = set((table, name) for table, name, columns in db_backend.secondary_indexes(cursor, db))
+            indexes_by_table = {}
+            for table, name, columns in indexes:
+                if (table, name) not in existing:
+                    indexes_by_table.setdefault(table, []).append((name, columns))
+            for table, table_indexes in indexes_by_table.items():
+                db_backend.create_indexes(cursor, table, table_indexes)
+            connection.commit()
+            rebuilt = True
+            print(f"INFO: Fast load: {sum(len(table_indexes) for table_indexes in indexes_by_table.values())} indexes rebuilt")
+
+    except Error as e:
+        print("Error while connecting to MySQL", e)
+    finally:
+        if connection.is_connected():
+            cursor.close()
+            connection.close()
+
+    if rebuilt and os.path.isfile(indexes_file):
+        os.remove(indexes_file)
+    elif not rebuilt:
+        print(f"WARNING: the indexes are not rebuilt, they are saved in {indexes_file} (run with --rebuild_indexes)")
+
+    return rebuilt
+
+def count_duplicate_keys(host, port, db, user, password):
+    """
+        Checks the unique keys of the new schema (the unique keys were not checked by the load).
+        Returns the number of duplicated keys.
+    """
+    total = 0
+    checked = 0
+
+    connection = db_backend.connect(host=host,
+                                    database=db,
+                                    user=user,
+                                    port=port,
+                                    password=password)
+
+    try:
+        if connection.is_connected():
+            cursor = connection.cursor()
+            for table, name, columns in db_backend.unique_keys(cursor, db):
+                # NULL values are not duplicates
+                not_null = " AND ".join(f"{column} IS NOT NULL" for column in columns)
+                cursor.execute(f""" SELECT COUNT(*) FROM (
+                                        SELECT 1 FROM `{table}` WHERE {not_null}
+                                        GROUP BY {', '.join(columns)} HAVING COUNT(*) > 1
+                                    ) AS duplicates """)
+                duplicates = cursor.fetchone()[0]
+                checked += 1
+                if duplicates:
+                    total += duplicates
+                    print(f"ERROR: {table}.{name} ({', '.join(columns)}): {duplicates} duplicated keys")
+
+    except Error as e:
+        print("Error while connecting to MySQL", e)
+    finally:
+        if connection.is_connected():
+            cursor.close()
+            connection.close()
+
+    print(f"INFO: {checked} unique keys checked, {total} duplicated keys")
+
+    return total
+
+def validate_fast_load(host, port, db, user, password):
+    """
+        Checks the relationships and the unique keys of the new schema
+        (the foreign keys and the unique keys were not checked by the load).
+        Returns the number of orphan rows, relationships not checked and duplicated keys.
+    """
+    relationships = check_integrity.merge_relationships(check_integrity.new_schema_relationships,
+                                                        check_integrity.fetch_declared_foreign_keys(host, port, db, user, password))
+    results = check_integrity.scan_relationships(host, port, db, user, password, relationships)
+    orphans, unchecked = check_integrity.print_report(results)
+
+    return orphans + unchecked + count_duplicate_keys(host, port, db, user, password)
+
 def main():
     parser = argparse.ArgumentParser(description="")
     parser.add_argument("--host", required=True, help="Database host")
@@ -2753,11 +3550,37 @@ def main():
     parser.add_argument("--ensembl_database", default='', help="Ensembl core Database name")
     parser.add_argument("--ensembl_user", default='', help="Ensembl core Username")
     parser.add_argument("--ensembl_password", default='', help="Ensembl core Password (default: '')")
+    parser.add_argument("--ensembl_fetch", default="in_list", choices=core_fetch_modes, help="How to select the G2P genes in the Ensembl core db: all (full scan), in_list or temp_table (default: in_list)")
+    parser.add_argument("--ensembl_cache_dir", default=None, help="Directory of the local cache of the Ensembl core genes and synonyms, built once per core db (requires pyarrow)")
     parser.add_argument("--omim_key", default='', help="OMIM API key")
     parser.add_argument("--gencc_file", default='', help="File submitted to GenCC")
+    parser.add_argument("--query_stats", action="store_true", help="Report query fingerprint statistics and N+1 queries at exit")
+    parser.add_argument("--query_stats_threshold", type=int, default=100, help="Flag statements executed more than this number of times from the same line (default: 100)")
+    parser.add_argument("--query_stats_file", default=None, help="File to write the query statistics (default: stderr)")
+    parser.add_argument("--db_backend", default="mysql", choices=db_backend.backends, help="Database backend (default: mysql)")
+    parser.add_argument("--sqlite_dir", default=None, help="Directory with the SQLite databases (default: in memory). Only used with --db_backend sqlite")
+    parser.add_argument("--http_cassette", default=None, help="Record the OLS/OMIM/EuropePMC responses to this file or replay them from it")
+    parser.add_argument("--http_mode", default="replay", choices=http_cassette.modes, help="Cassette mode (default: replay)")
+    parser.add_argument("--http_server", default=None, help="Replay through this local server (http_cassette.py serve) instead of in-process")
+    parser.add_argument("--http_latency", type=float, default=0, help="Replay: latency added to each response in seconds (default: 0)")
+    parser.add_argument("--http_error_rate", type=float, default=0, help="Replay: fraction of requests that fail with HTTP 503 (default: 0)")
+    parser.add_argument("--state_file", default=None, help="File with the state of the migration (high water mark of the logs, old/new ids), written by the full migration and used by --delta")
+    parser.add_argument("--delta", action="store_true", help="Migrate only the GFDs changed since the last migration (requires --state_file)")
+    parser.add_argument("--fast_load", action="store_true", help="Initial load of an empty new database: no foreign key and unique checks, secondary indexes of the large tables rebuilt and integrity checked at the end")
+    parser.add_argument("--fast_load_file", default="fast_load_indexes.json", help="File where the fast load saves the indexes before dropping them, removed once they are rebuilt (default: fast_load_indexes.json)")
+    parser.add_argument("--rebuild_indexes", action="store_true", help="Rebuild the indexes saved in --fast_load_file by a fast load that did not finish, and check the new database")
 
     args = parser.parse_args()
 
+    db_backend.configure(args.db_backend, args.sqlite_dir)
+
+    if args.query_stats:
+        query_stats.install(loop_threshold=args.query_stats_threshold, output_file=args.query_stats_file)
+
+    if args.http_cassette:
+        http_cassette.install(args.http_cassette, mode=args.http_mode, latency=args.http_latency,
+                              error_rate=args.http_error_rate, server_url=args.http_server)
+
     global omim_key_global
 
     host = args.host
@@ -2778,119 +3601,212 @@ def main():
     omim_key_global = args.omim_key
     gencc_file = args.gencc_file
 
+    if args.rebuild_indexes:
+        indexes = load_fast_load_indexes(args.fast_load_file, new_db)
+        print(f"INFO: Rebuilding {len(indexes)} indexes from {args.fast_load_file}...")
+        if not finish_fast_load(new_host, new_port, new_db, new_user, new_password, indexes, args.fast_load_file):
+            sys.exit(1)
+        print("INFO: Checking referential integrity and unique keys...")
+        if validate_fast_load(new_host, new_port, new_db, new_user, new_password):
+            print("ERROR: the new database has orphan rows, duplicated keys or relationships not checked")
+            sys.exit(1)
+        print("INFO: referential integrity and unique keys checked\n")
+        return
+
+    if args.delta:
+        if not args.state_file:
+            parser.error("--delta requires --state_file")
+        if args.fast_load:
+            parser.error("--fast_load can only be used by the full migration")
+        print(f"INFO: Delta migration from {args.state_file}...")
+        failed = migrate_delta(host, port, db, user, password, new_host, new_port, new_db, new_user, new_password, args.state_file)
+        print("INFO: Delta migration done\n")
+        print_stage_timings()
+        if failed:
+            print(f"ERROR: {len(failed)} GFDs use diseases or genes that are not in the new database, "
+                  "the delta migration can't insert them: run a full migration")
+            sys.exit(1)
+        return
+
+    # Ids of the last logs, the next delta migration starts after these logs
+    high_water_mark = None
+    if args.state_file:
+        high_water_mark = fetch_log_high_water_mark(host, port, db, user, password)
+
     print("INFO: Fetching data from old schema...")
 
     # Populates: attrib, attrib_type
-    attribs = fetch_attribs(host, port, db, user, password)
+    with timed_stage("fetch_attribs"):
+        attribs = fetch_attribs(host, port, db, user, password)
 
     # Populates: panel
-    panels_data = dump_panels(host, port, db, user, password)
+    with timed_stage("dump_panels"):
+        panels_data = dump_panels(host, port, db, user, password)
 
     # Populates: user, user_panel
-    user_panel_data = dump_users(host, port, db, user, password, attribs)
+    with timed_stage("dump_users"):
+        user_panel_data = dump_users(host, port, db, user, password, attribs)
   
     # Populates: publication
-    publications_data = dump_publications(host, port, db, user, password)
+    with timed_stage("dump_publications"):
+        publications_data = dump_publications(host, port, db, user, password)
 
     # Populates: phenotype
-    phenotype_data = dump_phenotype(host, port, db, user, password)
+    with timed_stage("dump_phenotype"):
+        phenotype_data = dump_phenotype(host, port, db, user, password)
 
     # Populates: organ
-    organ_data = dump_organ(host, port, db, user, password)
+    with timed_stage("dump_organ"):
+        organ_data = dump_organ(host, port, db, user, password)
 
     # Populates: disease
-    disease_data = dump_diseases(host, port, db, user, password)
+    with timed_stage("dump_diseases"):
+        disease_data = dump_diseases(host, port, db, user, password)
 
     # Populates: ontology_term, ontology
     # variant gencc consequence uses these terms
     # disease ontology stored here
-    disease_ontology_data = dump_ontology(host, port, db, user, password, attribs)
+    with timed_stage("dump_ontology"):
+        disease_ontology_data = dump_ontology(host, port, db, user, password, attribs)
 
     # Populates: locus
     # TODO: genomic_feature_statistic and genomic_feature_statistic_attrib
-    genomic_feature_data = dump_genes(host, port, db, user, password)
+    with timed_stage("dump_genes"):
+        genomic_feature_data = dump_genes(host, port, db, user, password)
 
     # Populates: locus_genotype_disease
-    gfd_data, last_updates, last_update_panel, disease_synonyms = dump_gfd(host, port, db, user, password, attribs)
+    with timed_stage("dump_gfd"):
+        gfd_data, last_updates, last_update_panel, disease_synonyms = dump_gfd(host, port, db, user, password, attribs)
 
     # Populates: history tables
-    gfd_log, gfd_panel_log, gfd_phenotype_log = dump_logs(host, port, db, user, password)
+    with timed_stage("dump_logs"):
+        gfd_log, gfd_panel_log, gfd_phenotype_log = dump_logs(host, port, db, user, password, until=high_water_mark)
 
     print("INFO: Fetching data from old schema... done\n")
 
     ### Store the data in the new database ###
-    # Populates: source
-    print("INFO: Populating source...")
-    populate_source(new_host, new_port, new_db, new_user, new_password)
-    print("INFO: source populated\n")
-
-    # Populates: attrib, attrib_type, ontology_term (variant consequence, variant type)
-    print("INFO: Populating attribs...")
-    populate_attribs(new_host, new_port, new_db, new_user, new_password, attribs)
-    print("INFO: attribs populated\n")
-    print("INFO: Populating new attribs...")
-    populate_new_attribs(new_host, new_port, new_db, new_user, new_password)
-    print("INFO: new attribs populated\n")
-
-    print("INFO: Updating attribs...")
-    update_attrib_description(new_host, new_port, new_db, new_user, new_password)
-    print("INFO: attribs updated\n")
-
-    print("INFO: Populating user data...")
-    # Populates: user, panel, user_panel, ontology_term
-    populates_user_panel(new_host, new_port, new_db, new_user, new_password, user_panel_data, panels_data)
-    print("INFO: user data populated\n")
-
-    # Populates: publication
-    # inserted_publications = {}
-    print("INFO: Populating publications...")
-    inserted_publications = populates_publications(new_host, new_port, new_db, new_user, new_password, publications_data)
-    print("INFO: publications populated\n")
-
-    # Populates: phenotype
-    # inserted_phenotypes = {}
-    print("INFO: Populating phenotypes...")
-    inserted_phenotypes = populates_phenotypes(new_host, new_port, new_db, new_user, new_password, phenotype_data)
-    print("INFO: phenotypes populated\n")
-
-    # Populates organ
-    print("INFO: Populating organs...")
-    inserted_organs = populates_organs(new_host, new_port, new_db, new_user, new_password, organ_data)
-    print("INFO: organs populated\n")
-
-    # Populates: disease, disease_ontology, ontology_term
-    # Update disease names before populating new db: https://www.ebi.ac.uk/panda/jira/browse/G2P-45
-    print("INFO: Populating diseases...")
-    inserted_disease_by_name, disease_genes = populates_disease(new_host, new_port, new_db, new_user, new_password, disease_data, disease_ontology_data)
-    print("INFO: diseases populated\n")
-
-    # Populates: locus, locus_attrib, locus_identifier
-    print("INFO: Populating genes...")
-    populates_locus(new_host, new_port, new_db, new_user, new_password, genomic_feature_data, ensembl_host, ensembl_port, ensembl_db, ensembl_user, ensembl_password)
-    print("INFO: genes populated\n")
-    print("INFO: Populating genes synonyms...")
-    populates_gene_synonyms(new_host, new_port, new_db, new_user, new_password, ensembl_host, ensembl_port, ensembl_db, ensembl_user, ensembl_password)
-    print("INFO: genes synonyms populated\n")
+    fast_load_indexes = None
+    if args.fast_load:
+        with timed_stage("fast_load_prepare"):
+            fast_load_indexes = prepare_fast_load(new_host, new_port, new_db, new_user, new_password, args.fast_load_file)
 
-    # Populates: locus_genotype_disease
-    print("INFO: Populating LGD...")
-    map_old_new_gfd = populates_lgd(new_host, new_port, new_db, new_user, new_password, gfd_data, inserted_publications, inserted_phenotypes, last_updates, last_update_panel, inserted_disease_by_name, disease_genes, inserted_organs)
-    print("INFO: LGD populated\n")
-
-    # Populates: history tables
-    print("INFO: Populating history tables...")
-    populates_history(new_host, new_port, new_db, new_user, new_password, map_old_new_gfd, gfd_log, gfd_panel_log, gfd_phenotype_log)
-    print("INFO: Populating history tables\n")
-
-    # Populates: disease_synonym
-    print("INFO: Populating disease synonyms...")
-    populates_disease_synonyms(new_host, new_port, new_db, new_user, new_password, disease_synonyms, map_old_new_gfd)
-    print("INFO: disease synonyms populated\n")
-
-    # Populates: gencc_submission
-    print("INFO: Populating gencc_submission...")
-    populates_gencc_submission(new_host, new_port, new_db, new_user, new_password, gencc_file, map_old_new_gfd)
-    print("INFO: gencc_submission populated\n")
+    # The indexes dropped by the fast load are rebuilt even if the load stops
+    try:
+        # Populates: source
+        print("INFO: Populating source...")
+        with timed_stage("populate_source"):
+            populate_source(new_host, new_port, new_db, new_user, new_password)
+        print("INFO: source populated\n")
+
+        # Populates: attrib, attrib_type, ontology_term (variant consequence, variant type)
+        print("INFO: Populating attribs...")
+        with timed_stage("populate_attribs"):
+            populate_attribs(new_host, new_port, new_db, new_user, new_password, attribs)
+        print("INFO: attribs populated\n")
+        print("INFO: Populating new attribs...")
+        with timed_stage("populate_new_attribs"):
+            populate_new_attribs(new_host, new_port, new_db, new_user, new_password)
+        print("INFO: new attribs populated\n")
+
+        print("INFO: Updating attribs...")
+        with timed_stage("update_attrib_description"):
+            update_attrib_description(new_host, new_port, new_db, new_user, new_password)
+        print("INFO: attribs updated\n")
+
+        print("INFO: Populating user data...")
+        # Populates: user, panel, user_panel, ontology_term
+        with timed_stage("populates_user_panel"):
+            populates_user_panel(new_host, new_port, new_db, new_user, new_password, user_panel_data, panels_data)
+        print("INFO: user data populated\n")
+
+        # Populates: publication
+        # inserted_publications = {}
+        print("INFO: Populating publications...")
+        with timed_stage("populates_publications"):
+            inserted_publications = populates_publications(new_host, new_port, new_db, new_user, new_password, publications_data)
+        print("INFO: publications populated\n")
+
+        # Populates: phenotype
+        # inserted_phenotypes = {}
+        print("INFO: Populating phenotypes...")
+        with timed_stage("populates_phenotypes"):
+            inserted_phenotypes = populates_phenotypes(new_host, new_port, new_db, new_user, new_password, phenotype_data)
+        print("INFO: phenotypes populated\n")
+
+        # Populates organ
+        print("INFO: Populating organs...")
+        with timed_stage("populates_organs"):
+            inserted_organs = populates_organs(new_host, new_port, new_db, new_user, new_password, organ_data)
+        print("INFO: organs populated\n")
+
+        # Populates: disease, disease_ontology, ontology_term
+        # Update disease names before populating new db: https://www.ebi.ac.uk/panda/jira/browse/G2P-45
+        print("INFO: Populating diseases...")
+        with timed_stage("populates_disease"):
+            inserted_disease_by_name, disease_genes = populates_disease(new_host, new_port, new_db, new_user, new_password, disease_data, disease_ontology_data)
+        print("INFO: diseases populated\n")
+
+        # Populates: locus, locus_attrib, locus_identifier
+        core_cache = None
+        if args.ensembl_cache_dir:
+            with timed_stage("ensembl_cache"):
+                core_cache = ensembl_cache.load_or_build(args.ensembl_cache_dir, ensembl_host, ensembl_port, ensembl_db, ensembl_user, ensembl_password)
+        print("INFO: Populating genes...")
+        with timed_stage("populates_locus"):
+            populates_locus(new_host, new_port, new_db, new_user, new_password, genomic_feature_data, ensembl_host, ensembl_port, ensembl_db, ensembl_user, ensembl_password, args.ensembl_fetch, core_cache)
+        print("INFO: genes populated\n")
+        print("INFO: Populating genes synonyms...")
+        with timed_stage("populates_gene_synonyms"):
+            populates_gene_synonyms(new_host, new_port, new_db, new_user, new_password, ensembl_host, ensembl_port, ensembl_db, ensembl_user, ensembl_password, args.ensembl_fetch, core_cache)
+        print("INFO: genes synonyms populated\n")
+
+        # Populates: locus_genotype_disease
+        print("INFO: Populating LGD...")
+        with timed_stage("populates_lgd"):
+            lgd_groups = {}
+            map_old_new_gfd = populates_lgd(new_host, new_port, new_db, new_user, new_password, gfd_data, inserted_publications, inserted_phenotypes, last_updates, last_update_panel, inserted_disease_by_name, disease_genes, inserted_organs, lgd_groups)
+        print("INFO: LGD populated\n")
+
+        # Populates: history tables
+        print("INFO: Populating history tables...")
+        with timed_stage("populates_history"):
+            populates_history(new_host, new_port, new_db, new_user, new_password, map_old_new_gfd, gfd_log, gfd_panel_log, gfd_phenotype_log)
+        print("INFO: Populating history tables\n")
+
+        # Populates: disease_synonym
+        print("INFO: Populating disease synonyms...")
+        with timed_stage("populates_disease_synonyms"):
+            populates_disease_synonyms(new_host, new_port, new_db, new_user, new_password, disease_synonyms, map_old_new_gfd)
+        print("INFO: disease synonyms populated\n")
+
+        # Populates: gencc_submission
+        print("INFO: Populating gencc_submission...")
+        with timed_stage("populates_gencc_submission"):
+            populates_gencc_submission(new_host, new_port, new_db, new_user, new_password, gencc_file, map_old_new_gfd)
+        print("INFO: gencc_submission populated\n")
+    finally:
+        if fast_load_indexes is not None:
+            print("INFO: Rebuilding indexes...")
+            with timed_stage("fast_load_rebuild_indexes"):
+                if finish_fast_load(new_host, new_port, new_db, new_user, new_password, fast_load_indexes, args.fast_load_file):
+                    print("INFO: indexes rebuilt\n")
+
+    if fast_load_indexes is not None:
+        print("INFO: Checking referential integrity and unique keys...")
+        with timed_stage("fast_load_validate"):
+            errors = validate_fast_load(new_host, new_port, new_db, new_user, new_password)
+        if errors:
+            print("ERROR: the new database has orphan rows, duplicated keys or relationships not checked")
+            print_stage_timings()
+            sys.exit(1)
+        print("INFO: referential integrity and unique keys checked\n")
+
+    if args.state_file:
+        save_migration_state(args.state_file, high_water_mark, map_old_new_gfd, lgd_groups, inserted_publications, inserted_phenotypes,
+                             inserted_organs, inserted_disease_by_name, disease_genes)
+        print(f"INFO: Delta migration state saved to {args.state_file}\n")
+
+    print_stage_timings()
 
 if __name__ == '__main__':
     main()
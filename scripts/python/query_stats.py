@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+    Query statistics for the G2P python scripts.
+
+    Wraps the database connections opened by the scripts and records every statement
+    they run. Statements are grouped by fingerprint (the SQL with the literals and
+    placeholders stripped) and for each fingerprint we keep the number of executions,
+    the total and the p99 latency.
+    A fingerprint executed more than 'loop_threshold' times from the same line of code
+    is flagged as a query run inside a loop (N+1 query).
+
+    Usage:
+        import query_stats
+        query_stats.install(loop_threshold=100, top_n=20, output_file="query_stats.txt")
+"""
+
+import sys
+import re
+import math
+import time
+import atexit
+import db_backend
+
+_re_comments = re.compile(r"/\*.*?\*/|--[^\n]*|#[^\n]*", re.S)
+_re_strings = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"")
+_re_numbers = re.compile(r"\b-?\d+(?:\.\d+)?\b")
+_re_placeholders = re.compile(r"%s|%\(\w+\)s|\?")
+_re_in_lists = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_re_values_lists = re.compile(r"(\(\?\+?\))(?:\s*,\s*\(\?\+?\))+")
+_re_spaces = re.compile(r"\s+")
+
+def fingerprint(statement):
+    """
+        Returns the statement without literals, placeholders and extra spaces.
+        Lists of values (IN lists and multi-row VALUES) are collapsed to a single
+        entry so that statements that only differ in the number of values share
+        the same fingerprint.
+    """
+    if isinstance(statement, (bytes, bytearray)):
+        statement = statement.decode("utf-8", "replace")
+
+    fp = _re_comments.sub(" ", statement)
+    fp = _re_strings.sub("?", fp)
+    fp = _re_placeholders.sub("?", fp)
+    fp = _re_numbers.sub("?", fp)
+    fp = _re_in_lists.sub("(?+)", fp)
+    fp = _re_values_lists.sub(r"\1", fp)
+    fp = _re_spaces.sub(" ", fp).strip()
+
+    return fp
+
+def percentile(values, pct):
+    """
+        Returns the percentile 'pct' (0-100) of a list of values (nearest-rank method).
+    """
+    if not values:
+        return 0
+    sorted_values = sorted(values)
+    rank = max(math.ceil(pct / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+class QueryStats:
+    """
+        Accumulates the execution statistics per fingerprint and per call site.
+    """
+
+    def __init__(self, loop_threshold=100, top_n=20, output_file=None):
+        self.loop_threshold = loop_threshold
+        self.top_n = top_n
+        self.output_file = output_file
+        self.timings = {} # key: fingerprint; value: list of durations (seconds)
+        self.call_sites = {} # key: (fingerprint, call site); value: number of executions
+        self.connections = 0
+
+    def record(self, statement, duration, call_site):
+        fp = fingerprint(statement)
+
+        if fp not in self.timings:
+            self.timings[fp] = [duration]
+        else:
+            self.timings[fp].append(duration)
+
+        key = (fp, call_site)
+        self.call_sites[key] = self.call_sites.get(key, 0) + 1
+
+    def flagged(self):
+        """
+            Returns the fingerprints executed more than 'loop_threshold' times
+            from the same call site.
+            Output: list of (fingerprint, call site, number of executions)
+        """
+        result = []
+        for (fp, call_site), count in self.call_sites.items():
+            if count > self.loop_threshold:
+                result.append((fp, call_site, count))
+        result.sort(key=lambda x: x[2], reverse=True)
+
+        return result
+
+    def summary(self):
+        """
+            Returns the statistics per fingerprint sorted by total time.
+            Output: list of dicts with keys fingerprint, count, total, mean, p99
+        """
+        result = []
+        for fp, durations in self.timings.items():
+            total = sum(durations)
+            result.append({ 'fingerprint':fp,
+                            'count':len(durations),
+                            'total':total,
+                            'mean':total / len(durations),
+                            'p99':percentile(durations, 99) })
+        result.sort(key=lambda x: x['total'], reverse=True)
+
+        return result
+
+    def report(self):
+        lines = []
+        summary = self.summary()
+        total_queries = sum(row['count'] for row in summary)
+        total_time = sum(row['total'] for row in summary)
+
+        lines.append(f"\n### Query statistics: {total_queries} queries, {len(summary)} fingerprints, {self.connections} connections, {total_time:.2f} s ###")
+        lines.append(f"{'count':>10}  {'total (s)':>10}  {'mean (ms)':>10}  {'p99 (ms)':>10}  fingerprint")
+        for row in summary[:self.top_n]:
+            fp = row['fingerprint']
+            if len(fp) > 120:
+                fp = fp[:117] + "..."
+            lines.append(f"{row['count']:>10}  {row['total']:>10.3f}  {row['mean'] * 1000:>10.3f}  {row['p99'] * 1000:>10.3f}  {fp}")
+
+        flagged = self.flagged()
+        if flagged:
+            lines.append(f"\nWARNING: {len(flagged)} statements executed more than {self.loop_threshold} times from the same line (N+1 queries)")
+            for fp, call_site, count in flagged:
+                if len(fp) > 120:
+                    fp = fp[:117] + "..."
+                lines.append(f"{count:>10}  {call_site}  {fp}")
+
+        return "\n".join(lines) + "\n"
+
+    def write_report(self):
+        if self.output_file:
+            with open(self.output_file, "w") as output:
+                output.write(self.report())
+        else:
+            sys.stderr.write(self.report())
+
+class ProfiledCursor:
+    """
+        Cursor wrapper that times execute() and executemany().
+        All the other attributes are delegated to the wrapped cursor.
+    """
+
+    def __init__(self, cursor, stats):
+        self._cursor = cursor
+        self._stats = stats
+
+    def _call_site(self):
+        # Frame of the code that called execute()/executemany()
+        frame = sys._getframe(2)
+        return f"{frame.f_code.co_filename.split('/')[-1]}:{frame.f_lineno} ({frame.f_code.co_name})"
+
+    def execute(self, operation, params=None, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self._cursor.execute(operation, params, *args, **kwargs)
+        finally:
+            self._stats.record(operation, time.perf_counter() - start, self._call_site())
+
+    def executemany(self, operation, seq_params, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self._cursor.executemany(operation, seq_params, *args, **kwargs)
+        finally:
+            self._stats.record(operation, time.perf_counter() - start, self._call_site())
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+class ProfiledConnection:
+    """
+        Connection wrapper that returns profiled cursors.
+    """
+
+    def __init__(self, connection, stats):
+        self._connection = connection
+        self._stats = stats
+
+    def cursor(self, *args, **kwargs):
+        return ProfiledCursor(self._connection.cursor(*args, **kwargs), self._stats)
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+_stats = None
+
+def install(loop_threshold=100, top_n=20, output_file=None):
+    """
+        Replaces db_backend.connect with a version that returns profiled connections.
+        The report is written when the script exits.
+        Returns the QueryStats object.
+    """
+    global _stats
+
+    if _stats is not None:
+        return _stats
+
+    _stats = QueryStats(loop_threshold, top_n, output_file)
+    connect = db_backend.connect
+
+    def profiled_connect(*args, **kwargs):
+        _stats.connections += 1
+        return ProfiledConnection(connect(*args, **kwargs), _stats)
+
+    db_backend.connect = profiled_connect
+    atexit.register(_stats.write_report)
+
+    return _stats
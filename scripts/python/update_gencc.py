@@ -1,17 +1,26 @@
 #!/usr/bin/env python3
 
-import subprocess 
 import argparse
 import os
 import sys
-import mysql.connector
-from mysql.connector import Error
+import db_backend
+from db_backend import Error
 from datetime import date, datetime
 import requests
 import json
 import gzip
 import csv
-from openpyxl import Workbook
+import time
+import hashlib
+import threading
+import traceback
+import importlib.util
+from contextlib import contextmanager, ExitStack
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from openpyxl import Workbook, load_workbook
+import query_stats
+import download_panels
 
 # Mapping terms to GenCC IDs
 allelic_requirement = {
@@ -33,6 +42,17 @@ confidence_category = {
     "refuted": "GENCC:100006"
 }
 
+submitter_id = "GENCC:000112" # G2P submitter id
+submitter_name = "TGMI G2P" # G2P submitter name
+assertion_criteria_url = "https://www.ebi.ac.uk/gene2phenotype/terminology"
+g2p_url = "https://www.ebi.ac.uk/gene2phenotype/gfd?dbID="
+submission_id_base = 1000112 # ID maintained by us. Any alphanumeric string will be accepted up to 64 characters
+
+# Panels of the submission, same order as the download files
+gencc_panels = [file[:-len("G2P.csv.gz")] for file in download_panels.panel_files]
+
+output_header = "submission_id\thgnc_id\thgnc_symbol\tdisease_id\tdisease_name\tmoi_id\tmoi_name\tsubmitter_id\tsubmitter_name\tclassification_id\tclassification_name\tdate\tpublic_report_url\tpmids\tassertion_criteria_url\n"
+
 
 def get_ols(disease_name):
     # only using mondo because mondo gives a close enough match with how we name diseases in G2P
@@ -57,9 +77,10 @@ def get_ols(disease_name):
     else:
         return statement
 
-def fetch_g2p_attribs(host, port, db, user, password):
+def fetch_g2p_attribs(host, port, db, user, password, connection=None):
     """
         Fetchs allelic requirement and mutation consequence attribs from the db.
+        connection: open connection to use (not closed), default: new connection
     """
     ar_attribs = {}
     mc_attribs = {}
@@ -70,12 +91,15 @@ def fetch_g2p_attribs(host, port, db, user, password):
                             WHERE at.code = 'allelic_requirement' or at.code = 'mutation_consequence'
                         """
 
-    connection = mysql.connector.connect(host=host,
-                                         database=db,
-                                         user=user,
-                                         port=port,
-                                         password=password)
+    shared_connection = connection is not None
+    if not shared_connection:
+        connection = db_backend.connect(host=host,
+                                        database=db,
+                                        user=user,
+                                        port=port,
+                                        password=password)
 
+    cursor = None
     try:
         if connection.is_connected():
             cursor = connection.cursor()
@@ -92,14 +116,15 @@ def fetch_g2p_attribs(host, port, db, user, password):
     finally:
         if cursor:
             cursor.close()
-        if connection and connection.is_connected():
+        if not shared_connection and connection and connection.is_connected():
             connection.close()
     
     return ar_attribs, mc_attribs
 
-def fetch_g2p_records(host, port, db, user, password, ar_attribs_dict, mc_attribs_dict):
+def fetch_g2p_records(host, port, db, user, password, ar_attribs_dict, mc_attribs_dict, connection=None):
     """
         Fetchs all G2P records from the db.
+        connection: open connection to use (not closed), default: new connection
     """
     all_records = {}
 
@@ -110,32 +135,25 @@ def fetch_g2p_records(host, port, db, user, password, ar_attribs_dict, mc_attrib
                         left join disease d on d.disease_id = gfd.disease_id
                     """
 
-    connection = mysql.connector.connect(host=host,
-                                         database=db,
-                                         user=user,
-                                         port=port,
-                                         password=password)
+    shared_connection = connection is not None
+    if not shared_connection:
+        connection = db_backend.connect(host=host,
+                                        database=db,
+                                        user=user,
+                                        port=port,
+                                        password=password)
 
+    cursor = None
     try:
         if connection.is_connected():
             cursor = connection.cursor()
             cursor.execute(sql_query_gfd)
             gfd_data = cursor.fetchall()
             for row in gfd_data:
-                ar_final_values = []
-                mc_final_values = []
-
-                for ar_id in row[3]:
-                    ar_final_values.append(ar_attribs_dict[int(ar_id)])
-                for mc_id in row[4]:
-                    mc_final_values.append(mc_attribs_dict[int(mc_id)])
-
                 gene_symbol = row[1]
                 disease = row[2]
-                ar_final_values.sort()
-                mc_final_values.sort()
-                gfd_ar = ";".join(ar_final_values)
-                gfd_mc = ";".join(mc_final_values)
+                gfd_ar = decode_attribs(row[3], ar_attribs_dict)
+                gfd_mc = decode_attribs(row[4], mc_attribs_dict)
 
                 key = f"{gene_symbol}---{disease}---{gfd_ar}---{gfd_mc}"
                 all_records[key] = row[0]
@@ -145,11 +163,679 @@ def fetch_g2p_records(host, port, db, user, password, ar_attribs_dict, mc_attrib
     finally:
         if cursor:
             cursor.close()
-        if connection and connection.is_connected():
+        if not shared_connection and connection and connection.is_connected():
             connection.close()
     
     return all_records
 
+def fetch_submission_rows(host, port, db, user, password, panels=None):
+    """
+        Yields the visible G2P records of the panels as (panel, row, g2p_id), in the order of
+        the panels and of the G2P ids. The rows have the same fields as the download files
+        (only the fields used by the submission).
+        Allelic requirement and mutation consequence (type SET) are decoded by the query.
+    """
+    panels = panels or gencc_panels
+    panel_order = " ".join(["WHEN %s THEN " + str(index) for index in range(len(panels))])
+    panel_list = ", ".join(["%s"] * len(panels))
+
+    sql_query_submission = f""" SELECT gfd.genomic_feature_disease_id, a.value, gf.gene_symbol, gf.hgnc_id, d.name, d.mim,
+                                       (SELECT cc.value FROM attrib cc WHERE cc.attrib_id = gfdp.confidence_category_attrib),
+                                       (SELECT GROUP_CONCAT(ar.value) FROM attrib ar WHERE FIND_IN_SET(ar.attrib_id, gfd.allelic_requirement_attrib)),
+                                       (SELECT GROUP_CONCAT(mc.value) FROM attrib mc WHERE FIND_IN_SET(mc.attrib_id, gfd.mutation_consequence_attrib)),
+                                       (SELECT GROUP_CONCAT(DISTINCT p.pmid) FROM genomic_feature_disease_publication gfdpub
+                                        JOIN publication p ON p.publication_id = gfdpub.publication_id
+                                        WHERE gfdpub.genomic_feature_disease_id = gfd.genomic_feature_disease_id),
+                                       (SELECT MAX(l.created) FROM genomic_feature_disease_panel_log l
+                                        WHERE l.genomic_feature_disease_panel_id = gfdp.genomic_feature_disease_panel_id AND l.action = 'create'),
+                                       (SELECT MIN(ot.ontology_accession) FROM disease_ontology_mapping dom
+                                        JOIN ontology_term ot ON ot.ontology_term_id = dom.ontology_term_id
+                                        WHERE dom.disease_id = gfd.disease_id)
+                                FROM genomic_feature_disease gfd
+                                JOIN genomic_feature_disease_panel gfdp ON gfdp.genomic_feature_disease_id = gfd.genomic_feature_disease_id
+                                JOIN attrib a ON a.attrib_id = gfdp.panel_attrib
+                                LEFT JOIN genomic_feature gf ON gf.genomic_feature_id = gfd.genomic_feature_id
+                                LEFT JOIN disease d ON d.disease_id = gfd.disease_id
+                                WHERE a.value IN ({panel_list}) AND gfdp.is_visible = 1
+                                ORDER BY CASE a.value {panel_order} END, gfd.genomic_feature_disease_id
+                            """
+
+    connection = db_backend.connect(host=host,
+                                    database=db,
+                                    user=user,
+                                    port=port,
+                                    password=password)
+
+    try:
+        if connection.is_connected():
+            cursor = connection.cursor()
+            if db_backend.backend() == "mysql":
+                # The default maximum length (1024) truncates long lists of pmids
+                cursor.execute("SET SESSION group_concat_max_len = 1000000")
+            cursor.execute(sql_query_submission, panels + panels)
+            for row in cursor:
+                mc_list = row[8].split(",") if row[8] else []
+                mc_list.sort()
+                pmids = sorted(row[9].split(","), key=int) if row[9] else []
+                created = row[10]
+                if isinstance(created, datetime):
+                    created = created.strftime("%Y-%m-%d %H:%M:%S")
+
+                # Same defaults as the download files
+                submission_row = { "gene symbol":row[2] or "No gene symbol",
+                                   "hgnc id":str(row[3]) if row[3] else "No hgnc id",
+                                   "disease name":row[4] or "No disease name",
+                                   "disease mim":str(row[5]) if row[5] else "No disease mim",
+                                   "confidence category":row[6] or "No confidence category",
+                                   "allelic requirement":(row[7] or "").replace(",", ";"),
+                                   "mutation consequence":";".join(mc_list),
+                                   "pmids":";".join(str(pmid) for pmid in pmids),
+                                   "gene disease pair entry date":created or "",
+                                   "disease ontology":row[11] or "" }
+
+                yield row[1], submission_row, row[0]
+
+    except Error as e:
+        print("Error while connecting to MySQL", e)
+    finally:
+        if connection.is_connected():
+            cursor.close()
+            connection.close()
+
+# Columns of the download files used by the submission
+submission_columns = ["gene symbol", "disease name", "allelic requirement", "mutation consequence", "hgnc id",
+                      "confidence category", "disease mim", "disease ontology", "pmids", "gene disease pair entry date"]
+
+def parse_download_file(file_path):
+    """
+        Returns the rows of a download file as tuples of the submission columns
+    """
+    with gzip.open(file_path, mode='rt') as gz_file:
+        return [tuple(row[column] for column in submission_columns) for row in csv.DictReader(gz_file)]
+
+def read_parsed_file(file_path):
+    """
+        Returns the parsed rows of a download file saved by write_parsed_file(),
+        None if the file was not parsed or was parsed with other columns
+    """
+    path = f"{file_path}.rows.json.gz"
+    if not os.path.isfile(path):
+        return None
+
+    with gzip.open(path, mode='rt', encoding="utf-8") as fh:
+        parsed = json.load(fh)
+
+    if parsed['columns'] != submission_columns:
+        return None
+
+    return [tuple(row) for row in parsed['rows']]
+
+def write_parsed_file(file_path, rows):
+    """
+        Saves the parsed rows of a download file next to the file (gzipped JSON).
+        Only used for the files of the archive: the file never changes.
+    """
+    path = f"{file_path}.rows.json.gz"
+    with gzip.open(f"{path}.tmp", mode='wt', encoding="utf-8", compresslevel=1) as output:
+        json.dump({ 'columns':submission_columns, 'rows':rows }, output)
+    os.replace(f"{path}.tmp", path)
+
+def read_download_files(files, workers=1, names=None, cache=False):
+    """
+        Yields the rows of the download files as (file, row, None), in the order of the files.
+        With more than one worker the files are parsed in a process pool.
+        names: names of the files in the messages (default: file name of the path)
+        cache: use the parsed rows saved by a previous run (files of the archive)
+    """
+    names = names or [os.path.basename(file_path) for file_path in files]
+
+    if workers <= 1 and not cache:
+        for file, file_path in zip(names, files):
+            with gzip.open(file_path, mode='rt') as gz_file:
+                for row in csv.DictReader(gz_file):
+                    yield file, row, None
+        return
+
+    parsed = {}
+    if cache:
+        for file_path in files:
+            rows = read_parsed_file(file_path)
+            if rows is not None:
+                parsed[file_path] = rows
+    # The same file can be used by more than one panel
+    to_parse = list(dict.fromkeys(file_path for file_path in files if file_path not in parsed))
+
+    with ExitStack() as stack:
+        if workers > 1 and len(to_parse) > 1:
+            executor = stack.enter_context(ProcessPoolExecutor(max_workers=min(workers, len(to_parse))))
+            results = zip(to_parse, executor.map(parse_download_file, to_parse))
+        else:
+            results = ((file_path, parse_download_file(file_path)) for file_path in to_parse)
+
+        for file, file_path in zip(names, files):
+            while file_path not in parsed:
+                parsed_path, rows = next(results)
+                parsed[parsed_path] = rows
+                if cache:
+                    write_parsed_file(parsed_path, rows)
+
+            for values in parsed[file_path]:
+                yield file, dict(zip(submission_columns, values)), None
+
+# Tables read by fetch_g2p_attribs() and fetch_g2p_records()
+records_cache_tables = ["attrib", "attrib_type", "genomic_feature_disease", "genomic_feature", "disease"]
+
+_records_cache = {} # key: cache file; value: content of the cache (kept by the long-running mode)
+
+def read_records_cache(cache_file, database):
+    """
+        Returns the content of the cache of the G2P records of the database,
+        None if there is no cache or it is the cache of another database
+    """
+    if not cache_file or not os.path.isfile(cache_file):
+        return None
+
+    with open(cache_file, encoding="utf-8") as fh:
+        cache = json.load(fh)
+    if cache.get('database') != database:
+        return None
+
+    # JSON keys are strings
+    cache['ar_attribs'] = { int(attrib_id):value for attrib_id, value in cache['ar_attribs'].items() }
+    cache['mc_attribs'] = { int(attrib_id):value for attrib_id, value in cache['mc_attribs'].items() }
+
+    return cache
+
+def write_records_cache(cache_file, cache):
+    with open(f"{cache_file}.tmp", "w", encoding="utf-8") as output:
+        json.dump(cache, output)
+    os.replace(f"{cache_file}.tmp", cache_file)
+
+def fetch_g2p_data(host, port, db, user, password, cache_file=None):
+    """
+        Returns the allelic requirement and mutation consequence attribs and the G2P records
+        (fetch_g2p_attribs and fetch_g2p_records).
+        With a cache file, the checksums of the tables are compared with the checksums of
+        the cache (one query) and the database is only read if a table changed.
+        The database is read with one connection.
+    """
+    database = f"{host}:{port}/{db}"
+    ar_attribs, mc_attribs, all_records = {}, {}, {}
+
+    connection = db_backend.connect(host=host,
+                                    database=db,
+                                    user=user,
+                                    port=port,
+                                    password=password)
+
+    try:
+        if connection.is_connected():
+            cursor = connection.cursor()
+            checksums = db_backend.table_checksums(cursor, records_cache_tables) if cache_file else None
+            cursor.close()
+
+            cache = _records_cache.get(cache_file) or read_records_cache(cache_file, database)
+            if cache and cache['database'] == database and cache['checksums'] == checksums:
+                _records_cache[cache_file] = cache
+                print(f"INFO: G2P records read from the cache {cache_file} (tables not changed)")
+                return cache['ar_attribs'], cache['mc_attribs'], cache['records']
+
+            ar_attribs, mc_attribs = fetch_g2p_attribs(host, port, db, user, password, connection=connection)
+            all_records = fetch_g2p_records(host, port, db, user, password, ar_attribs, mc_attribs, connection=connection)
+
+            if cache_file and ar_attribs and all_records:
+                _records_cache[cache_file] = { 'database':database,
+                                               'checksums':checksums,
+                                               'ar_attribs':ar_attribs,
+                                               'mc_attribs':mc_attribs,
+                                               'records':all_records }
+                write_records_cache(cache_file, _records_cache[cache_file])
+
+    except Error as e:
+        print("Error while connecting to MySQL", e)
+    finally:
+        if connection.is_connected():
+            connection.close()
+
+    return ar_attribs, mc_attribs, all_records
+
+def decode_attribs(set_value, attribs_dict):
+    """
+        Decodes a SET column with attrib ids into a sorted string of attrib values separated by ';'
+    """
+    values = [attribs_dict[int(attrib_id)] for attrib_id in set_value]
+    values.sort()
+
+    return ";".join(values)
+
+def build_key(row):
+    """
+        Returns the key used to match a row from the download files to the G2P records.
+        Format: gene---disease---allelic requirement---mutation consequences (sorted)
+    """
+    mc_list = row["mutation consequence"].split(";")
+    mc_list.sort()
+    mc = ";".join(mc_list)
+
+    return f"{row['gene symbol']}---{row['disease name']}---{row['allelic requirement']}---{mc}"
+
+def submission_fields(row, g2p_id):
+    """
+        Returns the fields (output_header) to output for a row from the download files.
+        The allelic requirement of the row has to be valid (key in allelic_requirement).
+    """
+    gene_symbol = row["gene symbol"]
+    disease_name = row["disease name"]
+    ar = row["allelic requirement"]
+
+    # HGNC ID
+    h = row["hgnc id"]
+    hgnc_id = f"HGNC:{h}"
+
+    # Prepare MOI - allelic requeriment
+    moi_id = allelic_requirement[ar]
+
+    record_url = g2p_url + str(g2p_id)
+
+    # the submission id is generated and maintained by us
+    g2p_id_formatted = f"{int(g2p_id):05}"
+    submission_id = f"{submission_id_base}{g2p_id_formatted}"
+
+    # Confidence
+    confidence = row["confidence category"]
+    classification_id = confidence_category[confidence]
+
+    # Update disease name to dyadic
+    if not disease_name.startswith(gene_symbol):
+        new_disease_name = gene_symbol + "-related " + disease_name
+    else:
+        new_disease_name = disease_name
+
+    # We use the OMIM, Mondo or Orphanet as the disease_id
+    disease_id = row["disease mim"]
+    disease_ontology = row["disease ontology"]
+    if disease_id == "No disease mim" and disease_ontology:
+        disease_id = disease_ontology
+
+    # pmids = row["pmids"].replace(";", ",")
+    pmids = row["pmids"]
+
+    g2p_date = row["gene disease pair entry date"]
+    if g2p_date:
+        g2p_date_tmp = datetime.strptime(g2p_date, "%Y-%m-%d %H:%M:%S")
+        g2p_date = g2p_date_tmp.strftime("%Y/%m/%d")
+
+    return [submission_id, hgnc_id, gene_symbol, disease_id, new_disease_name, moi_id, ar, submitter_id, submitter_name,
+            classification_id, confidence, g2p_date, record_url, pmids, assertion_criteria_url]
+
+def format_submission_line(row, g2p_id):
+    """
+        Returns the line to output for a row from the download files.
+    """
+    return "\t".join(submission_fields(row, g2p_id)) + "\n"
+
+# Phases of a run, in the order of the pipeline
+metric_phases = ["download", "db_fetch", "parse", "transform", "tsv_write", "xlsx_write"]
+
+def new_metrics():
+    """
+        Returns the metrics of a run: duration and counters of each phase
+    """
+    return { 'started':time.time(),
+             'success':None,
+             'duration':None,
+             'phases':{ phase:{ 'seconds':0.0, 'rows_in':0, 'rows_out':0, 'bytes':0 } for phase in metric_phases },
+             'skipped':{ 'allelic_requirement':0, 'confidence_category':0 },
+             'deduplicated':0 }
+
+@contextmanager
+def timed_phase(metrics, phase):
+    """
+        Adds the duration of the block to the phase. Yields the metrics of the phase.
+    """
+    start = time.perf_counter()
+    try:
+        yield metrics['phases'][phase]
+    finally:
+        metrics['phases'][phase]['seconds'] += time.perf_counter() - start
+
+def timed_rows(rows, metrics, phase):
+    """
+        Yields the rows and adds to the phase the time spent producing them and the number of rows
+    """
+    phase_metrics = metrics['phases'][phase]
+    iterator = iter(rows)
+    while True:
+        start = time.perf_counter()
+        try:
+            row = next(iterator)
+        except StopIteration:
+            phase_metrics['seconds'] += time.perf_counter() - start
+            return
+        phase_metrics['seconds'] += time.perf_counter() - start
+        phase_metrics['rows_out'] += 1
+        yield row
+
+def format_run_metrics(metrics):
+    """
+        Returns the metrics of a run in the Prometheus text format
+    """
+    phases = metrics['phases']
+    lines = []
+
+    def add(name, metric_type, description, values):
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for labels, value in values:
+            lines.append(f"{name}{labels} {value}")
+
+    add("g2p_gencc_run_success", "gauge", "1 if the last run succeeded", [("", int(bool(metrics['success'])))])
+    add("g2p_gencc_run_timestamp_seconds", "gauge", "Start time of the last run", [("", metrics['started'])])
+    add("g2p_gencc_run_duration_seconds", "gauge", "Duration of the last run", [("", metrics['duration'] or 0)])
+    add("g2p_gencc_phase_duration_seconds", "gauge", "Duration of each phase of the last run",
+        [(f'{{phase="{phase}"}}', phases[phase]['seconds']) for phase in metric_phases])
+    add("g2p_gencc_phase_rows_in", "gauge", "Rows read by each phase of the last run",
+        [(f'{{phase="{phase}"}}', phases[phase]['rows_in']) for phase in metric_phases])
+    add("g2p_gencc_phase_rows_out", "gauge", "Rows produced by each phase of the last run",
+        [(f'{{phase="{phase}"}}', phases[phase]['rows_out']) for phase in metric_phases])
+    add("g2p_gencc_phase_bytes", "gauge", "Bytes downloaded or written by each phase of the last run",
+        [(f'{{phase="{phase}"}}', phases[phase]['bytes']) for phase in metric_phases])
+    add("g2p_gencc_rows_skipped", "gauge", "Rows skipped by the last run (invalid term)",
+        [(f'{{reason="{reason}"}}', value) for reason, value in metrics['skipped'].items()])
+    add("g2p_gencc_deduplicated_keys", "gauge", "Rows of the last run with a key already submitted", [("", metrics['deduplicated'])])
+
+    return "\n".join(lines) + "\n"
+
+def write_metrics(metrics_dir, metrics):
+    """
+        Writes the metrics of a run to <metrics_dir>/g2p_gencc.prom (Prometheus textfile collector)
+        and <metrics_dir>/g2p_gencc.json
+    """
+    os.makedirs(metrics_dir, exist_ok=True)
+    for file, content in [("g2p_gencc.prom", format_run_metrics(metrics)),
+                          ("g2p_gencc.json", json.dumps(metrics, indent=2, sort_keys=True))]:
+        path = os.path.join(metrics_dir, file)
+        # The collector can read the file at any time
+        with open(f"{path}.tmp", "w", encoding="utf-8") as output:
+            output.write(content)
+        os.replace(f"{path}.tmp", path)
+
+@contextmanager
+def submission_writer(txt_file, excel_file, header, metrics=None):
+    """
+        Writes the submission to the text file and to the Excel file in one pass.
+        The header is written first, yields a function that writes the fields of one line.
+        The Excel file uses a write-only workbook: the rows are streamed to disk and
+        the file is saved when the writing is done.
+        metrics: metrics of the run (phases tsv_write and xlsx_write), the rows do not include the header
+    """
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+
+    with open(txt_file, mode='w') as output_file:
+        output_file.write("\t".join(header) + "\n")
+        sheet.append(header)
+
+        if metrics:
+            tsv_metrics = metrics['phases']['tsv_write']
+            xlsx_metrics = metrics['phases']['xlsx_write']
+
+            def write(fields):
+                start = time.perf_counter()
+                output_file.write("\t".join(fields) + "\n")
+                middle = time.perf_counter()
+                sheet.append(fields)
+                tsv_metrics['seconds'] += middle - start
+                xlsx_metrics['seconds'] += time.perf_counter() - middle
+                tsv_metrics['rows_in'] += 1
+                tsv_metrics['rows_out'] += 1
+                xlsx_metrics['rows_in'] += 1
+                xlsx_metrics['rows_out'] += 1
+        else:
+            def write(fields):
+                output_file.write("\t".join(fields) + "\n")
+                sheet.append(fields)
+
+        yield write
+
+    if metrics:
+        with timed_phase(metrics, "xlsx_write"):
+            workbook.save(excel_file)
+        tsv_metrics['bytes'] = os.path.getsize(txt_file)
+        xlsx_metrics['bytes'] = os.path.getsize(excel_file)
+    else:
+        workbook.save(excel_file)
+
+def submission_lines(submission_rows, all_g2p_records, metrics=None):
+    """
+        Yields the fields of the submission lines of the rows (file, row, g2p_id).
+        The first row of each key is used, rows with an invalid allelic requirement or
+        confidence category are skipped.
+        Rows without G2P id are matched to the G2P records (all_g2p_records) by key.
+        metrics: metrics of the run (skipped rows and duplicated keys)
+    """
+    final_data_to_submit = {}
+
+    for file, row, g2p_id in submission_rows:
+        key = build_key(row)
+
+        if key in final_data_to_submit:
+            if metrics:
+                metrics['deduplicated'] += 1
+        else:
+            # we are going to skip records with multiple allelic requirement
+            ar = row["allelic requirement"]
+            if ar not in allelic_requirement:
+                print(f"SKIP: invalid allelic requeriment '{ar}' not found for key '{key}' in file '{file}'")
+                if metrics:
+                    metrics['skipped']['allelic_requirement'] += 1
+                continue
+            confidence = row["confidence category"]
+            if confidence not in confidence_category:
+                print(f"SKIP: invalid confidence category '{confidence}' for key '{key}' in file '{file}'")
+                if metrics:
+                    metrics['skipped']['confidence_category'] += 1
+                continue
+
+            # Get the G2P internal ID to use in the URL
+            if g2p_id is None:
+                if key in all_g2p_records:
+                    g2p_id = all_g2p_records[key]
+                else:
+                    sys.exit(f"Key: '{key}' from download files not found in G2P database")
+
+            yield submission_fields(row, g2p_id)
+
+            final_data_to_submit[key] = 1
+
+def arrow_available():
+    return importlib.util.find_spec("pyarrow") is not None
+
+def arrow_starts_with(values, prefixes):
+    """
+        Returns a boolean array: values[i] starts with prefixes[i] (same as str.startswith)
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    lengths = pc.utf8_length(prefixes)
+    result = pa.array([False] * len(values))
+    for length in pc.unique(lengths).to_pylist():
+        same_prefix = pc.equal(pc.utf8_slice_codeunits(values, 0, length), prefixes)
+        result = pc.or_(result, pc.and_(pc.equal(lengths, length), same_prefix))
+
+    return result
+
+def arrow_submission_lines(files, all_g2p_records, names=None, metrics=None):
+    """
+        Returns the fields of the submission lines of the download files, same lines as
+        submission_lines() (row engine) computed with pyarrow column operations:
+        the files are read in one table, the terms are mapped with dictionary lookups
+        and the first row of each key is kept (stable drop duplicates).
+        names: names of the files in the messages (default: file name of the path)
+        metrics: metrics of the run (parse phase, skipped rows and duplicated keys)
+    """
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.compute as pc
+
+    names = names or [os.path.basename(file_path) for file_path in files]
+
+    parse_start = time.perf_counter()
+    tables = []
+    for file, file_path in zip(names, files):
+        # Gzip is detected from the file extension
+        # The quoted values can have new lines (disease names), as with csv.DictReader
+        table = pa_csv.read_csv(file_path,
+                                parse_options=pa_csv.ParseOptions(newlines_in_values=True),
+                                convert_options=pa_csv.ConvertOptions(column_types={ column:pa.string() for column in submission_columns },
+                                                                      include_columns=submission_columns,
+                                                                      strings_can_be_null=False))
+        tables.append(table.append_column("file", pa.array([file] * table.num_rows, pa.string())))
+    table = pa.concat_tables(tables).combine_chunks()
+    table = table.append_column("position", pa.array(range(table.num_rows), pa.int64()))
+    if metrics:
+        metrics['phases']['parse']['seconds'] += time.perf_counter() - parse_start
+        metrics['phases']['parse']['rows_out'] += table.num_rows
+
+    # Key: gene---disease---allelic requirement---mutation consequences (sorted)
+    mc_lists = pc.split_pattern(table["mutation consequence"], ";").combine_chunks()
+    mc_sorted = pa.table({ "parent":pc.list_parent_indices(mc_lists), "value":pc.list_flatten(mc_lists) }).sort_by([("parent", "ascending"), ("value", "ascending")])
+    mc_lists = pa.ListArray.from_arrays(mc_lists.offsets, mc_sorted["value"].combine_chunks())
+    key = pc.binary_join_element_wise(table["gene symbol"], table["disease name"], table["allelic requirement"],
+                                      pc.binary_join(mc_lists, ";"), "---")
+    table = table.append_column("key", key)
+
+    # MOI and classification: null for invalid terms
+    moi_id = pc.take(pa.array(list(allelic_requirement.values())),
+                     pc.index_in(table["allelic requirement"], value_set=pa.array(list(allelic_requirement.keys()))))
+    classification_id = pc.take(pa.array(list(confidence_category.values())),
+                                pc.index_in(table["confidence category"], value_set=pa.array(list(confidence_category.keys()))))
+    table = table.append_column("moi_id", moi_id).append_column("classification_id", classification_id)
+
+    valid = pc.and_(pc.is_valid(table["moi_id"]), pc.is_valid(table["classification_id"]))
+    first_rows = table.filter(valid).group_by("key", use_threads=False).aggregate([("position", "min")])
+    first_position = dict(zip(first_rows["key"].to_pylist(), first_rows["position_min"].to_pylist()))
+    if metrics:
+        # Rows after the first valid row of their key
+        metrics['deduplicated'] += pc.sum(pc.is_in(table["key"], value_set=first_rows["key"])).as_py() - first_rows.num_rows
+
+    # Invalid rows are reported until the first valid row of the key (same as the row engine)
+    invalid = table.filter(pc.invert(valid)).select(["position", "key", "file", "allelic requirement", "confidence category"])
+    for position, key, file, ar, confidence in zip(*[invalid[column].to_pylist() for column in invalid.column_names]):
+        if position < first_position.get(key, position + 1):
+            if ar not in allelic_requirement:
+                print(f"SKIP: invalid allelic requeriment '{ar}' not found for key '{key}' in file '{file}'")
+                reason = 'allelic_requirement'
+            else:
+                print(f"SKIP: invalid confidence category '{confidence}' for key '{key}' in file '{file}'")
+                reason = 'confidence_category'
+            if metrics:
+                metrics['skipped'][reason] += 1
+
+    # The position of a row is its index in the table, the rows are kept in the original order
+    table = table.take(pc.take(first_rows["position_min"], pc.array_sort_indices(first_rows["position_min"])))
+
+    # G2P internal ID
+    g2p_keys = list(all_g2p_records.keys())
+    g2p_id = pc.take(pa.array([all_g2p_records[key] for key in g2p_keys], pa.int64()),
+                     pc.index_in(table["key"], value_set=pa.array(g2p_keys, pa.string())))
+    if g2p_id.null_count:
+        key = table["key"].filter(pc.is_null(g2p_id))[0].as_py()
+        sys.exit(f"Key: '{key}' from download files not found in G2P database")
+    g2p_id = g2p_id.cast(pa.string())
+
+    gene_symbol = table["gene symbol"]
+    disease_name = table["disease name"]
+
+    # Update disease name to dyadic
+    new_disease_name = pc.if_else(arrow_starts_with(disease_name, gene_symbol), disease_name,
+                                  pc.binary_join_element_wise(gene_symbol, "-related ", disease_name, ""))
+
+    # We use the OMIM, Mondo or Orphanet as the disease_id
+    disease_id = pc.if_else(pc.and_(pc.equal(table["disease mim"], "No disease mim"), pc.not_equal(table["disease ontology"], "")),
+                            table["disease ontology"], table["disease mim"])
+
+    g2p_date = table["gene disease pair entry date"]
+    no_date = pc.equal(g2p_date, "")
+    g2p_date = pc.strftime(pc.strptime(pc.if_else(no_date, "1970-01-01 00:00:00", g2p_date), format="%Y-%m-%d %H:%M:%S", unit="s"),
+                           format="%Y/%m/%d")
+    g2p_date = pc.if_else(no_date, "", g2p_date)
+
+    columns = [pc.binary_join_element_wise(str(submission_id_base), pc.utf8_lpad(g2p_id, width=5, padding="0"), ""),
+               pc.binary_join_element_wise("HGNC:", table["hgnc id"], ""),
+               gene_symbol,
+               disease_id,
+               new_disease_name,
+               table["moi_id"],
+               table["allelic requirement"],
+               pa.array([submitter_id] * table.num_rows),
+               pa.array([submitter_name] * table.num_rows),
+               table["classification_id"],
+               table["confidence category"],
+               g2p_date,
+               pc.binary_join_element_wise(g2p_url, g2p_id, ""),
+               table["pmids"],
+               pa.array([assertion_criteria_url] * table.num_rows)]
+
+    return [list(fields) for fields in zip(*[column.to_pylist() for column in columns])]
+
+def find_previous_submission(path, present_day):
+    """
+        Returns the submission file (G2P_GenCC.txt or G2P_GenCC.xlsx) of the last dated
+        directory of path before present_day, None if there is no previous submission.
+    """
+    previous_days = []
+    if os.path.isdir(path):
+        for directory in os.listdir(path):
+            try:
+                day = date.fromisoformat(directory)
+            except ValueError:
+                continue
+            if day < present_day:
+                previous_days.append(directory)
+
+    for directory in sorted(previous_days, reverse=True):
+        for file in ["G2P_GenCC.txt", "G2P_GenCC.xlsx"]:
+            file_path = os.path.join(path, directory, file)
+            if os.path.isfile(file_path):
+                return file_path
+
+    return None
+
+def read_submission(file_path):
+    """
+        Yields the fields of the lines of a submission file (text or Excel), header excluded
+    """
+    n_fields = len(output_header.rstrip("\n").split("\t"))
+
+    if file_path.endswith(".xlsx"):
+        workbook = load_workbook(file_path, read_only=True)
+        try:
+            for row in workbook.active.iter_rows(min_row=2, max_col=n_fields, values_only=True):
+                if row[0] is not None:
+                    yield ["" if value is None else str(value) for value in row]
+        finally:
+            workbook.close()
+    else:
+        with open(file_path, 'r') as file:
+            next(file, None)
+            for line in file:
+                yield line.rstrip("\n").split("\t")
+
+def row_hash(fields):
+    """
+        Returns the hash of the fields of a submission line
+    """
+    return hashlib.sha256("\t".join(fields).encode("utf-8")).hexdigest()
+
+def submission_hashes(file_path):
+    """
+        Returns the hashes of the lines of a submission file.
+        Output: dict key = submission_id; value = hash of the line
+    """
+    return { fields[0]:row_hash(fields) for fields in read_submission(file_path) }
+
 def convert_txt_to_excel(input_file, output_file):
     """
         Converts a text file to an Excel file.
@@ -166,58 +852,99 @@ def convert_txt_to_excel(input_file, output_file):
     wb.save(output_file)
 
 
-def main():
-    ap = argparse.ArgumentParser()
-    ap.add_argument("-p", "--path",
-                    default='/nfs/production/flicek/ensembl/variation/G2P/GenCC_create/',
-                    help="Path where the G2P and GenCC files are going to be saved")
-    ap.add_argument("--host", required=True, help="G2P database host")
-    ap.add_argument("--port", required=True, help="Host port")
-    ap.add_argument("--database", required=True, help="G2P Database name")
-    ap.add_argument("--user", required=True, help="Username for the G2P db")
-    ap.add_argument("--password", default='', help="Password (default: '')")
-    args = ap.parse_args()
+def run_submission(args):
+    """
+        Runs the GenCC submission with the options of the command line.
+        Returns the statistics of the run: output path, number of lines, diff counts (--diff)
+        and metrics. With --metrics_dir the metrics are also written to files (failed runs too).
+    """
+    metrics = new_metrics()
+    start = time.perf_counter()
+    try:
+        result = generate_submission(args, metrics)
+        metrics['success'] = True
+    except (Exception, SystemExit):
+        metrics['success'] = False
+        raise
+    finally:
+        metrics['duration'] = time.perf_counter() - start
+        if args.metrics_dir:
+            write_metrics(args.metrics_dir, metrics)
 
+    result['metrics'] = metrics
+    return result
+
+def generate_submission(args, metrics):
+    """
+        Writes the GenCC submission files, the duration and counters of each phase are added to metrics.
+        Returns the output path, the number of lines and the diff counts (--diff).
+    """
     host = args.host
     port = args.port
     db = args.database
     user = args.user
     password = args.password
 
-    ensembl_dir = os.environ.get('ENSEMBL_ROOT_DIR')
+    # Attach the date to the path
+    present_day = date.today()
+    output_path = args.path + "/" + str(present_day)
 
-    if not ensembl_dir or not os.path.exists(f"{ensembl_dir}/ensembl-gene2phenotype/scripts/download_file.sh"):
-        raise FileNotFoundError("ENSEMBL_ROOT_DIR is not set correctly or the script does not exist")
+    if args.source == "db":
+        # The submission rows are read from the database, the G2P id is the id of the record
+        print(f"Fetching the G2P records of the panels: {', '.join(args.panels)}\n")
+        os.makedirs(output_path, exist_ok=True)
+        submission_rows = timed_rows(fetch_submission_rows(host, port, db, user, password, args.panels), metrics, "db_fetch")
+        all_g2p_records = {}
+    else:
+        print("\nDownloading G2P files...")
+        try:
+            with timed_phase(metrics, "download") as phase:
+                files, phase['bytes'] = download_panels.download_files(args.path, args.download_url, workers=args.download_workers, archive=args.archive)
+                phase['rows_out'] = len(files)
+        except requests.RequestException as e:
+            sys.exit(f"Error while downloading the G2P files: {e}")
+        print("Downloading G2P files... done\n")
+        # The files of the archive are named by sha256, the messages use the names of the panel files
+        file_names = download_panels.panel_files if args.archive else None
+        submission_rows = timed_rows(read_download_files(files, args.parse_workers, file_names, cache=args.archive), metrics, "parse")
 
-    print("\nDownloading G2P files...")
-    subprocess.run(['bash', f"{ensembl_dir}/ensembl-gene2phenotype/scripts/download_file.sh", args.path])
-    print("Downloading G2P files... done\n")
+        print(f"Fetching all G2P records...")
+        # Fetch the attribs from G2P db
+        # Allelic requeriment and mutation consequence are type SET
+        # Doing a join is complicated when we have multiple values in the SET
+        # That is why we pre-fetched the attribs with fetch_g2p_attribs()
+        records_cache = None if args.no_records_cache else args.records_cache or os.path.join(args.path, "g2p_records_cache.json")
+        with timed_phase(metrics, "db_fetch") as phase:
+            ar_attribs, mc_attribs, all_g2p_records = fetch_g2p_data(host, port, db, user, password, records_cache)
+            phase['rows_out'] = len(all_g2p_records)
+        print(f"Fetching all G2P records... done\n")
 
-    # Attach the date to the path
-    present_day = date.today()
-    args.path = args.path + "/" + str(present_day)
+    print(f"Using directory for GenCC files: {output_path}\n")
 
-    print(f"Using directory for GenCC files: {args.path}\n")
-    files = [f for f in os.listdir(args.path) if os.path.isfile(os.path.join(args.path, f))]
+    outfile = output_path + "/G2P_GenCC.txt"
+    final_output_file = output_path + "/G2P_GenCC.xlsx"
 
-    outfile = args.path + "/G2P_GenCC.txt"
-    final_output_file = args.path + "/G2P_GenCC.xlsx"
+    if args.engine == "arrow" and args.source == "files" and arrow_available():
+        with timed_phase(metrics, "transform"):
+            lines = arrow_submission_lines(files, all_g2p_records, file_names, metrics)
+    else:
+        if args.engine == "arrow":
+            print("WARNING: the arrow engine needs pyarrow and --source files, using the row engine\n")
+        lines = submission_lines(submission_rows, all_g2p_records, metrics)
+    lines = timed_rows(lines, metrics, "transform")
+    n_lines = 0
 
-    final_data_to_submit = {}
-    submitter_id = "GENCC:000112" # G2P submitter id
-    submitter_name = "TGMI G2P" # G2P submitter name
-    assertion_criteria_url = "https://www.ebi.ac.uk/gene2phenotype/terminology"
-    g2p_url = "https://www.ebi.ac.uk/gene2phenotype/gfd?dbID="
-    submission_id_base = 1000112 # ID maintained by us. Any alphanumeric string will be accepted up to 64 characters
-
-    print(f"Fetching all G2P records...")
-    # Fetch the attribs from G2P db
-    ar_attribs, mc_attribs = fetch_g2p_attribs(host, port, db, user, password)
-    # Allelic requeriment and mutation consequence are type SET
-    # Doing a join is complicated when we have multiple values in the SET
-    # That is why we pre-fetched the attribs with fetch_g2p_attribs()
-    all_g2p_records = fetch_g2p_records(host, port, db, user, password, ar_attribs, mc_attribs)
-    print(f"Fetching all G2P records... done\n")
+    # Diff mode: the new, changed and removed lines are also written to separate files
+    previous = None
+    if args.diff:
+        previous_file = args.previous or find_previous_submission(os.path.dirname(output_path), present_day)
+        if previous_file:
+            print(f"Comparing with the previous submission: {previous_file}\n")
+            previous = submission_hashes(previous_file)
+        else:
+            print("WARNING: no previous submission found, all the lines are new\n")
+            previous = {}
+    diff_counts = { 'new':0, 'changed':0, 'removed':0 }
 
     # Output format
     # submission_id: automatic id
@@ -236,81 +963,245 @@ def main():
     # pmids: Listing of PMIDs that have been used in the submission seperated by comma
     # assertion_criteria_url: G2P terminology url
 
-    with open(outfile, mode='w') as output_file:
-        # Write output header
-        output_file.write("submission_id\thgnc_id\thgnc_symbol\tdisease_id\tdisease_name\tmoi_id\tmoi_name\tsubmitter_id\tsubmitter_name\tclassification_id\tclassification_name\tdate\tpublic_report_url\tpmids\tassertion_criteria_url\n")
+    header = output_header.rstrip("\n").split("\t")
 
-        for file in files:
-            file_path = args.path + "/" + file
+    with ExitStack() as stack:
+        write = stack.enter_context(submission_writer(outfile, final_output_file, header, metrics))
 
-            with gzip.open(file_path, mode='rt') as gz_file:
-                csv_reader = csv.DictReader(gz_file)
-                
-                for row in csv_reader:
-                    gene_symbol = row["gene symbol"]
-                    disease_name = row["disease name"]
-                    ar = row["allelic requirement"] # we are going to skip records with multiple allelic requirement
-                    mc_list = row["mutation consequence"].split(";")
-                    mc_list.sort()
-                    mc = ";".join(mc_list)
-                    key = f"{gene_symbol}---{disease_name}---{ar}---{mc}"
-
-                    if key not in final_data_to_submit:
-                        # HGNC ID
-                        h = row["hgnc id"]
-                        hgnc_id = f"HGNC:{h}"
-
-                        # Prepare MOI - allelic requeriment
-                        if ar in allelic_requirement:
-                            moi_id = allelic_requirement[ar]
-                        else:
-                            print(f"SKIP: invalid allelic requeriment '{ar}' not found for key '{key}' in file '{file}'")
-                            continue
-
-                        # Get the G2P internal ID to use in the URL
-                        if key in all_g2p_records:
-                            g2p_id = all_g2p_records[key]
-                        else:
-                            sys.exit(f"Key: '{key}' from download files not found in G2P database")
-
-                        record_url = g2p_url + str(g2p_id)
-
-                        # the submission id is generated and maintained by us
-                        g2p_id_formatted = f"{int(g2p_id):05}"
-                        submission_id = f"{submission_id_base}{g2p_id_formatted}"
-
-                        # Confidence
-                        confidence = row["confidence category"]
-                        classification_id = confidence_category[confidence]
-
-                        # Update disease name to dyadic
-                        if not disease_name.startswith(gene_symbol):
-                            new_disease_name = gene_symbol + "-related " + disease_name
-                        else:
-                            new_disease_name = disease_name
-
-                        # We use the OMIM, Mondo or Orphanet as the disease_id
-                        disease_id = row["disease mim"]
-                        disease_ontology = row["disease ontology"]
-                        if disease_id == "No disease mim" and disease_ontology:
-                            disease_id = disease_ontology
-                        
-                        # pmids = row["pmids"].replace(";", ",")
-                        pmids = row["pmids"]
-
-                        g2p_date = row["gene disease pair entry date"]
-                        if g2p_date:
-                            g2p_date_tmp = datetime.strptime(g2p_date, "%Y-%m-%d %H:%M:%S")
-                            g2p_date = g2p_date_tmp.strftime("%Y/%m/%d")
-
-                        line_to_output = f"{submission_id}\t{hgnc_id}\t{gene_symbol}\t{disease_id}\t{new_disease_name}\t{moi_id}\t{ar}\t{submitter_id}\t{submitter_name}\t{classification_id}\t{confidence}\t{g2p_date}\t{record_url}\t{pmids}\t{assertion_criteria_url}\n"
-                        output_file.write(line_to_output)
-
-                        final_data_to_submit[key] = 1
-
-    output_file.close()
-
-    convert_txt_to_excel(outfile, final_output_file)
+        diff_writers = {}
+        if previous is not None:
+            for status in diff_counts:
+                diff_writers[status] = stack.enter_context(submission_writer(f"{output_path}/G2P_GenCC_{status}.txt",
+                                                                             f"{output_path}/G2P_GenCC_{status}.xlsx",
+                                                                             header))
+
+        for fields in lines:
+            write(fields)
+            n_lines += 1
+
+            if previous is not None:
+                submission_id = fields[0]
+                status = None
+                if submission_id not in previous:
+                    status = 'new'
+                elif previous.pop(submission_id) != row_hash(fields):
+                    status = 'changed'
+                if status:
+                    diff_writers[status](fields)
+                    diff_counts[status] += 1
+
+        # The lines left in previous are not in the new submission
+        if previous:
+            for fields in read_submission(previous_file):
+                if fields[0] in previous:
+                    diff_writers['removed'](fields)
+                    diff_counts['removed'] += 1
+
+    # The rows of the submission are parsed (files) or fetched (db) while they are transformed
+    phases = metrics['phases']
+    input_phase = "db_fetch" if args.source == "db" else "parse"
+    phases['transform']['seconds'] = max(phases['transform']['seconds'] - phases[input_phase]['seconds'], 0)
+    phases['transform']['rows_in'] = phases[input_phase]['rows_out']
+    print(f"INFO: {phases['transform']['rows_in']} rows, {n_lines} lines, {sum(metrics['skipped'].values())} skipped, {metrics['deduplicated']} duplicated keys")
+
+    if args.diff:
+        print(f"INFO: {n_lines} lines: {diff_counts['new']} new, {diff_counts['changed']} changed, {diff_counts['removed']} removed")
+
+    return { 'path':output_path, 'lines':n_lines, 'diff':diff_counts if args.diff else None }
+
+# Tables of the submission: a change of a table starts a run in the long-running mode
+submission_tables = records_cache_tables + ["genomic_feature_disease_panel", "genomic_feature_disease_panel_log",
+                                            "genomic_feature_disease_publication", "publication",
+                                            "disease_ontology_mapping", "ontology_term"]
+
+def fetch_change_marker(host, port, db, user, password):
+    """
+        Returns the checksums of the tables of the submission (one query), None on error
+    """
+    checksums = None
+
+    connection = db_backend.connect(host=host,
+                                    database=db,
+                                    user=user,
+                                    port=port,
+                                    password=password)
+
+    try:
+        if connection.is_connected():
+            cursor = connection.cursor()
+            checksums = db_backend.table_checksums(cursor, submission_tables)
+            cursor.close()
+
+    except Error as e:
+        print("Error while connecting to MySQL", e)
+    finally:
+        if connection.is_connected():
+            connection.close()
+
+    return checksums
+
+def format_metrics(state):
+    """
+        Returns the metrics of the long-running mode in the Prometheus text format
+    """
+    metrics = [("g2p_gencc_runs_total", "counter", "Number of runs", state['runs']),
+               ("g2p_gencc_run_failures_total", "counter", "Number of failed runs", state['failures']),
+               ("g2p_gencc_running", "gauge", "1 if a run is in progress", int(state['running'])),
+               ("g2p_gencc_last_run_duration_seconds", "gauge", "Duration of the last run", state['last_duration']),
+               ("g2p_gencc_last_run_lines", "gauge", "Number of lines of the last successful run", state['last_lines']),
+               ("g2p_gencc_last_success_timestamp_seconds", "gauge", "Time of the last successful run", state['last_success']),
+               ("g2p_gencc_next_run_timestamp_seconds", "gauge", "Time of the next scheduled run", state['next_run'])]
+
+    lines = []
+    for name, metric_type, description, value in metrics:
+        if value is None:
+            continue
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        lines.append(f"{name} {value}")
+
+    if state.get('last_metrics'):
+        lines.append(format_run_metrics(state['last_metrics']).rstrip("\n"))
+
+    return "\n".join(lines) + "\n"
+
+class HealthHandler(BaseHTTPRequestHandler):
+    """
+        /health: state of the long-running mode (JSON), HTTP 503 if the last run failed
+        /metrics: metrics in the Prometheus text format
+    """
+
+    def do_GET(self):
+        state = self.server.state
+
+        if self.path == "/health":
+            status = 503 if state['last_error'] else 200
+            body = json.dumps({ key:value for key, value in state.items() if key != 'last_metrics' }, default=str).encode("utf-8")
+            content_type = "application/json"
+        elif self.path == "/metrics":
+            status = 200
+            body = format_metrics(state).encode("utf-8")
+            content_type = "text/plain; version=0.0.4"
+        else:
+            status = 404
+            body = b"Not found\n"
+            content_type = "text/plain"
+
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_health_server(state, host="127.0.0.1", port=0):
+    """
+        Starts the health and metrics server in a thread and returns it
+    """
+    server = ThreadingHTTPServer((host, port), HealthHandler)
+    server.state = state
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    return server
+
+def serve(args):
+    """
+        Long-running mode: runs the submission every args.every seconds, and when the checksums
+        of the tables of the submission change (checked every args.poll seconds).
+        The connections to the database are pooled, the G2P records stay in memory between runs.
+    """
+    state = { 'started':time.time(), 'runs':0, 'failures':0, 'running':False, 'last_run':None,
+              'last_duration':None, 'last_lines':None, 'last_success':None, 'last_error':None, 'next_run':time.time() }
+
+    db_backend.set_pool(args.database, 2)
+    server = start_health_server(state, port=args.health_port)
+    print(f"INFO: Health and metrics on http://127.0.0.1:{server.server_address[1]}/health and /metrics")
+
+    marker = None
+    try:
+        while True:
+            if args.poll and time.time() < state['next_run']:
+                current = fetch_change_marker(args.host, args.port, args.database, args.user, args.password)
+                if current is not None and marker is not None and current != marker:
+                    print("INFO: the G2P database changed, starting a run")
+                    state['next_run'] = time.time()
+
+            if time.time() >= state['next_run']:
+                # The marker is read before the run: a change during the run starts another run
+                marker = fetch_change_marker(args.host, args.port, args.database, args.user, args.password) if args.poll else None
+
+                state['running'] = True
+                state['last_run'] = time.time()
+                try:
+                    result = run_submission(args)
+                    state['last_metrics'] = result['metrics']
+                    state['last_lines'] = result['lines']
+                    state['last_success'] = time.time()
+                    state['last_error'] = None
+                except (Exception, SystemExit) as e:
+                    state['failures'] += 1
+                    state['last_error'] = str(e)
+                    print(f"ERROR: GenCC submission failed: {e}")
+                    traceback.print_exc()
+                state['runs'] += 1
+                state['running'] = False
+                state['last_duration'] = time.time() - state['last_run']
+                state['next_run'] = time.time() + args.every
+                print(f"INFO: run done in {state['last_duration']:.2f} s, next run at {datetime.fromtimestamp(state['next_run'])}")
+
+            wait = state['next_run'] - time.time()
+            if args.poll:
+                wait = min(wait, args.poll)
+            time.sleep(max(wait, 0))
+    except KeyboardInterrupt:
+        server.shutdown()
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-p", "--path",
+                    default='/nfs/production/flicek/ensembl/variation/G2P/GenCC_create/',
+                    help="Path where the G2P and GenCC files are going to be saved")
+    ap.add_argument("--host", required=True, help="G2P database host")
+    ap.add_argument("--port", required=True, help="Host port")
+    ap.add_argument("--database", required=True, help="G2P Database name")
+    ap.add_argument("--user", required=True, help="Username for the G2P db")
+    ap.add_argument("--password", default='', help="Password (default: '')")
+    ap.add_argument("--query_stats", action="store_true", help="Report query fingerprint statistics and N+1 queries at exit")
+    ap.add_argument("--query_stats_threshold", type=int, default=100, help="Flag statements executed more than this number of times from the same line (default: 100)")
+    ap.add_argument("--query_stats_file", default=None, help="File to write the query statistics (default: stderr)")
+    ap.add_argument("--source", default="files", choices=["files", "db"], help="files: download the panel files and match them to the G2P records; db: read the records of the panels from the G2P database (default: files)")
+    ap.add_argument("--panels", nargs="+", default=gencc_panels, help=f"Panels of the submission. Only used with --source db (default: {' '.join(gencc_panels)})")
+    ap.add_argument("--diff", action="store_true", help="Also write the lines new, changed and removed since the previous submission (G2P_GenCC_<new|changed|removed>.txt/.xlsx)")
+    ap.add_argument("--previous", default=None, help="Previous submission file (.txt or .xlsx) for --diff (default: the submission of the last dated directory of --path)")
+    ap.add_argument("--download_url", default=download_panels.default_base_url, help=f"URL of the G2P panel files (default: {download_panels.default_base_url})")
+    ap.add_argument("--archive", action="store_true", help="Store the download files once by sha256 in the archive of --path (with a manifest by date) and reuse the parsed rows of unchanged files")
+    ap.add_argument("--download_workers", type=int, default=None, help="Number of panel files downloaded at the same time (default: all)")
+    ap.add_argument("--engine", default="row", choices=["row", "arrow"], help="row: transform the download files row by row; arrow: transform them with pyarrow column operations (needs pyarrow). Only used with --source files (default: row)")
+    ap.add_argument("--records_cache", default=None, help="Cache of the G2P records, refreshed when the checksum of a table changes (default: <path>/g2p_records_cache.json)")
+    ap.add_argument("--no_records_cache", action="store_true", help="Always read the G2P records from the database")
+    ap.add_argument("--parse_workers", type=int, default=os.cpu_count(), help="Number of processes parsing the download files, 1 to parse them in the main process (default: number of CPUs)")
+    ap.add_argument("--db_backend", default="mysql", choices=db_backend.backends, help="Database backend (default: mysql)")
+    ap.add_argument("--sqlite_dir", default=None, help="Directory with the SQLite databases (default: in memory). Only used with --db_backend sqlite")
+    ap.add_argument("--metrics_dir", default=None, help="Directory of the metrics of the run: g2p_gencc.prom (Prometheus textfile collector) and g2p_gencc.json")
+    ap.add_argument("--serve", action="store_true", help="Keep running: run the submission every --every seconds and when the database changes (--poll)")
+    ap.add_argument("--every", type=int, default=None, help="Long-running mode: seconds between two runs (default: 86400). Implies --serve")
+    ap.add_argument("--poll", type=int, default=300, help="Long-running mode: seconds between two checks of the database tables, a change starts a run (0: no checks) (default: 300)")
+    ap.add_argument("--health_port", type=int, default=8767, help="Long-running mode: port of the health and metrics endpoints on localhost (default: 8767)")
+    args = ap.parse_args()
+
+    db_backend.configure(args.db_backend, args.sqlite_dir)
+
+    if args.query_stats:
+        query_stats.install(loop_threshold=args.query_stats_threshold, output_file=args.query_stats_file)
+
+    if args.serve or args.every:
+        args.every = args.every or 86400
+        serve(args)
+    else:
+        run_submission(args)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
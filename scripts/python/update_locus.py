@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+    Updates the G2P genes (locus) to a new Ensembl release.
+
+    The genes in G2P are compared with the Ensembl core db of the new release, using the
+    Ensembl stable id stored in locus_identifier:
+      - locus: sequence, start, end, strand
+      - locus_identifier: Ensembl, HGNC and OMIM identifiers (core xrefs HGNC and MIM_GENE)
+    Only the rows that changed are updated (bulk updates and inserts), the release is saved
+    in the meta table (key 'locus_gene_update').
+    Genes not found in the new release are reported, they are not updated.
+
+    Usage:
+        python update_locus.py --host ... --port ... --database ... --user ... --password ...
+                               --ensembl_host ... --ensembl_port ... --ensembl_database homo_sapiens_core_111_38
+                               --ensembl_user ... [--dry_run]
+"""
+
+import re
+import argparse
+from datetime import datetime
+import pytz
+
+import db_backend
+from db_backend import Error
+import query_stats
+from migrate_data_2024 import fetch_attrib, fetch_source, fetch_core_rows, core_fetch_modes
+
+# G2P source name: Ensembl core external db name
+identifier_sources = { 'HGNC':'HGNC', 'OMIM':'MIM_GENE' }
+
+def dump_g2p_locus(host, port, db, user, password):
+    """
+        Returns the genes of G2P (key: locus id) and the sequences (key: name; value: id)
+    """
+    sql_locus = """ SELECT l.id, l.name, s.name, l.start, l.end, l.strand
+                    FROM locus l
+                    LEFT JOIN sequence s ON s.id = l.sequence_id
+                """
+
+    sql_identifiers = """ SELECT li.id, li.locus_id, li.identifier, s.name
+                          FROM locus_identifier li
+                          LEFT JOIN source s ON s.id = li.source_id
+                          WHERE s.name IN ('Ensembl', 'HGNC', 'OMIM')
+                      """
+
+    sql_sequence = """ SELECT id, name
+                       FROM sequence
+                   """
+
+    loci = {}
+    sequences = {}
+
+    connection = db_backend.connect(host=host,
+                                    database=db,
+                                    user=user,
+                                    port=port,
+                                    password=password)
+
+    try:
+        if connection.is_connected():
+            cursor = connection.cursor()
+            cursor.execute(sql_locus)
+            for row in cursor.fetchall():
+                loci[row[0]] = { 'name':row[1],
+                                 'sequence':row[2],
+                                 'start':row[3],
+                                 'end':row[4],
+                                 'strand':row[5],
+                                 'identifiers':{} } # key: source; value: list of (locus_identifier id, identifier)
+
+            cursor.execute(sql_identifiers)
+            for row in cursor.fetchall():
+                if row[1] in loci:
+                    loci[row[1]]['identifiers'].setdefault(row[3], []).append((row[0], row[2]))
+
+            cursor.execute(sql_sequence)
+            for row in cursor.fetchall():
+                sequences[row[1]] = row[0]
+
+    except Error as e:
+        print("Error while connecting to MySQL", e)
+    finally:
+        if connection.is_connected():
+            cursor.close()
+            connection.close()
+
+    return loci, sequences
+
+def dump_core_genes(ensembl_host, ensembl_port, ensembl_db, ensembl_user, ensembl_password, stable_ids, core_fetch="in_list"):
+    """
+        Returns the coordinates (key: stable id) and the HGNC/MIM_GENE xrefs (key: stable id; value: db name: set of ids)
+        of the genes in the Ensembl core db
+    """
+    sql_genes = """ SELECT g.stable_id, s.name, g.seq_region_start, g.seq_region_end, g.seq_region_strand
+                    FROM gene g
+                    LEFT JOIN seq_region s on s.seq_region_id = g.seq_region_id
+                    WHERE s.coord_system_id = 4"""
+
+    sql_xrefs = """ SELECT g.stable_id, x.dbprimary_acc, e.db_name
+                    FROM gene g
+                    JOIN object_xref ox ON ox.ensembl_id = g.gene_id AND ox.ensembl_object_type = 'Gene'
+                    JOIN xref x ON x.xref_id = ox.xref_id
+                    JOIN external_db e ON e.external_db_id = x.external_db_id
+                    WHERE e.db_name IN ('HGNC', 'MIM_GENE')"""
+
+    genes = {}
+    xrefs = {}
+
+    connection = db_backend.connect(host=ensembl_host,
+                                    database=ensembl_db,
+                                    user=ensembl_user,
+                                    port=ensembl_port,
+                                    password=ensembl_password)
+
+    try:
+        if connection.is_connected():
+            cursor = connection.cursor()
+            for row in fetch_core_rows(cursor, sql_genes, "g.stable_id", stable_ids, core_fetch):
+                if row[0] not in genes:
+                    genes[row[0]] = { 'sequence':row[1],
+                                      'start':row[2],
+                                      'end':row[3],
+                                      'strand':row[4] }
+
+            for row in fetch_core_rows(cursor, sql_xrefs, "g.stable_id", stable_ids, core_fetch):
+                xrefs.setdefault(row[0], {}).setdefault(row[2], set()).add(row[1])
+
+    except Error as e:
+        print("Error while connecting to MySQL", e)
+    finally:
+        if connection.is_connected():
+            cursor.close()
+            connection.close()
+
+    return genes, xrefs
+
+def format_identifier(source, value):
+    if source == 'HGNC' and not value.startswith("HGNC:"):
+        return f"HGNC:{value}"
+
+    return value
+
+def diff_locus(loci, genes, xrefs):
+    """
+        Compares the G2P genes with the new release.
+        Returns the locus rows to update, the identifiers to update and to insert,
+        and the genes not found in the release.
+        An identifier is only changed if the core db has a single value for the gene.
+    """
+    locus_updates = [] # (locus id, sequence name, start, end, strand)
+    identifier_updates = [] # (locus_identifier id, identifier)
+    identifier_inserts = [] # (locus id, identifier, source)
+    missing = []
+
+    for locus_id, locus in loci.items():
+        ensembl_ids = locus['identifiers'].get('Ensembl', [])
+        if len(ensembl_ids) == 0:
+            continue
+        stable_id = ensembl_ids[0][1]
+
+        if stable_id not in genes:
+            missing.append((locus_id, locus['name'], stable_id))
+            continue
+
+        gene = genes[stable_id]
+        if (locus['sequence'], locus['start'], locus['end'], locus['strand']) != (gene['sequence'], gene['start'], gene['end'], gene['strand']):
+            locus_updates.append((locus_id, gene['sequence'], gene['start'], gene['end'], gene['strand']))
+
+        for source, db_name in identifier_sources.items():
+            new_ids = set(format_identifier(source, value) for value in xrefs.get(stable_id, {}).get(db_name, set()))
+            if len(new_ids) != 1:
+                continue
+            new_id = new_ids.pop()
+            current = locus['identifiers'].get(source, [])
+            if len(current) == 0:
+                identifier_inserts.append((locus_id, new_id, source))
+            elif new_id not in [identifier for _, identifier in current]:
+                identifier_updates.append((current[0][0], new_id))
+
+    return locus_updates, identifier_updates, identifier_inserts, missing
+
+def apply_updates(host, port, db, user, password, sequences, locus_updates, identifier_updates, identifier_inserts, ensembl_db, batch_size=1000):
+    sql_sequence = """ INSERT INTO sequence (name, reference_id)
+                       VALUES (%s, %s)
+                   """
+
+    sql_locus = """ UPDATE locus SET sequence_id = %s, start = %s, end = %s, strand = %s
+                    WHERE id = %s
+                """
+
+    sql_identifier = """ UPDATE locus_identifier SET identifier = %s
+                         WHERE id = %s
+                     """
+
+    sql_insert_identifier = """ INSERT INTO locus_identifier (locus_id, identifier, source_id)
+                                VALUES (%s, %s, %s)
+                            """
+
+    sql_update_meta = """ UPDATE meta SET date_update = %s, description = %s, source_id = %s, version = %s
+                          WHERE `key` = 'locus_gene_update'
+                      """
+
+    sql_insert_meta = """ INSERT INTO meta (`key`, date_update, is_public, description, source_id, version)
+                          VALUES (%s, %s, %s, %s, %s, %s)
+                      """
+
+    reference_id = fetch_attrib(host, port, db, user, password, 'grch38')
+    ensembl_source_id = fetch_source(host, port, db, user, password, 'Ensembl')
+    source_ids = { source:fetch_source(host, port, db, user, password, source) for source in identifier_sources }
+    version = re.search("[0-9]+", ensembl_db).group()
+    description = f"Update genes to Ensembl release {version}"
+
+    connection = db_backend.connect(host=host,
+                                    database=db,
+                                    user=user,
+                                    port=port,
+                                    password=password)
+
+    try:
+        if connection.is_connected():
+            cursor = connection.cursor()
+
+            # New sequences
+            for sequence in sorted(set(update[1] for update in locus_updates if update[1] not in sequences)):
+                cursor.execute(sql_sequence, [sequence, reference_id])
+                sequences[sequence] = cursor.lastrowid
+
+            rows = [[sequences[sequence], start, end, strand, locus_id] for locus_id, sequence, start, end, strand in locus_updates]
+            for i in range(0, len(rows), batch_size):
+                cursor.executemany(sql_locus, rows[i:i + batch_size])
+
+            rows = [[identifier, li_id] for li_id, identifier in identifier_updates]
+            for i in range(0, len(rows), batch_size):
+                cursor.executemany(sql_identifier, rows[i:i + batch_size])
+
+            rows = [[locus_id, identifier, source_ids[source]] for locus_id, identifier, source in identifier_inserts]
+            for i in range(0, len(rows), batch_size):
+                cursor.executemany(sql_insert_identifier, rows[i:i + batch_size])
+
+            # Insert or update meta
+            timezone = pytz.timezone("Europe/London")
+            date_obj = datetime.now().replace(microsecond=0)
+            aware_datetime = timezone.localize(date_obj)
+            cursor.execute(sql_update_meta, [aware_datetime, description, ensembl_source_id, version])
+            if cursor.rowcount == 0:
+                cursor.execute(sql_insert_meta, ['locus_gene_update', aware_datetime, 0, description, ensembl_source_id, version])
+
+            connection.commit()
+
+    except Error as e:
+        print("Error while connecting to MySQL", e)
+    finally:
+        if connection.is_connected():
+            cursor.close()
+            connection.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Updates the G2P genes (locus and locus_identifier) to a new Ensembl release")
+    parser.add_argument("--host", required=True, help="G2P Database host")
+    parser.add_argument("--port", required=True, help="G2P Host port")
+    parser.add_argument("--database", required=True, help="G2P Database name")
+    parser.add_argument("--user", required=True, help="G2P Username")
+    parser.add_argument("--password", default='', help="G2P Password (default: '')")
+    parser.add_argument("--ensembl_host", required=True, help="Ensembl core Database host")
+    parser.add_argument("--ensembl_port", required=True, help="Ensembl core Host port")
+    parser.add_argument("--ensembl_database", required=True, help="Ensembl core Database name of the new release")
+    parser.add_argument("--ensembl_user", required=True, help="Ensembl core Username")
+    parser.add_argument("--ensembl_password", default='', help="Ensembl core Password (default: '')")
+    parser.add_argument("--ensembl_fetch", default="in_list", choices=core_fetch_modes, help="How to select the G2P genes in the Ensembl core db (default: in_list)")
+    parser.add_argument("--dry_run", action="store_true", help="Report the changes without updating the G2P database")
+    parser.add_argument("--db_backend", default="mysql", choices=db_backend.backends, help="Database backend (default: mysql)")
+    parser.add_argument("--sqlite_dir", default=None, help="Directory with the SQLite databases (default: in memory). Only used with --db_backend sqlite")
+    parser.add_argument("--query_stats", action="store_true", help="Report query fingerprint statistics and N+1 queries at exit")
+
+    args = parser.parse_args()
+
+    db_backend.configure(args.db_backend, args.sqlite_dir)
+    if args.query_stats:
+        query_stats.install()
+
+    if not re.search("[0-9]+", args.ensembl_database):
+        parser.error(f"--ensembl_database '{args.ensembl_database}' does not include the release number")
+
+    print("INFO: Fetching G2P genes...")
+    loci, sequences = dump_g2p_locus(args.host, args.port, args.database, args.user, args.password)
+    stable_ids = [identifiers[0][1] for identifiers in (locus['identifiers'].get('Ensembl') for locus in loci.values()) if identifiers]
+    print(f"INFO: {len(loci)} genes, {len(stable_ids)} with an Ensembl stable id")
+
+    print(f"INFO: Fetching genes from {args.ensembl_database}...")
+    genes, xrefs = dump_core_genes(args.ensembl_host, args.ensembl_port, args.ensembl_database, args.ensembl_user, args.ensembl_password, stable_ids, args.ensembl_fetch)
+
+    locus_updates, identifier_updates, identifier_inserts, missing = diff_locus(loci, genes, xrefs)
+
+    print(f"INFO: {len(locus_updates)} genes with new coordinates")
+    print(f"INFO: {len(identifier_updates)} identifiers to update, {len(identifier_inserts)} identifiers to add")
+    for locus_id, name, stable_id in missing:
+        print(f"WARNING: {name} ({stable_id}) not found in {args.ensembl_database}")
+
+    if args.dry_run:
+        for locus_id, sequence, start, end, strand in locus_updates:
+            locus = loci[locus_id]
+            print(f"    {locus['name']}: {locus['sequence']}:{locus['start']}-{locus['end']}:{locus['strand']} -> {sequence}:{start}-{end}:{strand}")
+        print("INFO: Dry run, the G2P database was not updated")
+        return
+
+    apply_updates(args.host, args.port, args.database, args.user, args.password, sequences,
+                  locus_updates, identifier_updates, identifier_inserts, args.ensembl_database)
+    print("INFO: Genes updated")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,450 @@
+#!/usr/bin/env python3
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+    Compares the old and the new databases after a migration (migrate_data_2024.py).
+
+    For each entity the data of both schemas is converted to the same tuples, grouped by key
+    (gene symbol or new LGD id) and reduced to one digest (sha256) per key.
+    The digests do not depend on the order of the rows, only the keys with different
+    digests are reported.
+    The old GFDs are aligned to the new LGDs with the mapping saved by the migration (--state_file).
+    The panels, publications and phenotypes of all the GFDs merged into the LGD are expected in the LGD.
+    The GFDs with the same LGD key that the migration does not merge (different confidence or gencc
+    consequences, see populates_lgd) are saved in the state file: they are reported for information
+    and are not mismatches.
+
+    Entities:
+      - gene: identifiers of the gene (Ensembl, HGNC, OMIM)
+      - disease: disease name of the LGD
+      - lgd: gene and genotype of the LGD
+      - panel: panels and confidence of the LGD
+      - publication: PMIDs of the LGD
+      - phenotype: HPO terms of the LGD
+      - history: number of history rows of the LGD, panels and phenotypes
+
+    The entities are compared in parallel, each worker opens its own connections.
+    With the SQLite backend the databases have to be files (--sqlite_dir).
+
+    Usage:
+        python verify_migration.py --host ... --port ... --database ... --user ... --password ...
+                                   --new_host ... --new_port ... --new_database ... --new_user ... --new_password ...
+                                   --state_file migration_state.json [--entities lgd,panel] [--workers 4]
+"""
+
+import sys
+import time
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import db_backend
+from db_backend import Error
+from migrate_data_2024 import ar_mapping, first_set_attrib, load_migration_state, format_disease_name, clean_up_disease_name
+
+# Users whose logs are not migrated to the history tables (populates_history)
+history_excluded_users = ["diana_lemos", "ola_austine", "sarah_hunt"]
+
+def fetch_rows(cursor, sql, params=None):
+    cursor.execute(sql, params)
+    return cursor.fetchall()
+
+def group_by_lgd(rows, context, members=False):
+    """
+        Groups rows (old gfd_id, values...) by the new LGD id.
+        By default only the GFD mapped to the LGD is used (the GFD that created the LGD).
+        With members all the GFDs merged into the LGD are used.
+    """
+    gfd_to_lgd = context['map_old_new_gfd']
+    if members:
+        gfd_to_lgd = context['gfd_to_lgd']
+
+    result = {}
+    for row in rows:
+        lgd_id = gfd_to_lgd.get(row[0])
+        if lgd_id is not None:
+            result.setdefault(lgd_id, set()).add(tuple(row[1:]))
+
+    return result
+
+def merged_gfds(group):
+    """
+        Returns the GFDs merged into the LGD (the GFDs of the group except the ones not merged by populates_lgd)
+    """
+    unmerged = set(group.get('unmerged', []))
+
+    return [gfd_id for gfd_id in group['gfds'] if gfd_id not in unmerged]
+
+def group_by_key(rows):
+    result = {}
+    for row in rows:
+        result.setdefault(row[0], []).append(tuple(row[1:]))
+
+    return result
+
+def old_genes(cursor, context):
+    result = {}
+    for gene_symbol, hgnc_id, mim, stable_id in fetch_rows(cursor, "SELECT gene_symbol, hgnc_id, mim, ensembl_stable_id FROM genomic_feature"):
+        identifiers = result.setdefault(gene_symbol, [])
+        if hgnc_id is not None:
+            identifiers.append(("HGNC", f"HGNC:{hgnc_id}"))
+        if stable_id is not None:
+            identifiers.append(("Ensembl", stable_id))
+        if mim is not None:
+            identifiers.append(("OMIM", mim))
+
+    return result
+
+def new_genes(cursor, context):
+    sql_query = """ SELECT l.name, s.name, i.identifier
+                    FROM locus l
+                    LEFT JOIN locus_identifier i ON i.locus_id = l.id
+                    LEFT JOIN source s ON s.id = i.source_id
+                """
+    result = {}
+    for gene_symbol, source, identifier in fetch_rows(cursor, sql_query):
+        identifiers = result.setdefault(gene_symbol, [])
+        if identifier is not None:
+            identifiers.append((source, identifier))
+
+    return result
+
+def old_diseases(cursor, context):
+    """
+        Disease name of the LGD, formatted as in prepare_lgd().
+        The names are compared after clean_up_disease_name(), the key used to match the new diseases.
+    """
+    sql_query = """ SELECT gfd.genomic_feature_disease_id, d.name, gf.gene_symbol
+                    FROM genomic_feature_disease gfd
+                    LEFT JOIN disease d ON d.disease_id = gfd.disease_id
+                    LEFT JOIN genomic_feature gf ON gf.genomic_feature_id = gfd.genomic_feature_id
+                """
+    rows = []
+    for gfd_id, disease_name, gene_symbol in fetch_rows(cursor, sql_query):
+        new_disease_name = None
+        if disease_name in context['disease_genes']:
+            for disease_name_with_gene in format_disease_name(disease_name, context['disease_genes'][disease_name]):
+                if gene_symbol.lower() in disease_name_with_gene.lower():
+                    new_disease_name = clean_up_disease_name(disease_name_with_gene)
+        rows.append((gfd_id, new_disease_name))
+
+    return group_by_lgd(rows, context)
+
+def new_diseases(cursor, context):
+    sql_query = """ SELECT lgd.id, d.name
+                    FROM locus_genotype_disease lgd
+                    LEFT JOIN disease d ON d.id = lgd.disease_id
+                    WHERE lgd.is_deleted = 0
+                """
+    return group_by_key((lgd_id, clean_up_disease_name(name)) for lgd_id, name in fetch_rows(cursor, sql_query))
+
+def old_lgds(cursor, context):
+    sql_query = """ SELECT gfd.genomic_feature_disease_id, gf.gene_symbol, gfd.allelic_requirement_attrib
+                    FROM genomic_feature_disease gfd
+                    LEFT JOIN genomic_feature gf ON gf.genomic_feature_id = gfd.genomic_feature_id
+                """
+    attribs = { attrib_id:{ 'attrib_value':value } for attrib_id, value in fetch_rows(cursor, "SELECT attrib_id, value FROM attrib") }
+
+    rows = []
+    for gfd_id, gene_symbol, allelic_requirement in fetch_rows(cursor, sql_query):
+        genotype = first_set_attrib(allelic_requirement, attribs)
+        rows.append((gfd_id, gene_symbol, ar_mapping.get(genotype, genotype)))
+
+    return group_by_lgd(rows, context)
+
+def new_lgds(cursor, context):
+    sql_query = """ SELECT lgd.id, l.name, a.value
+                    FROM locus_genotype_disease lgd
+                    LEFT JOIN locus l ON l.id = lgd.locus_id
+                    LEFT JOIN attrib a ON a.id = lgd.genotype_id
+                    WHERE lgd.is_deleted = 0
+                """
+    return group_by_key(fetch_rows(cursor, sql_query))
+
+def old_panels(cursor, context):
+    """
+        Panels of the GFDs of the LGD, the first GFD in a panel sets the confidence (merge_lgd_children)
+    """
+    sql_query = """ SELECT p.genomic_feature_disease_id, a_panel.value, a_conf.value
+                    FROM genomic_feature_disease_panel p
+                    LEFT JOIN attrib a_panel ON a_panel.attrib_id = p.panel_attrib
+                    LEFT JOIN attrib a_conf ON a_conf.attrib_id = p.confidence_category_attrib
+                    WHERE p.panel_attrib != 46
+                """
+    panels = {}
+    for gfd_id, panel, confidence in fetch_rows(cursor, sql_query):
+        panels.setdefault(gfd_id, {})[panel] = confidence
+
+    result = {}
+    for lgd_id, group in context['lgd_groups'].items():
+        lgd_panels = {}
+        for gfd_id in merged_gfds(group):
+            for panel, confidence in panels.get(gfd_id, {}).items():
+                lgd_panels.setdefault(panel, confidence)
+        result[lgd_id] = list(lgd_panels.items())
+
+    return result
+
+def new_panels(cursor, context):
+    sql_query = """ SELECT lp.lgd_id, p.name, a.value
+                    FROM lgd_panel lp
+                    LEFT JOIN locus_genotype_disease lgd ON lgd.id = lp.lgd_id
+                    LEFT JOIN panel p ON p.id = lp.panel_id
+                    LEFT JOIN attrib a ON a.id = lp.relevance_id
+                    WHERE lgd.is_deleted = 0 AND lp.is_deleted = 0
+                """
+    return group_by_key(fetch_rows(cursor, sql_query))
+
+def old_publications(cursor, context):
+    sql_query = """ SELECT gfd.genomic_feature_disease_id, gfd.publication_id, p.pmid
+                    FROM genomic_feature_disease_publication gfd
+                    LEFT JOIN publication p ON p.publication_id = gfd.publication_id
+                """
+    rows = [(gfd_id, pmid) for gfd_id, publication_id, pmid in fetch_rows(cursor, sql_query)
+            if publication_id in context['publications']]
+
+    return group_by_lgd(rows, context, members=True)
+
+def new_publications(cursor, context):
+    sql_query = """ SELECT lp.lgd_id, p.pmid
+                    FROM lgd_publication lp
+                    LEFT JOIN locus_genotype_disease lgd ON lgd.id = lp.lgd_id
+                    LEFT JOIN publication p ON p.id = lp.publication_id
+                    WHERE lgd.is_deleted = 0 AND lp.is_deleted = 0
+                """
+    return group_by_key(fetch_rows(cursor, sql_query))
+
+def old_phenotypes(cursor, context):
+    sql_query = """ SELECT gfd.genomic_feature_disease_id, gfd.phenotype_id, p.stable_id
+                    FROM genomic_feature_disease_phenotype gfd
+                    LEFT JOIN phenotype p ON p.phenotype_id = gfd.phenotype_id
+                """
+    rows = [(gfd_id, accession) for gfd_id, phenotype_id, accession in fetch_rows(cursor, sql_query)
+            if phenotype_id in context['phenotypes']]
+
+    return group_by_lgd(rows, context, members=True)
+
+def new_phenotypes(cursor, context):
+    sql_query = """ SELECT lp.lgd_id, o.accession
+                    FROM lgd_phenotype lp
+                    LEFT JOIN locus_genotype_disease lgd ON lgd.id = lp.lgd_id
+                    LEFT JOIN ontology_term o ON o.id = lp.phenotype_id
+                    WHERE lgd.is_deleted = 0 AND lp.is_deleted = 0
+                """
+    return group_by_key(fetch_rows(cursor, sql_query))
+
+def old_history(cursor, context):
+    """
+        Number of logs migrated to the history tables (populates_history): create and update logs
+        of the GFD mapped to the LGD, except the logs of the excluded users
+    """
+    placeholders = ", ".join(["%s"] * len(history_excluded_users))
+    counts = {}
+    for name, table in [("lgd", "genomic_feature_disease_log"),
+                        ("lgd_panel", "genomic_feature_disease_panel_log"),
+                        ("lgd_phenotype", "GFD_phenotype_log")]:
+        sql_query = f""" SELECT l.genomic_feature_disease_id, l.action, COUNT(*)
+                         FROM {table} l
+                         LEFT JOIN user u ON u.user_id = l.user_id
+                         WHERE l.action IN ('create', 'update') AND (u.username IS NULL OR u.username NOT IN ({placeholders}))
+                         GROUP BY l.genomic_feature_disease_id, l.action
+                     """
+        for gfd_id, action, count in fetch_rows(cursor, sql_query, history_excluded_users):
+            lgd_id = context['map_old_new_gfd'].get(gfd_id)
+            if lgd_id is None:
+                continue
+            key = (lgd_id, name, "+" if action == "create" else "~")
+            counts[key] = counts.get(key, 0) + count
+
+    return group_by_key((lgd_id, name, history_type, count) for (lgd_id, name, history_type), count in counts.items())
+
+def new_history(cursor, context):
+    rows = []
+    for name, sql_query in [("lgd", """ SELECT id, history_type, COUNT(*)
+                                        FROM gene2phenotype_app_historicallocusgenotypedisease
+                                        GROUP BY id, history_type """),
+                            ("lgd_panel", """ SELECT lgd_id, history_type, COUNT(*)
+                                              FROM gene2phenotype_app_historicallgdpanel
+                                              GROUP BY lgd_id, history_type """),
+                            ("lgd_phenotype", """ SELECT lgd_id, history_type, COUNT(*)
+                                                  FROM gene2phenotype_app_historicallgdphenotype
+                                                  GROUP BY lgd_id, history_type """)]:
+        for lgd_id, history_type, count in fetch_rows(cursor, sql_query):
+            rows.append((lgd_id, name, history_type, count))
+
+    return group_by_key(rows)
+
+# key: entity; value: functions that return the tuples by key in the old and in the new db
+entities = { 'gene':(old_genes, new_genes),
+             'disease':(old_diseases, new_diseases),
+             'lgd':(old_lgds, new_lgds),
+             'panel':(old_panels, new_panels),
+             'publication':(old_publications, new_publications),
+             'phenotype':(old_phenotypes, new_phenotypes),
+             'history':(old_history, new_history) }
+
+def normalise(values):
+    """
+        Returns the tuples as sorted strings, the same value has the same string in MySQL and SQLite
+        (e.g. OMIM ids are integers in the old db and strings in the new db)
+    """
+    return sorted("\t".join("\\N" if value is None else str(value) for value in row) for row in values)
+
+def digests(data):
+    """
+        Returns the digest of the tuples of each key, independent of the order of the tuples
+    """
+    result = {}
+    for key, values in data.items():
+        values = normalise(values)
+        if not values:
+            continue
+        result[key] = (hashlib.sha256("\n".join(values).encode("utf-8")).hexdigest(), values)
+
+    return result
+
+def fetch_entity(function, host, port, db, user, password, context):
+    data = {}
+
+    connection = db_backend.connect(host=host,
+                                    database=db,
+                                    user=user,
+                                    port=port,
+                                    password=password)
+
+    try:
+        if connection.is_connected():
+            cursor = connection.cursor()
+            data = function(cursor, context)
+
+    except Error as e:
+        print("Error while connecting to MySQL", e)
+    finally:
+        if connection.is_connected():
+            cursor.close()
+            connection.close()
+
+    return data
+
+def compare_entity(entity, backend, sqlite_dir, old_db, new_db, context):
+    """
+        Runs in a worker: returns the entity, the number of keys, the mismatches
+        (key, old tuples, new tuples) and the run time
+    """
+    start = time.perf_counter()
+    db_backend.configure(backend, sqlite_dir)
+
+    old_function, new_function = entities[entity]
+    old_data = digests(fetch_entity(old_function, *old_db, context))
+    new_data = digests(fetch_entity(new_function, *new_db, context))
+
+    mismatches = []
+    for key in sorted(set(old_data) | set(new_data), key=str):
+        old_digest, old_values = old_data.get(key, (None, []))
+        new_digest, new_values = new_data.get(key, (None, []))
+        if old_digest != new_digest:
+            mismatches.append((key, old_values, new_values))
+
+    return entity, len(set(old_data) | set(new_data)), mismatches, time.perf_counter() - start
+
+def format_values(values, max_values):
+    text = "; ".join(values[:max_values])
+    if len(values) > max_values:
+        text += f"; ... ({len(values)} values)"
+
+    return text if values else "-"
+
+def verify(backend, sqlite_dir, old_db, new_db, state_file, selected_entities, workers, max_report=20, max_values=5):
+    """
+        Compares the selected entities and prints the mismatching keys.
+        Returns the number of mismatches.
+    """
+    state = load_migration_state(state_file)
+    context = { 'map_old_new_gfd':state['map_old_new_gfd'],
+                'lgd_groups':state['lgd_groups'],
+                'gfd_to_lgd':{ gfd_id:lgd_id for lgd_id, group in state['lgd_groups'].items() for gfd_id in merged_gfds(group) },
+                'disease_genes':state['disease_genes'],
+                'publications':set(state['inserted_publications']),
+                'phenotypes':set(state['inserted_phenotypes']) }
+
+    # GFDs not merged by the migration on purpose: not mismatches
+    unmerged = [(lgd_id, group['unmerged']) for lgd_id, group in sorted(state['lgd_groups'].items()) if group.get('unmerged')]
+    if unmerged:
+        print(f"INFO: {sum(len(gfd_ids) for lgd_id, gfd_ids in unmerged)} GFDs not merged into the LGD with the same key "
+              "(different confidence or gencc consequences), their panels, publications and phenotypes are not compared")
+        for lgd_id, gfd_ids in unmerged[:max_report]:
+            print(f"    LGD {lgd_id} (GFD {', '.join(str(gfd_id) for gfd_id in gfd_ids)} not merged)")
+        if len(unmerged) > max_report:
+            print(f"    ... {len(unmerged) - max_report} more")
+
+    total = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(compare_entity, entity, backend, sqlite_dir, old_db, new_db, context)
+                   for entity in selected_entities]
+        for future in futures:
+            entity, n_keys, mismatches, run_time = future.result()
+            total += len(mismatches)
+            print(f"INFO: {entity}: {n_keys} keys, {len(mismatches)} mismatches ({run_time:.2f} s)")
+            for key, old_values, new_values in mismatches[:max_report]:
+                label = key
+                if entity != 'gene':
+                    group = context['lgd_groups'].get(key, { 'gfds':[] })
+                    label = f"LGD {key} (GFD {', '.join(str(gfd_id) for gfd_id in group['gfds']) or '-'})"
+                print(f"    {label}\n        old: {format_values(old_values, max_values)}\n        new: {format_values(new_values, max_values)}")
+            if len(mismatches) > max_report:
+                print(f"    ... {len(mismatches) - max_report} more")
+
+    return total
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares the old and the new G2P databases after the migration")
+    parser.add_argument("--host", required=True, help="Database host")
+    parser.add_argument("--port", required=True, help="Host port")
+    parser.add_argument("--database", required=True, help="Database name")
+    parser.add_argument("--user", required=True, help="Username")
+    parser.add_argument("--password", default='', help="Password (default: '')")
+    parser.add_argument("--new_host", required=True, help="New Database host")
+    parser.add_argument("--new_port", required=True, help="New Host port")
+    parser.add_argument("--new_database", required=True, help="New Database name")
+    parser.add_argument("--new_user", required=True, help="New Username")
+    parser.add_argument("--new_password", default='', help="New Password (default: '')")
+    parser.add_argument("--state_file", required=True, help="State file written by the migration (migrate_data_2024.py --state_file)")
+    parser.add_argument("--entities", default=",".join(entities), help=f"Entities to compare (default: {','.join(entities)})")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes (default: number of CPUs)")
+    parser.add_argument("--max_report", type=int, default=20, help="Maximum number of mismatches printed by entity (default: 20)")
+    parser.add_argument("--db_backend", default="mysql", choices=db_backend.backends, help="Database backend (default: mysql)")
+    parser.add_argument("--sqlite_dir", default=None, help="Directory with the SQLite databases. Required with --db_backend sqlite")
+
+    args = parser.parse_args()
+
+    selected_entities = [entity.strip() for entity in args.entities.split(",") if entity.strip()]
+    for entity in selected_entities:
+        if entity not in entities:
+            sys.exit(f"ERROR: Unknown entity '{entity}', use: {', '.join(entities)}")
+
+    if args.db_backend == "sqlite" and args.sqlite_dir is None:
+        sys.exit("ERROR: --sqlite_dir is required with --db_backend sqlite (the workers can't share in-memory databases)")
+
+    old_db = (args.host, args.port, args.database, args.user, args.password)
+    new_db = (args.new_host, args.new_port, args.new_database, args.new_user, args.new_password)
+
+    start = time.perf_counter()
+    total = verify(args.db_backend, args.sqlite_dir, old_db, new_db, args.state_file, selected_entities, args.workers, args.max_report)
+    print(f"INFO: {total} mismatches in {time.perf_counter() - start:.2f} s")
+
+    if total:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()